@@ -0,0 +1,78 @@
+#!/usr/bin/env python2
+
+"""
+Measure depth update throughput of the OrderBook.
+
+usage: depth_update.py [levels] [updates]
+
+A synthetic book with the given number of levels per side (default 20000)
+is loaded and then the given number of random depth messages (default
+200000) is fed through OrderBook.slot_depth(). About half of the updates
+change existing levels, the rest insert or remove levels, most of them
+near the top of the book like in the real feed.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import goxapi # pylint: disable=F0401
+
+
+class FakeGox(object):
+    """just enough of goxapi.Gox for an OrderBook"""
+    # pylint: disable=R0903
+    def __init__(self):
+        self.currency = "USD"
+        self.signal_ticker = goxapi.Signal()
+        self.signal_depth_stamped = goxapi.Signal()
+        self.signal_trade = goxapi.Signal()
+        self.signal_userorder = goxapi.Signal()
+        self.signal_fulldepth = goxapi.Signal()
+        self.signal_partialdepth = goxapi.Signal()
+
+def make_book(compact, levels):
+    """create an orderbook with levels on each side around 100 USD"""
+    book = goxapi.OrderBook(FakeGox(), compact)
+    book.totals_check_interval = 0
+    book.asks.load((10000000 + i * 10, 100000000) for i in range(levels))
+    book.bids.load((9999990 - i * 10, 100000000) for i in range(levels))
+    book.check_totals() # initializes the totals
+    return book
+
+def make_updates(levels, count):
+    """create a list of random depth messages"""
+    rnd = random.Random(42)
+    updates = []
+    for dummy in xrange(count):
+        distance = int(rnd.expovariate(1.0 / 500)) % levels
+        if rnd.random() < 0.5:
+            typ, price = "ask", 10000000 + distance * 5
+        else:
+            typ, price = "bid", 9999990 - distance * 5
+        volume = rnd.choice([0, 0, rnd.randint(1, 1000) * 100000])
+        updates.append((typ, price, 0, volume, 0))
+    return updates
+
+def main():
+    """run the benchmark and print the results"""
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    updates = make_updates(levels, count)
+    print("levels per side: %d, updates: %d" % (levels, count))
+    print("%-16s %12s %14s" % ("mode", "updates/s", "check_totals ms"))
+    for name, compact in [("BookSide", False), ("CompactBookSide", True)]:
+        book = make_book(compact, levels)
+        time_start = time.time()
+        for update in updates:
+            book.slot_depth(None, update)
+        duration = time.time() - time_start
+        (drift_ask, drift_bid, check) = book.check_totals()
+        assert (drift_ask, drift_bid) == (0, 0)
+        print("%-16s %12d %14.2f" % (name, count / duration, check * 1000))
+
+
+if __name__ == "__main__":
+    main()
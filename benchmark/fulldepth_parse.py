@@ -0,0 +1,130 @@
+#!/usr/bin/env python2
+
+"""
+Compare loading the fulldepth snapshot into the orderbook with one
+json.loads() over the whole response and with the streaming
+FulldepthParser.
+
+usage: fulldepth_parse.py [fulldepth.json.gz]
+
+The file is a recorded (gzipped) response of money/depth/full. If no file
+is given a synthetic one with 20000 levels per side is used. Every mode
+runs in a forked child process so its peak memory (maxrss) can be
+measured; the baseline is a child that only reads the compressed file.
+"""
+
+import gzip
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import goxapi # pylint: disable=F0401
+
+
+class FakeGox(object):
+    """just enough of goxapi.Gox for an OrderBook"""
+    # pylint: disable=R0903
+    def __init__(self):
+        self.currency = "USD"
+        self.signal_ticker = goxapi.Signal()
+        self.signal_depth_stamped = goxapi.Signal()
+        self.signal_trade = goxapi.Signal()
+        self.signal_userorder = goxapi.Signal()
+        self.signal_fulldepth = goxapi.Signal()
+        self.signal_partialdepth = goxapi.Signal()
+
+def synthetic_gz(levels):
+    """gzipped fulldepth response with all the fields mtgox sends"""
+    rnd = random.Random(42)
+    def side(start, step):
+        """levels starting at start, prices step apart"""
+        result = []
+        for i in range(levels):
+            price = start + i * step
+            amount = rnd.randint(1, 10000) * 100000
+            result.append({"price": price / 1E5, "amount": amount / 1E8,
+                "price_int": str(price), "amount_int": str(amount),
+                "stamp": str(1366000000000000 + i)})
+        return result
+    depth = {"result": "success", "data": {
+        "now": "1366641543431424", "cached": "1366641543431424",
+        "asks": side(10000000, 10),
+        "bids": list(reversed(side(9999990, -10))),
+        "filter_min_price": {"value_int": "5000000"},
+        "filter_max_price": {"value_int": "20000000"}}}
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as zipped:
+        zipped.write(json.dumps(depth))
+    return buf.getvalue()
+
+def load_baseline(dummy_compressed):
+    """only the compressed data"""
+    return None
+
+def load_json(compressed):
+    """the old way: unzip all, parse all, then build the book"""
+    with io.BytesIO(compressed) as buf:
+        with gzip.GzipFile(fileobj=buf) as unzipped:
+            text = unzipped.read()
+    gox = FakeGox()
+    book = goxapi.OrderBook(gox)
+    gox.signal_fulldepth(gox, json.loads(text))
+    return book
+
+def load_streaming(compressed):
+    """decompress and parse in 64 KiB pieces like they arrive"""
+    gox = FakeGox()
+    book = goxapi.OrderBook(gox)
+    parser = goxapi.FulldepthParser()
+    decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for pos in xrange(0, len(compressed), 65536):
+        parser.feed(decompress.decompress(compressed[pos:pos + 65536]))
+    parser.feed(decompress.flush())
+    gox.signal_fulldepth(gox, parser.close())
+    return book
+
+def measure(func, filename):
+    """run func in a child process, return (seconds, maxrss KiB, levels)"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        with open(filename, "rb") as depth_file:
+            compressed = depth_file.read()
+        time_start = time.time()
+        book = func(compressed)
+        duration = time.time() - time_start
+        levels = len(book.asks) + len(book.bids) if book else 0
+        os.write(write_fd, "%f %d" % (duration, levels))
+        os._exit(0) # pylint: disable=W0212
+    os.close(write_fd)
+    result = os.read(read_fd, 100).split()
+    os.close(read_fd)
+    usage = os.wait4(pid, 0)[2]
+    return float(result[0]), usage.ru_maxrss, int(result[1])
+
+def main():
+    """run the benchmark and print the results"""
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = "/tmp/fulldepth_synthetic.json.gz"
+        with open(filename, "wb") as depth_file:
+            depth_file.write(synthetic_gz(20000))
+    dummy, base_rss, dummy = measure(load_baseline, filename)
+    print("file: %s (%d bytes)" % (filename, os.path.getsize(filename)))
+    print("%-12s %8s %10s %14s" % ("mode", "levels", "time ms", "peak MiB"))
+    for name, func in [("json.loads", load_json),
+                       ("streaming", load_streaming)]:
+        duration, rss, levels = measure(func, filename)
+        print("%-12s %8d %10.1f %14.1f" % (name, levels, duration * 1000,
+            (rss - base_rss) / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
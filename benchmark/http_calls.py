@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+
+"""
+Measure throughput of signed HTTP API calls (use_http_api mode).
+
+usage: http_calls.py [calls] [latency_ms]
+
+A local stub HTTP server answers every call after the given latency
+(default 50 ms) to simulate the round trip to the exchange. The given
+number of order adds (default 200) is enqueued at once and the time
+until all results have arrived is measured for different numbers of
+http_workers. The requests are sent one after the other, only their
+responses are awaited in parallel (at most http_endpoint_concurrency
+per endpoint). The server also counts nonces that are lower than one it
+has already seen. It checks them in its handler threads, so some of
+these are caused by its own thread scheduling, real ones are retried
+by goxapi with a new nonce.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import sys
+import threading
+import time
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import goxapi # pylint: disable=F0401
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """answer every signed call with success after some latency"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        """handle a signed call"""
+        post = self.rfile.read(int(self.headers["Content-Length"]))
+        nonce = int(urlparse.parse_qs(post)["nonce"][0])
+        self.server.check_nonce(nonce)
+        time.sleep(self.server.latency)
+        body = json.dumps({"result": "success", "data": "ok"})
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """threaded server that counts nonces arriving out of order"""
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.last_nonce = 0
+        self.out_of_order = 0
+
+    def check_nonce(self, nonce):
+        """the exchange would reject a nonce lower than the last one"""
+        with self.lock:
+            if nonce <= self.last_nonce:
+                self.out_of_order += 1
+            self.last_nonce = max(nonce, self.last_nonce)
+
+class FakeSecret(object):
+    """a secret that is always known"""
+    # pylint: disable=R0903
+    key = "00000000-0000-0000-0000-000000000000"
+    secret = "c2VjcmV0"
+
+    def know_secret(self):
+        """yes"""
+        return True
+
+class FakeConfig(object):
+    """plain http, the given number of workers"""
+
+    def __init__(self, workers):
+        self.workers = workers
+
+    def get_bool(self, dummy_sect, opt):
+        """all options off"""
+        return False
+
+    def get_int(self, dummy_sect, opt):
+        """number of workers, default endpoint limit"""
+        return {"http_workers": self.workers,
+                "http_endpoint_concurrency": 2}.get(opt, 0)
+
+def run(workers, calls):
+    """enqueue calls order adds, return the time until all are answered"""
+    client = goxapi.WebsocketClient("USD", FakeSecret(), FakeConfig(workers))
+    client._connect_socket = lambda: time.sleep(1000) # pylint: disable=W0212
+    done = threading.Event()
+    received = []
+    def slot_recv(dummy_sender, dummy_data):
+        """count the results"""
+        received.append(1)
+        if len(received) == calls:
+            done.set()
+    client.signal_recv.connect(slot_recv)
+    client.start()
+    time_start = time.time()
+    for i in range(calls):
+        client.enqueue_http_request("BTCUSD/money/order/add",
+            {"type": "bid", "price_int": 10000000, "amount_int": i}, i)
+    done.wait(600)
+    duration = time.time() - time_start
+    client.stop()
+    return duration
+
+def main():
+    """run the benchmark and print the results"""
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    server = StubServer(latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    goxapi.HTTP_HOST = "127.0.0.1:%d" % server.server_port
+
+    print("calls: %d, latency: %d ms" % (calls, latency * 1000))
+    print("%8s %10s %8s %12s" % ("workers", "calls/s", "reused", "out of order"))
+    for workers in [1, 2, 4, 8]:
+        goxapi.HTTP_POOL = goxapi.HTTPConnectionPool(workers)
+        server.out_of_order = 0
+        duration = run(workers, calls)
+        stats = goxapi.HTTP_POOL.stats()
+        goxapi.HTTP_POOL.close_all()
+        print("%8d %10.1f %8d %12d" % (workers, calls / duration,
+            stats["reused"], server.out_of_order))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,739 @@
+#!/usr/bin/env python2
+
+"""
+A local stand-in for the MtGox servers, for load testing reconnects,
+order round trips and the HTTP API without touching the real exchange.
+
+usage: mtgox_stub.py [options]   (see --help)
+
+One port serves everything goxapi talks to:
+
+  GET  /socket.io/1                      socket.io 1 handshake
+  GET  /socket.io/1/websocket/<sid>      socket.io over websocket
+  GET  /mtgox                            plain websocket
+  GET  /api/2/BTCxxx/money/depth/full    full depth (gzipped if accepted)
+  GET  /api/2/BTCxxx/money/depth/fetch   depth around the current price
+  GET  /api/2/BTCxxx/money/trades        trades, optionally ?since=tid
+  GET  /api/2/BTCxxx/money/ticker        ticker (also ticker_fast)
+  POST /api/2/.../money/...              signed calls: idkey, orders, info,
+                                         order/add, order/cancel
+
+A simulated market generates depth, trade and ticker messages at the
+given rates and sends them to all streaming clients. Every client can
+lose a fraction of the messages (--drop), get them late (--lag) and be
+disconnected after some time (--disconnect). The signatures of all
+signed calls are checked against KEY and SECRET (printed at startup),
+nonces that don't increase are counted (and rejected with
+--strict-nonce). To point goxtool at the stub start it with
+
+  goxtool.py --server 127.0.0.1:<port>
+
+which also switches off SSL, and add the stub's key and secret with
+--add-secret. From Python set goxapi.SOCKETIO_HOST, WEBSOCKET_HOST and
+HTTP_HOST to "127.0.0.1:<port>", goxapi.FORCE_NO_SSL to True.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import base64
+import collections
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import os
+import Queue
+import random
+import struct
+import sys
+import threading
+import time
+import urlparse
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import websocket # pylint: disable=F0401
+
+KEY = "00000000-0000-0000-0000-000000000000"
+SECRET = base64.b64encode("mtgox stub secret")
+
+CHANNEL_DEPTH = "24e67e0d-1cad-4cc0-9e7a-f8523ef460fe"
+CHANNEL_TRADE = "dbf1dee9-4f2e-4a08-8cb7-748919a71b21"
+CHANNEL_TICKER = "d5f06780-30a8-4a48-a2f8-7ed181b4a13f"
+CHANNEL_LAG = "85174711-be64-4de1-b783-0628995d7914"
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# price and volume units of the integer values
+PRICE_UNIT = {"JPY": 1E3, "SEK": 1E3}
+BTC_UNIT = 1E8
+
+
+def money(value_int, currency):
+    """the value object MtGox uses in tickers and filters"""
+    unit = PRICE_UNIT.get(currency, 1E5)
+    return {"value": "%.5f" % (value_int / unit), "value_int": str(value_int),
+        "display": "%.5f %s" % (value_int / unit, currency),
+        "currency": currency}
+
+
+class Market:
+    """a random walk of an orderbook with trades. All methods are thread
+    safe, the messages they return are dicts ready to be sent"""
+
+    def __init__(self, currency, levels, seed=None):
+        self.currency = currency
+        self.lock = threading.Lock()
+        self.rnd = random.Random(seed)
+        self.unit = int(PRICE_UNIT.get(currency, 1E5))
+        self.tick = self.unit / 100 # one cent
+        middle = 100 * self.unit
+        self.asks = {}
+        self.bids = {}
+        for i in range(levels):
+            self.asks[middle + (i + 1) * self.tick] = self._random_volume()
+            self.bids[middle - i * self.tick] = self._random_volume()
+        self.trades = collections.deque(maxlen=10000)
+        self._last_now = 0
+
+    def _random_volume(self):
+        """a random volume between 0.01 and 10 BTC"""
+        return self.rnd.randint(1, 1000) * 1000000
+
+    def now(self):
+        """microsecond timestamp, strictly increasing"""
+        self._last_now = max(self._last_now + 1, int(time.time() * 1E6))
+        return self._last_now
+
+    def best(self):
+        """return (bid, ask)"""
+        return max(self.bids), min(self.asks)
+
+    def depth_message(self, typ, price, voldiff, total):
+        """streaming depth message for a changed level"""
+        return {"channel": CHANNEL_DEPTH, "op": "private",
+            "origin": "broadcast", "private": "depth", "depth": {
+                "price": "%.5f" % (float(price) / self.unit),
+                "type": {"ask": 1, "bid": 2}[typ], "type_str": typ,
+                "volume": "%.8f" % (voldiff / BTC_UNIT),
+                "price_int": str(price), "volume_int": str(voldiff),
+                "item": "BTC", "currency": self.currency,
+                "now": str(self.now()), "total_volume_int": str(total)}}
+
+    def step_depth(self):
+        """change a random level, mostly near the top of the book"""
+        with self.lock:
+            bid, ask = self.best()
+            distance = int(self.rnd.expovariate(1.0 / 20)) * self.tick
+            if self.rnd.random() < 0.5:
+                typ, side, price = "ask", self.asks, ask + distance
+            else:
+                typ, side, price = "bid", self.bids, bid - distance
+            old = side.get(price, 0)
+            if old and self.rnd.random() < 0.3 and len(side) > 1:
+                new = 0
+                del side[price]
+            else:
+                new = self._random_volume()
+                side[price] = new
+            return [self.depth_message(typ, price, new - old, new)]
+
+    def step_trade(self):
+        """fill (a part of) the best bid or ask"""
+        with self.lock:
+            if self.rnd.random() < 0.5:
+                trade_type, typ, side = "bid", "ask", self.asks
+                price = min(side)
+            else:
+                trade_type, typ, side = "ask", "bid", self.bids
+                price = max(side)
+            old = side[price]
+            amount = min(old, self._random_volume())
+            if amount == old and len(side) > 1:
+                del side[price]
+            else:
+                side[price] = old - amount
+            tid = self.now()
+            trade = {"type": "trade", "date": int(tid / 1E6),
+                "amount": amount / BTC_UNIT,
+                "price": float(price) / self.unit, "tid": str(tid),
+                "amount_int": str(amount), "price_int": str(price),
+                "item": "BTC", "price_currency": self.currency,
+                "trade_type": trade_type, "primary": "Y",
+                "properties": "limit"}
+            self.trades.append(trade)
+            return [{"channel": CHANNEL_TRADE, "op": "private",
+                "origin": "broadcast", "private": "trade", "trade": trade},
+                self.depth_message(typ, price, -amount, side.get(price, 0))]
+
+    def ticker(self):
+        """streaming ticker message (the data is also the HTTP ticker)"""
+        with self.lock:
+            bid, ask = self.best()
+            return {"channel": CHANNEL_TICKER, "op": "private",
+                "origin": "broadcast", "private": "ticker",
+                "ticker": self._ticker_data(bid, ask)}
+
+    def _ticker_data(self, bid, ask):
+        """the ticker fields"""
+        last = self.trades[-1]["price_int"] if self.trades else bid
+        data = dict((name, money(int(last), self.currency))
+            for name in ("high", "low", "avg", "vwap", "last",
+                         "last_local", "last_orig", "last_all"))
+        data["buy"] = money(bid, self.currency)
+        data["sell"] = money(ask, self.currency)
+        data["vol"] = {"value": "1000.00000000",
+            "value_int": "100000000000", "display": "1,000.00 BTC",
+            "currency": "BTC"}
+        data["item"] = "BTC"
+        data["now"] = str(self.now())
+        return data
+
+    def http_ticker(self):
+        """data of money/ticker"""
+        with self.lock:
+            bid, ask = self.best()
+            return self._ticker_data(bid, ask)
+
+    def depth(self, low=None, high=None):
+        """data of money/depth/full (or fetch if low and high are given)"""
+        with self.lock:
+            now = str(self.now())
+            def levels(side, reverse):
+                """the levels within the range, sorted by price"""
+                return [{"price": float(price) / self.unit,
+                    "amount": side[price] / BTC_UNIT,
+                    "price_int": str(price), "amount_int": str(side[price]),
+                    "stamp": now}
+                    for price in sorted(side, reverse=reverse)
+                    if (low is None or low <= price <= high)]
+            asks = levels(self.asks, False)
+            bids = levels(self.bids, False)
+            bid, ask = self.best()
+        data = {"now": now, "cached": now, "asks": asks, "bids": bids}
+        if low is not None:
+            data["filter_min_price"] = money(low, self.currency)
+            data["filter_max_price"] = money(high, self.currency)
+        else:
+            data["filter_min_price"] = money(bid / 2, self.currency)
+            data["filter_max_price"] = money(ask * 2, self.currency)
+        return data
+
+    def trades_since(self, since):
+        """data of money/trades"""
+        with self.lock:
+            return [trade for trade in self.trades
+                if int(trade["tid"]) > since]
+
+
+class Account:
+    """the orders of the stub's only account and the nonce check"""
+
+    def __init__(self, currency, strict_nonce):
+        self.currency = currency
+        self.strict_nonce = strict_nonce
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.last_nonce = 0
+        self.count_calls = 0
+        self.count_bad_nonce = 0
+        self.count_bad_sign = 0
+
+    def check(self, key, sign, message, nonce):
+        """check signature and nonce, return an error text or None. Nonces
+        that are not higher than the last one are counted, they are only
+        rejected with --strict-nonce because concurrent requests can be
+        processed in a different order than they were sent"""
+        expected = hmac.new(base64.b64decode(SECRET), message,
+            hashlib.sha512).digest()
+        with self.lock:
+            self.count_calls += 1
+            if key != KEY or sign != expected:
+                self.count_bad_sign += 1
+                return "Invalid signature"
+            if nonce <= self.last_nonce:
+                self.count_bad_nonce += 1
+                if self.strict_nonce:
+                    return "Invalid nonce"
+            self.last_nonce = max(nonce, self.last_nonce)
+        return None
+
+    def call(self, endpoint, params):
+        """execute an API call, return (result, user_order message or None)
+        or raise KeyError("Order not found")"""
+        name = endpoint.split("/")[-1]
+        prev = endpoint.split("/")[-2] if "/" in endpoint else ""
+        if name == "idkey":
+            return "idkey-" + KEY, None
+        if name == "orders":
+            with self.lock:
+                return [self._order_data(order)
+                    for order in self.orders.values()], None
+        if name == "info":
+            return {"Wallets": {
+                "BTC": {"Balance": {"value_int": "10000000000"}},
+                self.currency: {"Balance": {"value_int": "100000000000"}}}
+            }, None
+        if name == "lag":
+            return {"lag": 1000, "lag_secs": 0.001, "lag_text": "0.001"}, None
+        if prev == "order" and name == "add":
+            oid = str(uuid.uuid4())
+            order = {"oid": oid, "type": params["type"],
+                "price": int(params.get("price_int", 0)),
+                "amount": int(params["amount_int"])}
+            with self.lock:
+                self.orders[oid] = order
+            return oid, self._user_order(self._order_data(order))
+        if prev == "order" and name == "cancel":
+            with self.lock:
+                if not params["oid"] in self.orders:
+                    raise KeyError("Order not found")
+                del self.orders[params["oid"]]
+            return {"oid": params["oid"], "qid": str(uuid.uuid4())}, \
+                self._user_order({"oid": params["oid"]})
+        raise KeyError("Unknown call: %s" % endpoint)
+
+    def _order_data(self, order):
+        """an order like in private/orders and user_order messages"""
+        return {"oid": order["oid"], "currency": self.currency,
+            "item": "BTC", "type": order["type"],
+            "amount": money(order["amount"], "BTC"),
+            "effective_amount": money(order["amount"], "BTC"),
+            "price": money(order["price"], self.currency),
+            "status": "open", "date": int(time.time()), "priority": "0",
+            "actions": []}
+
+    @staticmethod
+    def _user_order(data):
+        """the streaming message for an order change"""
+        return {"op": "private", "origin": "broadcast",
+            "private": "user_order", "channel": "idkey-" + KEY,
+            "user_order": data}
+
+
+class Session:
+    """one streaming client. Messages are put into its queue and sent by
+    its own thread, after the configured lag, some of them dropped."""
+
+    def __init__(self, server, handler, socketio):
+        self.server = server
+        self.handler = handler
+        self.socketio = socketio
+        self.subscribed_key = False
+        self.closed = False
+        self.count_sent = 0
+        self.count_dropped = 0
+        self._queue = Queue.Queue(100000)
+        self._send_lock = threading.Lock()
+        self._time_start = time.time()
+
+    def put(self, msg):
+        """queue a message dict for sending"""
+        try:
+            self._queue.put_nowait((time.time(), json.dumps(msg)))
+        except Queue.Full:
+            self.count_dropped += 1
+
+    def send_frame(self, payload, opcode=websocket.ABNF.OPCODE_TEXT):
+        """send an unmasked frame"""
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 0x10000:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self.handler.wfile.write(header + payload)
+            self.handler.wfile.flush()
+
+    def send_json(self, text):
+        """send a json message with or without the socket.io framing"""
+        if self.socketio:
+            text = "4::/mtgox:" + text
+        self.send_frame(text)
+
+    def sender_func(self):
+        """the sender thread, also sends socket.io heartbeats"""
+        options = self.server.options
+        time_heartbeat = time.time()
+        try:
+            while not self.closed:
+                if options.disconnect and \
+                        time.time() - self._time_start > options.disconnect:
+                    break
+                if self.socketio and time.time() - time_heartbeat > 15:
+                    time_heartbeat = time.time()
+                    self.send_frame("2::")
+                try:
+                    (time_put, text) = self._queue.get(True, 0.5)
+                except Queue.Empty:
+                    continue
+                if options.drop and random.random() < options.drop:
+                    self.count_dropped += 1
+                    continue
+                delay = time_put + options.lag / 1000.0 - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self.send_json(text)
+                self.count_sent += 1
+        except (IOError, OSError):
+            pass
+        self.close()
+
+    def close(self):
+        """close the connection, the reader will notice"""
+        if not self.closed:
+            self.closed = True
+            try:
+                self.send_frame(struct.pack("!H", 1000),
+                    websocket.ABNF.OPCODE_CLOSE)
+            except (IOError, OSError):
+                pass
+            try:
+                self.handler.connection.shutdown(2)
+            except (IOError, OSError):
+                pass
+
+    def read_frame(self):
+        """read a (masked) client frame, return (opcode, payload)"""
+        rfile = self.handler.rfile
+        header = rfile.read(2)
+        if len(header) < 2:
+            raise IOError("closed")
+        b1, b2 = struct.unpack("!BB", header)
+        length = b2 & 0x7f
+        if length == 126:
+            length = struct.unpack("!H", rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", rfile.read(8))[0]
+        mask_key = rfile.read(4) if b2 & 0x80 else None
+        payload = rfile.read(length)
+        if len(payload) < length:
+            raise IOError("closed")
+        if mask_key:
+            payload = websocket.ABNF.mask(mask_key, payload)
+        return b1 & 0x0f, payload
+
+    def run(self):
+        """read and answer the client's messages until it disconnects"""
+        if self.socketio:
+            self.send_frame("1::")
+        thread = threading.Thread(target=self.sender_func)
+        thread.daemon = True
+        thread.start()
+        self.server.add_session(self)
+        try:
+            while not self.closed:
+                opcode, payload = self.read_frame()
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    break
+                if opcode == websocket.ABNF.OPCODE_PING:
+                    self.send_frame(payload, websocket.ABNF.OPCODE_PONG)
+                    continue
+                if self.socketio:
+                    if payload == "1::/mtgox":
+                        self.send_frame("1::/mtgox")
+                    elif payload.startswith("4::/mtgox:"):
+                        self.handle_json(payload[10:])
+                else:
+                    self.handle_json(payload)
+        except (IOError, OSError, struct.error):
+            pass
+        self.server.remove_session(self)
+        self.close()
+
+    def handle_json(self, text):
+        """handle an op sent by the client"""
+        msg = json.loads(text)
+        if msg.get("op") == "mtgox.subscribe":
+            if msg.get("key") == "idkey-" + KEY:
+                self.subscribed_key = True
+            elif msg.get("type") == "lag":
+                self.put({"op": "subscribe", "channel": CHANNEL_LAG})
+        elif msg.get("op") == "call":
+            self.handle_call(msg)
+
+    def handle_call(self, msg):
+        """handle a signed call: key (16 bytes), signature (64 bytes) and
+        the JSON of the call, base64 encoded"""
+        signed = base64.b64decode(msg["call"])
+        key = "-".join([signed[:16].encode("hex")[i:j] for i, j in
+            ((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))])
+        call = json.loads(signed[80:])
+        error = self.server.account.check(key, signed[16:80], signed[80:],
+            int(call["nonce"]))
+        if error:
+            self.put({"op": "remark", "success": False, "message": error,
+                "id": msg["id"]})
+            return
+        try:
+            result, user_order = self.server.account.call(
+                call["call"], call["params"])
+        except KeyError as exc:
+            self.put({"op": "remark", "success": False,
+                "message": exc.args[0], "id": msg["id"]})
+            return
+        self.put({"op": "result", "id": msg["id"], "result": result})
+        if user_order:
+            self.server.send_user_order(user_order)
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP API, socket.io handshake and websocket upgrade"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """everything but the signed calls"""
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            self.upgrade(url.path.startswith("/socket.io/"))
+        elif url.path == "/socket.io/1":
+            self.socketio_handshake()
+        elif url.path.startswith("/api/2/"):
+            self.api_get(url.path[len("/api/2/"):], query)
+        else:
+            self.send_json(404, {"result": "error", "error": "Not found"})
+
+    def do_POST(self):
+        """signed API calls"""
+        post = self.rfile.read(int(self.headers["Content-Length"]))
+        endpoint = urlparse.urlparse(self.path).path[len("/api/2/"):]
+        params = dict((name, values[0]) for name, values
+            in urlparse.parse_qs(post).items())
+        sign = base64.b64decode(self.headers.get("Rest-Sign", ""))
+        error = self.server.account.check(self.headers.get("Rest-Key"),
+            sign, endpoint + chr(0) + post, int(params.get("nonce", 0)))
+        if error:
+            self.send_json(403, {"result": "error", "error": error})
+            return
+        self.http_lag()
+        try:
+            result, user_order = self.server.account.call(endpoint, params)
+        except KeyError as exc:
+            self.send_json(200, {"result": "error", "error": exc.args[0]})
+            return
+        self.send_json(200, {"result": "success", "data": result})
+        if user_order:
+            self.server.send_user_order(user_order)
+
+    def http_lag(self):
+        """wait --http-lag milliseconds"""
+        if self.server.options.http_lag:
+            time.sleep(self.server.options.http_lag / 1000.0)
+
+    def api_get(self, endpoint, query):
+        """public API: depth, trades, ticker"""
+        market = self.server.market
+        self.http_lag()
+        if endpoint.endswith("/money/depth/full"):
+            data = market.depth()
+        elif endpoint.endswith("/money/depth/fetch"):
+            with market.lock:
+                bid, ask = market.best()
+            data = market.depth(bid * 95 / 100, ask * 105 / 100)
+        elif endpoint.endswith("/money/trades"):
+            data = market.trades_since(int(query.get("since", ["0"])[0]))
+        elif endpoint.endswith("/money/ticker") \
+                or endpoint.endswith("/money/ticker_fast"):
+            data = market.http_ticker()
+        else:
+            self.send_json(404, {"result": "error", "error": "Not found"})
+            return
+        self.send_json(200, {"result": "success", "data": data})
+
+    def send_json(self, status, obj):
+        """send a JSON response, gzipped if it is big and gzip is accepted"""
+        body = json.dumps(obj)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if len(body) > 1024 and "gzip" in self.headers.get(
+                "Accept-Encoding", ""):
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode="wb") as zipped:
+                zipped.write(body)
+            body = buf.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def socketio_handshake(self):
+        """the answer SocketIO.connect() expects: a chunked body with the
+        session id, heartbeat and close timeouts and the transports"""
+        body = "%s:60:60:websocket" % uuid.uuid4().hex
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.write("%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+
+    def upgrade(self, socketio):
+        """websocket handshake, then run the session on this connection"""
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        Session(self.server, self, socketio).run()
+        self.close_connection = 1
+
+    def log_message(self, *args):
+        if self.server.options.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, *args)
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """the server, the market generator and the list of sessions"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, options):
+        BaseHTTPServer.HTTPServer.__init__(self,
+            (options.host, options.port), StubHandler)
+        self.options = options
+        self.market = Market(options.currency, options.levels, options.seed)
+        self.account = Account(options.currency, options.strict_nonce)
+        self.sessions = []
+        self.count_sessions = 0
+        self._lock = threading.Lock()
+        self._terminating = False
+
+    def add_session(self, session):
+        """start sending the feed to this session"""
+        with self._lock:
+            self.sessions.append(session)
+            self.count_sessions += 1
+
+    def remove_session(self, session):
+        """stop sending the feed to this session"""
+        with self._lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    def broadcast(self, messages):
+        """send the messages to all sessions"""
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            for msg in messages:
+                session.put(msg)
+
+    def send_user_order(self, msg):
+        """send a user_order message to the sessions subscribed to the
+        account channel"""
+        with self._lock:
+            sessions = [session for session in self.sessions
+                if session.subscribed_key]
+        for session in sessions:
+            session.put(msg)
+
+    def generator_func(self):
+        """generate the market messages at the configured rates"""
+        options = self.options
+        market = self.market
+        streams = [(rate, func) for (rate, func) in (
+            (options.depth_rate, market.step_depth),
+            (options.trade_rate, market.step_trade),
+            (options.ticker_rate, lambda: [market.ticker()])) if rate > 0]
+        due = [time.time()] * len(streams)
+        while not self._terminating:
+            now = time.time()
+            messages = []
+            for i, (rate, func) in enumerate(streams):
+                while due[i] <= now:
+                    messages.extend(func())
+                    due[i] += 1.0 / rate
+            if messages:
+                self.broadcast(messages)
+            time.sleep(max(0, min(due + [now + 0.1]) - time.time()))
+
+    def stats(self):
+        """one line of counters"""
+        with self._lock:
+            sessions = list(self.sessions)
+        account = self.account
+        return ("sessions: %d (total %d) sent: %d dropped: %d calls: %d "
+            "bad signatures: %d bad nonces: %d orders: %d" % (
+            len(sessions), self.count_sessions,
+            sum(session.count_sent for session in sessions),
+            sum(session.count_dropped for session in sessions),
+            account.count_calls, account.count_bad_sign,
+            account.count_bad_nonce, len(account.orders)))
+
+
+def parse_args(argv=None):
+    """command line options"""
+    argp = argparse.ArgumentParser(description="local MtGox stand-in server")
+    argp.add_argument("--host", default="127.0.0.1",
+        help="address to listen on, default=127.0.0.1")
+    argp.add_argument("--port", type=int, default=8080,
+        help="port to listen on, default=8080 (0 = any free port)")
+    argp.add_argument("--currency", default="USD",
+        help="currency of the market, default=USD")
+    argp.add_argument("--levels", type=int, default=1000,
+        help="initial number of levels per side, default=1000")
+    argp.add_argument("--depth-rate", type=float, default=20,
+        help="depth messages per second, default=20")
+    argp.add_argument("--trade-rate", type=float, default=1,
+        help="trades per second, default=1")
+    argp.add_argument("--ticker-rate", type=float, default=0.5,
+        help="ticker messages per second, default=0.5")
+    argp.add_argument("--drop", type=float, default=0,
+        help="fraction of streaming messages to drop, default=0")
+    argp.add_argument("--lag", type=float, default=0,
+        help="delay of streaming messages in milliseconds, default=0")
+    argp.add_argument("--http-lag", type=float, default=0,
+        help="delay of HTTP responses in milliseconds, default=0")
+    argp.add_argument("--disconnect", type=float, default=0,
+        help="disconnect streaming clients after this many seconds")
+    argp.add_argument("--strict-nonce", action="store_true",
+        help="reject calls whose nonce is not higher than the last one")
+    argp.add_argument("--seed", type=int, default=None,
+        help="random seed of the market")
+    argp.add_argument("--stats", type=float, default=10,
+        help="print counters every this many seconds, 0=never")
+    argp.add_argument("--verbose", action="store_true",
+        help="log every HTTP request")
+    return argp.parse_args(argv)
+
+def start(options):
+    """start the server and the generator in background threads, return
+    the server (use server.server_address for the actual port)"""
+    server = StubServer(options)
+    for func in (server.serve_forever, server.generator_func):
+        thread = threading.Thread(target=func)
+        thread.daemon = True
+        thread.start()
+    return server
+
+def main():
+    """run the server until Ctrl+C"""
+    options = parse_args()
+    server = start(options)
+    host, port = server.server_address
+    print("MtGox stub listening on %s:%d" % (host, port))
+    print("key:    %s" % KEY)
+    print("secret: %s" % SECRET)
+    print("start goxtool with: goxtool.py --server %s:%d" % (host, port))
+    try:
+        while True:
+            time.sleep(options.stats or 3600)
+            if options.stats:
+                print(server.stats())
+    except KeyboardInterrupt:
+        pass
+    server._terminating = True # pylint: disable=W0212
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
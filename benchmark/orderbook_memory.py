@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+
+"""
+Compare memory usage and load time of the two orderbook
+representations (BookSide and CompactBookSide).
+
+usage: orderbook_memory.py [fulldepth.json[.gz]]
+
+The file is a recorded response of money/depth/full (plain or gzipped).
+If no file is given a synthetic book with 20000 levels per side is used.
+"""
+
+import gc
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import goxapi # pylint: disable=F0401
+
+
+def load_depth(filename):
+    """load a recorded fulldepth file"""
+    if filename.endswith(".gz"):
+        with gzip.open(filename) as depth_file:
+            return json.load(depth_file)
+    with open(filename) as depth_file:
+        return json.load(depth_file)
+
+def synthetic_depth(levels):
+    """create a fulldepth structure with the given number of levels"""
+    rnd = random.Random(42)
+    def side(start, step):
+        """levels starting at start, prices step apart"""
+        return [{"price_int": str(start + i * step),
+                 "amount_int": str(rnd.randint(1, 10000) * 100000)}
+                for i in range(levels)]
+    return {"result": "success", "data": {
+        "asks": side(10000000, 10),
+        "bids": list(reversed(side(9999990, -10)))}}
+
+def deep_size(side):
+    """approximate number of bytes used by one side of the book"""
+    size = sys.getsizeof(side)
+    if isinstance(side, goxapi.CompactBookSide):
+        # pylint: disable=W0212
+        return size + sys.getsizeof(side._keys) + sys.getsizeof(side._vols)
+    # pylint: disable=W0212
+    size += sys.getsizeof(side._keys) + sys.getsizeof(side._levels)
+    for key in side._keys:
+        size += sys.getsizeof(key)
+    for price, level in side._levels.items():
+        size += sys.getsizeof(price)
+        size += sys.getsizeof(level)
+        size += sys.getsizeof(level.volume)
+    return size
+
+def measure(side_class, depth):
+    """load depth into both sides of this type, return (bytes, seconds)"""
+    levels = {}
+    for typ in ("asks", "bids"):
+        levels[typ] = [(int(o["price_int"]), int(o["amount_int"]))
+            for o in depth["data"][typ]]
+    gc.collect()
+    time_start = time.time()
+    asks = side_class("ask")
+    bids = side_class("bid")
+    asks.load(levels["asks"])
+    bids.load(levels["bids"])
+    duration = time.time() - time_start
+    return deep_size(asks) + deep_size(bids), duration
+
+def main():
+    """run the benchmark and print the results"""
+    if len(sys.argv) > 1:
+        depth = load_depth(sys.argv[1])
+    else:
+        depth = synthetic_depth(20000)
+    count = len(depth["data"]["asks"]) + len(depth["data"]["bids"])
+    print("levels: %d" % count)
+    print("%-16s %12s %10s %10s" % ("mode", "bytes", "bytes/lvl", "load ms"))
+    for name, side_class in [("BookSide", goxapi.BookSide),
+                             ("CompactBookSide", goxapi.CompactBookSide)]:
+        size, duration = measure(side_class, depth)
+        print("%-16s %12d %10.1f %10.1f" % (
+            name, size, float(size) / count, duration * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python2
+
+"""
+End-to-end benchmark of the message processing pipeline:
+Gox.slot_recv() -> OrderBook -> History -> strategy slots.
+
+usage: pipeline.py [--levels 1000,10000,50000] [--messages 50000]
+                   [--feed NAME] [--compact] [--output result.json]
+       pipeline.py --compare old.json new.json
+
+For every book size a synthetic market (the one of mtgox_stub.py) is
+loaded with fulldepth and then the given number of streaming messages
+(mostly depth, some trades and tickers) is fed through slot_recv() of a
+Gox that is not connected, with the strategy from goxtool/strategy.py
+loaded. With --feed a recorded feed (see FeedRecorder) is used instead,
+its first fulldepth is the initial book.
+
+Every run happens in a forked child process so its peak memory (maxrss)
+can be measured. The latency of every message through the whole chain
+is measured exactly, the time spent in the individual slots (the stages)
+comes from the SignalProfiler histograms, so those percentiles are upper
+bounds (powers of 2 microseconds). The results are printed and, with
+--output, written as JSON together with the git commit, to be compared
+with --compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import goxapi # pylint: disable=F0401
+import strategy # pylint: disable=F0401
+import mtgox_stub
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def synthetic_feed(levels, count):
+    """return (fulldepth, list of JSON strings)"""
+    market = mtgox_stub.Market("USD", levels, seed=42)
+    fulldepth = {"result": "success", "data": market.depth()}
+    messages = []
+    while len(messages) < count:
+        kind = market.rnd.random()
+        if kind < 0.9:
+            batch = market.step_depth()
+        elif kind < 0.98:
+            batch = market.step_trade()
+        else:
+            batch = [market.ticker()]
+        messages.extend(json.dumps(msg, separators=(",", ":"))
+            for msg in batch)
+    return fulldepth, messages[:count]
+
+def recorded_feed(name, count):
+    """return (fulldepth, list of JSON strings) from a recorded feed"""
+    fulldepth = None
+    messages = []
+    for (dummy_time, kind, data) in goxapi.FeedReader(
+            goxapi.feed_files(name)).records():
+        if kind == "fulldepth" and fulldepth is None:
+            fulldepth = data
+        elif kind == "recv" and fulldepth is not None:
+            messages.append(data)
+            if len(messages) == count:
+                break
+    return fulldepth, messages
+
+def percentiles(durations):
+    """exact percentiles in microseconds of a sorted list of seconds"""
+    if not durations:
+        return {}
+    result = dict(("p%s" % pct, durations[min(len(durations) - 1,
+        int(len(durations) * pct / 100.0))] * 1E6) for pct in PERCENTILES)
+    result["max"] = durations[-1] * 1E6
+    return result
+
+def histogram_percentiles(histogram):
+    """upper bounds in microseconds from a SignalProfiler histogram"""
+    total = sum(histogram)
+    result = {}
+    for pct in PERCENTILES:
+        needed = total * pct / 100.0
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if seen >= needed:
+                result["p%s" % pct] = 2 ** bucket
+                break
+    return result
+
+def message_kind(msg):
+    """depth, trade, ticker, ... from the raw JSON"""
+    pos = msg.find('"private":"')
+    if pos < 0:
+        return "other"
+    return msg[pos + 11:msg.find('"', pos + 11)]
+
+def run(fulldepth, messages, compact):
+    """feed the messages through a fresh Gox, return the result dict"""
+    tmpdir = tempfile.mkdtemp()
+    config = goxapi.GoxConfig(os.path.join(tmpdir, "pipeline.ini"))
+    config.set("gox", "orderbook_compact", str(compact))
+    gox = goxapi.Gox(goxapi.Secret(config), config)
+    gox.timer_poll.cancel()
+    gox.client._timer.cancel() # pylint: disable=W0212
+    strat = strategy.Strategy(gox)
+
+    gox.signal_fulldepth(gox, fulldepth)
+    levels = len(gox.orderbook.asks) + len(gox.orderbook.bids)
+    gox.enable_profiling()
+
+    slot_recv = gox.slot_recv
+    durations = []
+    kinds = [message_kind(msg) for msg in messages]
+    time_start = time.time()
+    for msg in messages:
+        time_msg = time.time()
+        slot_recv(None, msg)
+        durations.append(time.time() - time_msg)
+    duration = time.time() - time_start
+
+    stages = []
+    for entry in gox.get_signal_stats():
+        stages.append({"signal": entry["signal"], "slot": entry["slot"],
+            "count": entry["count"],
+            "mean": entry["total"] / entry["count"] * 1E6,
+            "max": entry["max"] * 1E6,
+            "percentiles": histogram_percentiles(entry["histogram"])})
+    gox.disable_profiling()
+
+    by_kind = {}
+    for kind, msg_duration in zip(kinds, durations):
+        by_kind.setdefault(kind, []).append(msg_duration)
+    del strat
+    shutil.rmtree(tmpdir)
+    return {"levels": levels, "messages": len(messages),
+        "seconds": duration, "messages_per_sec": len(messages) / duration,
+        "latency": percentiles(sorted(durations)),
+        "latency_by_kind": dict((kind, percentiles(sorted(values)))
+            for kind, values in by_kind.items()),
+        "stages": stages,
+        "gaps": gox.orderbook.count_gaps}
+
+def measure(func, *args):
+    """run func(*args) in a child process, return its result dict with
+    the peak memory of the child added"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        result = func(*args)
+        with os.fdopen(write_fd, "w") as pipe:
+            pipe.write(json.dumps(result))
+        os._exit(0) # pylint: disable=W0212
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        text = pipe.read()
+    usage = os.wait4(pid, 0)[2]
+    result = json.loads(text)
+    result["peak_rss_kib"] = usage.ru_maxrss
+    return result
+
+def child_run(source, levels, count, compact):
+    """build the feed and run it (in the child process)"""
+    if source:
+        fulldepth, messages = recorded_feed(source, count)
+    else:
+        fulldepth, messages = synthetic_feed(levels, count)
+    result = run(fulldepth, messages, compact)
+    result["size"] = levels
+    return result
+
+def git_commit():
+    """the current commit of the repository or None"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(result):
+    """human readable summary of one run, labelled with the --levels
+    size (per side) or, for a recorded feed, the size of both sides"""
+    latency = result["latency"]
+    if result["size"]:
+        label = "levels %d" % result["size"]
+    else:
+        label = "feed, %d levels" % result["levels"]
+    print("%s: %d msg/s, latency p50 %.1f p99 %.1f max %.1f us, "
+        "peak %.1f MiB, %d gaps" % (label,
+        result["messages_per_sec"], latency["p50"], latency["p99"],
+        latency["max"], result["peak_rss_kib"] / 1024.0, result["gaps"]))
+    for stage in result["stages"][:6]:
+        print("    %-22s %-28s %8d calls %8.1f us mean, p99 <= %d us" % (
+            stage["signal"], stage["slot"], stage["count"], stage["mean"],
+            stage["percentiles"].get("p99", 0)))
+
+def compare(old_name, new_name):
+    """print the change of throughput and latency between two results"""
+    with open(old_name) as old_file:
+        old = json.load(old_file)
+    with open(new_name) as new_file:
+        new = json.load(new_file)
+    print("%s -> %s" % (old.get("commit"), new.get("commit")))
+    old_runs = dict((run_old["size"], run_old) for run_old in old["runs"])
+    for result in new["runs"]:
+        before = old_runs.get(result["size"])
+        if not before:
+            continue
+        print("size %8d: msg/s %+6.1f%%  p99 %+6.1f%%  peak memory %+6.1f%%"
+            % (result["size"],
+            100.0 * result["messages_per_sec"] / before["messages_per_sec"]
+                - 100,
+            100.0 * result["latency"]["p99"] / before["latency"]["p99"] - 100,
+            100.0 * result["peak_rss_kib"] / before["peak_rss_kib"] - 100))
+
+def main():
+    """run the benchmark and print the results"""
+    argp = argparse.ArgumentParser(description="goxapi pipeline benchmark")
+    argp.add_argument("--levels", default="1000,10000,50000",
+        help="comma separated book sizes per side")
+    argp.add_argument("--messages", type=int, default=50000,
+        help="number of streaming messages per run")
+    argp.add_argument("--feed", default="",
+        help="use this recorded feed instead of synthetic messages")
+    argp.add_argument("--compact", action="store_true",
+        help="use the compact orderbook")
+    argp.add_argument("--output", default="",
+        help="write the results to this JSON file")
+    argp.add_argument("--compare", nargs=2, metavar="JSON",
+        help="compare two result files and exit")
+    args = argp.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.feed:
+        sizes = [0]
+    else:
+        sizes = [int(size) for size in args.levels.split(",")]
+    runs = []
+    for levels in sizes:
+        result = measure(child_run, args.feed, levels, args.messages,
+            args.compact)
+        print_result(result)
+        runs.append(result)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"commit": git_commit(), "time": time.time(),
+                "python": platform.python_version(),
+                "feed": args.feed or "synthetic", "compact": args.compact,
+                "runs": runs}, output, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
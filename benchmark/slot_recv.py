@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+
+"""
+Measure how many streaming messages per second Gox.slot_recv() handles.
+
+usage: slot_recv.py [messages.txt] [repeat]
+
+The file contains one recorded JSON message per line, exactly as it is
+passed to slot_recv() (without the socket.io "4::/mtgox:" prefix). If no
+file is given a synthetic feed is used: depth, trade and ticker messages
+in USD, EUR and JPY, of which only the USD ones are for us. The legacy
+dispatch (getattr() per message, every message decoded) is compared with
+the handler table plus raw prefilter, using every JSON decoder that can
+be imported.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import goxapi # pylint: disable=F0401
+
+DECODERS = ["json", "simplejson", "ujson"]
+
+
+class LegacyGox(goxapi.Gox):
+    """the dispatch as it was before the handler tables"""
+
+    def slot_recv(self, dummy_sender, data):
+        (str_json) = data
+        handler = None
+        msg = json.loads(str_json)
+        if "op" in msg:
+            try:
+                msg_op = msg["op"]
+                handler = getattr(self, "_on_op_" + msg_op)
+            except AttributeError:
+                self.debug("slot_recv() ignoring: op=%s" % msg_op)
+        else:
+            self.debug("slot_recv() ignoring:", msg)
+        if handler:
+            handler(msg)
+
+    def _on_op_private(self, msg):
+        private = msg["private"]
+        handler = None
+        try:
+            handler = getattr(self, "_on_op_private_" + private)
+        except AttributeError:
+            self.debug("_on_op_private() ignoring: private=%s" % private)
+        if handler:
+            handler(msg)
+
+def synthetic_messages(count):
+    """depth, trade and ticker messages in three currencies"""
+    rnd = random.Random(42)
+    messages = []
+    for i in xrange(count):
+        currency = rnd.choice(["USD", "USD", "EUR", "JPY"])
+        price = str(rnd.randint(9000000, 11000000))
+        kind = rnd.random()
+        if kind < 0.8:
+            msg = {"channel": "24e67e0d-1cad-4cc0-9e7a-f8523ef460fe",
+                "op": "private", "origin": "broadcast", "private": "depth",
+                "depth": {"price": "100.0", "type": 1, "type_str": "ask",
+                    "volume": "1.5", "price_int": price,
+                    "volume_int": "150000000", "item": "BTC",
+                    "currency": currency, "now": str(1366641543431424 + i),
+                    "total_volume_int": "1200000000"}}
+        elif kind < 0.95:
+            msg = {"channel": "dbf1dee9-4f2e-4a08-8cb7-748919a71b21",
+                "op": "private", "origin": "broadcast", "private": "trade",
+                "trade": {"type": "trade", "date": 1366641543,
+                    "amount": 1.5, "price": 100.0, "tid": str(i),
+                    "amount_int": "150000000", "price_int": price,
+                    "item": "BTC", "price_currency": currency,
+                    "trade_type": "bid", "primary": "Y",
+                    "properties": "limit"}}
+        else:
+            value = {"value": "100.0", "value_int": price,
+                "display": "$100.0", "currency": currency}
+            msg = {"channel": "d5f06780-30a8-4a48-a2f8-7ed181b4a13f",
+                "op": "private", "origin": "broadcast", "private": "ticker",
+                "ticker": {"high": value, "low": value, "avg": value,
+                    "vwap": value, "last": value, "buy": value,
+                    "sell": value, "vol": {"value": "1000",
+                        "value_int": "100000000000", "currency": "BTC"}}}
+        messages.append(json.dumps(msg, separators=(",", ":")))
+    return messages
+
+def run(gox, messages):
+    """feed all messages through slot_recv(), return messages per second"""
+    slot_recv = gox.slot_recv
+    time_start = time.time()
+    for msg in messages:
+        slot_recv(None, msg)
+    return len(messages) / (time.time() - time_start)
+
+def make_gox(gox_class, decoder, tmpdir):
+    """a Gox that is not connected, with this JSON decoder"""
+    config = goxapi.GoxConfig(os.path.join(tmpdir, "bench.ini"))
+    config.set("gox", "json_decoder", decoder)
+    gox = gox_class(goxapi.Secret(config), config)
+    gox.orderbook.totals_check_interval = 0
+    gox.timer_poll.cancel()
+    gox.client._timer.cancel() # pylint: disable=W0212
+    return gox
+
+def main():
+    """run the benchmark and print the results"""
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as msg_file:
+            messages = [line.strip() for line in msg_file if line.strip()]
+    else:
+        messages = synthetic_messages(20000)
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    messages = messages * repeat
+    tmpdir = tempfile.mkdtemp()
+
+    print("messages: %d" % len(messages))
+    print("%-28s %12s %12s" % ("dispatch", "messages/s", "prefiltered"))
+    gox = make_gox(LegacyGox, "json", tmpdir)
+    print("%-28s %12d %12s" % ("legacy getattr + json", run(gox, messages),
+        "-"))
+    for decoder in DECODERS:
+        if decoder != "json" and goxapi.json_decoder(decoder) == json.loads:
+            continue # not installed
+        gox = make_gox(goxapi.Gox, decoder, tmpdir)
+        speed = run(gox, messages)
+        print("%-28s %12d %12d" % ("table + prefilter + " + decoder, speed,
+            gox.count_prefiltered))
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+
+"""
+Compare the websocket masking implementations for several payload sizes.
+
+usage: websocket_mask.py [seconds]
+
+Each implementation masks random payloads of the sizes below repeatedly
+for about the given time (default 0.2 seconds) per size. The numpy
+variant is only measured if numpy can be imported.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import websocket # pylint: disable=F0401
+
+SIZES = [8, 32, 128, 512, 2048, 16384, 131072]
+
+
+def measure(func, data, seconds):
+    """call func(key, data) repeatedly, return calls per second"""
+    key = os.urandom(4)
+    count = 0
+    time_start = time.time()
+    while True:
+        for dummy in xrange(10):
+            func(key, data)
+        count += 10
+        duration = time.time() - time_start
+        if duration > seconds:
+            return count / duration
+
+def main():
+    """run the benchmark and print the results"""
+    # pylint: disable=W0212
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    funcs = [("loop", websocket._mask_loop),
+             ("long", websocket._mask_long),
+             ("ABNF.mask", websocket.ABNF.mask)]
+    if websocket.numpy:
+        funcs.insert(2, ("numpy", websocket._mask_numpy))
+    print("%8s" % "bytes" + "".join("%14s" % name for name, _ in funcs)
+        + "    (calls/s)")
+    for size in SIZES:
+        data = os.urandom(size)
+        print("%8d" % size + "".join("%14d" % measure(func, data, seconds)
+            for _, func in funcs))
+
+
+if __name__ == "__main__":
+    main()
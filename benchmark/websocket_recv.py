@@ -0,0 +1,125 @@
+#!/usr/bin/env python2
+
+"""
+Measure websocket receive throughput over a local socket pair.
+
+usage: websocket_recv.py [messages.txt] [repeat]
+
+The file contains one recorded socket.io message per line, for example
+the debug output of "4::/mtgox:{...}" lines. If no file is given a
+synthetic mix of small depth messages and a few large result messages is
+used. The messages are framed like the server does it and sent through
+a socket pair, then received with the previous byte string based reader
+(legacy), with recv() and with the zero-copy recv_data_view().
+Frame tracing is switched off, it would dominate the measurement.
+"""
+
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "goxtool"))
+import websocket # pylint: disable=F0401
+
+
+class LegacyWebSocket(websocket.WebSocket):
+    """the receive path as it was before the buffer was introduced"""
+
+    def _recv(self, bufsize):
+        bytes = self.io_sock.recv(bufsize)
+        if not bytes:
+            raise websocket.WebSocketConnectionClosedException()
+        return bytes
+
+    def _recv_strict(self, bufsize):
+        remaining = bufsize
+        bytes = ""
+        while remaining:
+            bytes += self._recv(remaining)
+            remaining = bufsize - len(bytes)
+        return bytes
+
+    def recv_data(self):
+        frame = self.recv_frame()
+        return (frame.opcode, frame.data)
+
+    def recv_frame(self):
+        header_bytes = self._recv_strict(2)
+        b1 = ord(header_bytes[0])
+        length = ord(header_bytes[1]) & 0x7f
+        if length == 0x7e:
+            length = struct.unpack("!H", self._recv_strict(2))[0]
+        elif length == 0x7f:
+            length = struct.unpack("!Q", self._recv_strict(8))[0]
+        data = self._recv_strict(length)
+        return websocket.ABNF(1, 0, 0, 0, b1 & 0xf, 0, data)
+
+def frame(payload):
+    """unmasked text frame like the server sends it"""
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 0x10000:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+def synthetic_messages():
+    """mostly depth messages and once in a while a big result"""
+    depth = ('4::/mtgox:{"channel":"24e67e0d-1cad-4cc0-9e7a-f8523ef460fe",'
+        '"op":"private","origin":"broadcast","private":"depth","depth":{'
+        '"price":"100.12345","type":2,"type_str":"bid","volume":"1.5",'
+        '"price_int":"10012345","volume_int":"150000000","item":"BTC",'
+        '"currency":"USD","now":"1366641543431424",'
+        '"total_volume_int":"1200000000"}}')
+    big = '4::/mtgox:{"op":"result","result":[%s]}' % ",".join(
+        ['{"price_int":"%d","amount_int":"100000000"}' % i
+            for i in range(10000000, 10000000 + 20000)])
+    return [depth] * 999 + [big]
+
+def run(ws_class, method, data, count):
+    """send data through a socket pair, receive count messages"""
+    server, client = socket.socketpair()
+    sender = threading.Thread(target=server.sendall, args=(data,))
+    sender.daemon = True
+    websock = ws_class()
+    websock.sock.close()
+    websock.io_sock = websock.sock = client
+    receive = getattr(websock, method)
+    sender.start()
+    time_start = time.time()
+    for dummy in xrange(count):
+        receive()
+    duration = time.time() - time_start
+    sender.join()
+    server.close()
+    client.close()
+    return duration
+
+def main():
+    """run the benchmark and print the results"""
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as msg_file:
+            messages = [line.rstrip("\n") for line in msg_file if line.strip()]
+    else:
+        messages = synthetic_messages()
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    websocket.enableTrace(False)
+    data = "".join(frame(msg) for msg in messages) * repeat
+    count = len(messages) * repeat
+    print("messages: %d, bytes: %d" % (count, len(data)))
+    print("%-24s %12s %10s" % ("reader", "messages/s", "MB/s"))
+    for name, ws_class, method in [
+            ("legacy recv()", LegacyWebSocket, "recv"),
+            ("recv()", websocket.WebSocket, "recv"),
+            ("recv_data_view()", websocket.WebSocket, "recv_data_view")]:
+        duration = run(ws_class, method, data, count)
+        print("%-24s %12d %10.1f" % (
+            name, count / duration, len(data) / duration / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,11 @@ class Model(QAbstractTableModel):
         self.__headerdata = self.headerdata = headerdata
         self.__data = []
 
-    def __slot_changed(self, book, dummy_data):
+    def __slot_changed(self, book, change):
+        # skip the re-aggregation if only the other side has changed
+        side = self._get_data_from_book(book)
+        if change and not change.affects(side.typ):
+            return
         self.__data = self.__parse_data(book)
         self.emit(SIGNAL("layoutChanged()"))
 
@@ -8,7 +8,8 @@ import utilities
 import time
 import os
 from decimal import Decimal as D
-from goxapi import http_request,HTTP_HOST,Timer
+import goxapi
+from goxapi import http_request,Timer
 import json
 
 F = utilities.FACTOR_FLOAT
@@ -127,7 +128,7 @@ class View(QMainWindow):
         self.refresh_and_display_ticker()
 
     def initialize_ticker(self):
-        use_ssl = self.gox.config.get_bool("gox", "use_ssl")
+        use_ssl = goxapi.ssl_enabled(self.gox.config)
         proto = {True: "https", False: "http"}[use_ssl]
         currency = self.gox.currency
         class Ticker(object):
@@ -145,11 +146,11 @@ class View(QMainWindow):
                 self.refresh_ticker2()
                 self.refresh_tickerfast()
             def refresh_tickerfast(self):
-                ticker_fast = http_request(proto + "://" +  HTTP_HOST + "/api/2/BTC" + currency + "/money/ticker_fast")
+                ticker_fast = http_request(proto + "://" +  goxapi.HTTP_HOST + "/api/2/BTC" + currency + "/money/ticker_fast")
                 self.ticker_fast = json.loads(ticker_fast)["data"]
                 self.create_fast(self.ticker_fast)                
             def refresh_ticker2(self):
-                ticker2 = http_request(proto + "://" +  HTTP_HOST + "/api/2/BTC" + currency + "/money/ticker")
+                ticker2 = http_request(proto + "://" +  goxapi.HTTP_HOST + "/api/2/BTC" + currency + "/money/ticker")
                 self.ticker2 = json.loads(ticker2)["data"]
                 self.create_ticker2(self.ticker2)
             def create_fast(self,ticker_fast):
@@ -28,27 +28,43 @@ if PY_VERSION < (2, 7):
     sys.exit(1)
 
 from ConfigParser import SafeConfigParser
+import array
 import base64
 import binascii
-import contextlib
+import bisect
+import collections
 from Crypto.Cipher import AES
 import getpass
-import gzip
+import glob
 import hashlib
+import heapq
 import hmac
+import httplib
 import inspect
-import io
+import itertools
 import json
 import logging
+import os
 import Queue
+import random
+import re
+import select
+import socket
+import sqlite3
+import struct
 import time
 import traceback
 import threading
-from urllib2 import Request as URLRequest
-from urllib2 import urlopen, HTTPError
 from urllib import urlencode
+from urlparse import urlparse
 import weakref
 import websocket
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 input = raw_input # pylint: disable=W0622,C0103
 
@@ -56,6 +72,24 @@ FORCE_PROTOCOL = ""
 FORCE_NO_FULLDEPTH = False
 FORCE_NO_HISTORY = False
 FORCE_HTTP_API = False
+FORCE_NO_SSL = False
+
+# play back recorded feed files (see FeedRecorder) instead of connecting,
+# FORCE_REPLAY_SPEED is the factor of the original speed, 0 means as fast
+# as possible
+FORCE_REPLAY = ""
+FORCE_REPLAY_SPEED = 1
+
+# an orderbook snapshot (load_fulldepth = snapshot) older than this many
+# seconds will not be used anymore
+ORDERBOOK_SNAPSHOT_MAX_AGE = 3600
+
+# when the orderbook detects a gap in the depth feed the depth around the
+# current price is fetched again, but not more often than every
+# DEPTH_RESYNC_INTERVAL seconds. If the gap is outside of that range the
+# full depth is fetched, not more often than every DEPTH_FULL_RESYNC_INTERVAL
+DEPTH_RESYNC_INTERVAL = 30
+DEPTH_FULL_RESYNC_INTERVAL = 600
 
 SOCKETIO_HOST = "socketio.mtgox.com"
 WEBSOCKET_HOST = "websocket.mtgox.com"
@@ -63,6 +97,28 @@ HTTP_HOST = "data.mtgox.com"
 
 USER_AGENT = "trader.genBTC"
 
+HTTP_TIMEOUT = 30
+HTTP_CHUNK_SIZE = 65536
+
+# signed HTTP API calls that failed are retried after a random delay of
+# 0.5..1.5 times HTTP_RETRY_DELAY * 2**attempt (but not more than
+# HTTP_RETRY_MAX_DELAY), at most HTTP_MAX_RETRIES times
+HTTP_RETRY_DELAY = 0.5
+HTTP_RETRY_MAX_DELAY = 30
+HTTP_MAX_RETRIES = 5
+
+# the feed recorder starts a new file when the current one is larger than
+# FEED_ROTATE_BYTES or older than FEED_ROTATE_SECONDS. Records are collected
+# into compressed blocks of about FEED_BLOCK_SIZE bytes, a block is written
+# at least every FEED_FLUSH_INTERVAL seconds and after every
+# FEED_INDEX_INTERVAL blocks an index block is written
+FEED_ROTATE_BYTES = 100 * 1024 * 1024
+FEED_ROTATE_SECONDS = 24 * 3600
+FEED_BLOCK_SIZE = 65536
+FEED_FLUSH_INTERVAL = 1
+FEED_INDEX_INTERVAL = 64
+FEED_QUEUE_SIZE = 10000
+
 def int2str(value_int, currency):
     """return currency integer formatted as a string"""
     if currency == "BTC":
@@ -90,34 +146,275 @@ def float2int(value_float, currency):
     else:
         return int(value_float * 100000)
 
-def http_request(url, post=None, headers=None):
-    """request data from the HTTP API, returns a string"""
-
-    def read_gzipped(response):
-        """read data from the response object,
-        unzip if necessary, return text string"""
-        if response.info().get('Content-Encoding') == 'gzip':
-            with io.BytesIO(response.read()) as buf:
-                with gzip.GzipFile(fileobj=buf) as unzipped:
-                    data = unzipped.read()
+class HTTPConnectionPool:
+    """keeps idle HTTP(S) connections open so that the next request to the
+    same host can reuse them instead of doing a new TCP and TLS handshake.
+    At most size idle connections are kept per (scheme, host), connections
+    that have been idle for longer than idle_timeout seconds or that the
+    server has already closed are not used anymore."""
+
+    def __init__(self, size=4, idle_timeout=30):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {} # (scheme, host) -> list of (connection, time)
+        self.count_requests = 0
+        self.count_reused = 0
+        self.count_handshakes = 0
+        self.count_retries = 0
+
+    def acquire(self, scheme, host):
+        """return a tuple (connection, reused). The connection is either
+        an idle one or a new one that will connect on the first request"""
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get((scheme, host), [])
+            while idle:
+                conn, time_released = idle.pop()
+                if now - time_released < self.idle_timeout \
+                        and self._is_alive(conn):
+                    self.count_reused += 1
+                    return conn, True
+                conn.close()
+            self.count_handshakes += 1
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, timeout=HTTP_TIMEOUT), False
+        return httplib.HTTPConnection(host, timeout=HTTP_TIMEOUT), False
+
+    def _is_alive(self, conn):
+        """check an idle connection before it is reused. The server does
+        not send anything on an idle connection, if it is readable then
+        the server has closed it. A POST on it would fail and could not
+        be repeated, so it must not be used."""
+        if not conn.sock:
+            return False
+        try:
+            return not select.select([conn.sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+
+    def release(self, scheme, host, conn):
+        """put the connection back into the pool after the response
+        has been read completely, close it if the pool is full"""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.size:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close_all(self):
+        """close all idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, dummy_time in idle:
+                    conn.close()
+            self._idle = {}
+
+    def send(self, url, post=None, headers=None):
+        """send a GET (or POST if post is not None) request but don't wait
+        for the response, pass the returned object to receive() to get the
+        HTTP status and the response body (unzipped if necessary). Idle
+        connections the server has closed are never reused (see
+        _is_alive()). If a reused connection still turns out to be dead a
+        GET request will be repeated on a new connection. A POST is never
+        repeated, it might already have been processed by the server (and
+        a signed call would need a new nonce anyways), the error is raised
+        instead."""
+        parsed = urlparse(url)
+        scheme, host = parsed.scheme, parsed.netloc
+        path = parsed.path
+        if parsed.query:
+            path += "?" + parsed.query
+        all_headers = {
+            "Accept-Encoding": "gzip",
+            "User-Agent": USER_AGENT
+        }
+        if post is not None:
+            all_headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if headers:
+            all_headers.update(headers)
+
+        with self._lock:
+            self.count_requests += 1
+        method = {True: "GET", False: "POST"}[post is None]
+        return self._send((scheme, host, method, path, post, all_headers))
+
+    def receive(self, sent):
+        """wait for the response of a request that was sent with send(),
+        return the HTTP status and the response body"""
+        chunks = []
+        status = self.receive_stream(sent, chunks.append)
+        return status, "".join(chunks)
+
+    def receive_stream(self, sent, consume):
+        """wait for the response of a request that was sent with send()
+        and pass the body piece by piece to consume() while it arrives,
+        gzip encoding is decoded on the fly. Returns the HTTP status."""
+        req, conn, reused = sent
+        while True:
+            try:
+                response = conn.getresponse()
+                break
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused or req[2] != "GET":
+                    raise
+                with self._lock:
+                    self.count_retries += 1
+                req, conn, reused = self._send(req)
+
+        decompress = None
+        if response.getheader("Content-Encoding") == "gzip":
+            decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            while True:
+                chunk = response.read(HTTP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if decompress:
+                    chunk = decompress.decompress(chunk)
+                consume(chunk)
+            if decompress:
+                consume(decompress.flush())
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
         else:
-            data = response.read()
-        return data
-
-    if not headers:
-        headers = {}
-    request = URLRequest(url, post, headers)
-    request.add_header('Accept-encoding', 'gzip')
-    request.add_header('User-Agent:', USER_AGENT)
-    data = ""
-    try:
-        with contextlib.closing(urlopen(request, post)) as res:
-            data = read_gzipped(res)
-    except HTTPError as err:
-        data = read_gzipped(err)
+            self.release(req[0], req[1], conn)
+        return response.status
 
+    def request(self, url, post=None, headers=None):
+        """send a request and wait for the response, see send()"""
+        return self.receive(self.send(url, post, headers))
+
+    def _send(self, req):
+        """send the request on a pooled connection"""
+        scheme, host, method, path, post, headers = req
+        while True:
+            conn, reused = self.acquire(scheme, host)
+            try:
+                conn.request(method, path, post, headers)
+                return req, conn, reused
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused or method != "GET":
+                    raise
+                with self._lock:
+                    self.count_retries += 1
+
+    def stats(self):
+        """return a dict with the counters"""
+        with self._lock:
+            return {
+                "requests": self.count_requests,
+                "reused": self.count_reused,
+                "handshakes": self.count_handshakes,
+                "retries": self.count_retries,
+                "idle": sum(len(idle) for idle in self._idle.values())
+            }
+
+
+HTTP_POOL = HTTPConnectionPool()
+
+
+class FulldepthParser:
+    """incremental parser for the money/depth/full response. Feed it the
+    (decompressed) response text piece by piece as it arrives, the asks and
+    bids are parsed one by one and only their price_int and amount_int are
+    kept as (price, volume) tuples. Nothing else of the levels survives, so
+    the entire document never needs to be in memory as a string or as a
+    tree of dicts. close() returns the message with the same structure as
+    json.loads() would return it, but with the tuples in the lists."""
+
+    _ARRAY_START = re.compile(r'"(asks|bids)"\s*:\s*\[')
+
+    def __init__(self):
+        self.levels = {"asks": [], "bids": []}
+        self._decoder = json.JSONDecoder()
+        self._skeleton = [] # everything outside of the asks and bids arrays
+        self._side = None   # the list we are currently parsing into
+        self._buf = ""
+        self._pos = 0
+
+    def feed(self, text):
+        """parse the next piece of the response"""
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        buf = self._buf
+        length = len(buf)
+        while True:
+            if self._side is None:
+                match = self._ARRAY_START.search(buf, self._pos)
+                if not match:
+                    # keep the end, it might be the beginning of a key
+                    keep = max(self._pos, length - 32)
+                    self._skeleton.append(buf[self._pos:keep])
+                    self._pos = keep
+                    return
+                name = match.group(1)
+                self._skeleton.append(buf[self._pos:match.start()])
+                self._skeleton.append('"%s":[]' % name)
+                self._side = self.levels[name]
+                self._pos = match.end()
+            else:
+                pos = self._pos
+                while pos < length and buf[pos] in " \t\r\n,":
+                    pos += 1
+                self._pos = pos
+                if pos == length:
+                    return
+                if buf[pos] == "]":
+                    self._side = None
+                    self._pos = pos + 1
+                    continue
+                try:
+                    order, self._pos = self._decoder.raw_decode(buf, pos)
+                except ValueError:
+                    return # incomplete, wait for more
+                self._side.append(
+                    (int(order["price_int"]), int(order["amount_int"])))
+
+    def close(self):
+        """finish parsing and return the message"""
+        if self._side is not None:
+            raise ValueError("fulldepth truncated")
+        self._skeleton.append(self._buf[self._pos:])
+        depth = json.loads("".join(self._skeleton))
+        if "data" in depth:
+            depth["data"].update(self.levels)
+        return depth
+
+
+def depth_levels(orders):
+    """return the list of fulldepth orders as (price_int, amount_int)
+    tuples, FulldepthParser delivers them like this already (and a
+    recorded fulldepth contains them as lists)"""
+    if orders and isinstance(orders[0], (tuple, list)):
+        return orders
+    return [(int(order["price_int"]), int(order["amount_int"]))
+        for order in orders]
+
+def http_request(url, post=None, headers=None):
+    """request data from the HTTP API, returns a string. The connections
+    are kept open and reused (see HTTPConnectionPool and HTTP_POOL)"""
+    dummy_status, data = HTTP_POOL.request(url, post, headers)
     return data
 
+def json_decoder(name):
+    """return the loads() function of the JSON module with this name, for
+    example "simplejson" or "ujson". If it can't be imported the standard
+    json.loads() is returned. The module must decode like json.loads()"""
+    if name and name != "json":
+        try:
+            return __import__(name).loads
+        except (ImportError, AttributeError):
+            pass
+    return json.loads
+
 def start_thread(thread_func):
     """start a new thread to execute the supplied function"""
     thread = threading.Thread(None, thread_func)
@@ -125,6 +422,19 @@ def start_thread(thread_func):
     thread.start()
     return thread
 
+def replace_file(src, dst):
+    """rename src to dst, replacing dst if it exists. On Windows os.rename()
+    refuses to overwrite, there the old file is removed first (this is
+    not atomic, but the old one is about to be replaced anyways)"""
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+def ssl_enabled(config):
+    """return True if the connections should use SSL (the use_ssl
+    option, FORCE_NO_SSL overrides it for a local test server)"""
+    return config.get_bool("gox", "use_ssl") and not FORCE_NO_SSL
+
 def pretty_format(something):
     """pretty-format a nested dict or list for debugging purposes.
     If it happens to be a valid json string then it will be parsed first"""
@@ -149,12 +459,25 @@ class GoxConfig(SafeConfigParser):
                 ,["gox", "use_ssl", "True"]
                 ,["gox", "use_plain_old_websocket", "False"]
                 ,["gox", "use_http_api", "False"]
+                ,["gox", "use_event_loop", "False"]
+                ,["gox", "http_pool_size", "4"]
+                ,["gox", "http_pool_idle_timeout", "30"]
+                ,["gox", "http_workers", "4"]
+                ,["gox", "http_endpoint_concurrency", "2"]
                 ,["gox", "load_fulldepth", "True"]
                 ,["gox", "load_history", "False"]
+                ,["gox", "orderbook_compact", "False"]
+                ,["gox", "orderbook_notify_rate", "0"]
+                ,["gox", "signal_profile_interval", "0"]
                 ,["gox", "history_timeframe", "15"]
+                ,["gox", "history_max_candles", "10000"]
+                ,["gox", "history_timeframes", ""]
+                ,["gox", "history_store", "False"]
+                ,["gox", "json_decoder", "json"]
                 ,["gox", "secret_key", ""]
                 ,["gox", "secret_secret", ""]
                 ,["goxtool", "set_xterm_title", "True"]
+                ,["goxtool", "ui_queue_size", "0"]
                 ]
 
     def __init__(self, filename):
@@ -222,6 +545,10 @@ class Signal():
     _lock = threading.RLock()
     signal_error = None
 
+    # if this is set to a SignalProfiler instance (see Gox.enable_profiling())
+    # then all signals will measure the time spent in each slot
+    profiler = None
+
     def __init__(self):
         self._functions = weakref.WeakSet()
         self._methods = weakref.WeakKeyDictionary()
@@ -258,6 +585,8 @@ class Signal():
         signals can be directly connected to other signals) without problems.
         If a slot raises an exception a traceback will be sent to the static
         Signal.signal_error() or to logging.critical()"""
+        if Signal.profiler:
+            return self._call_profiled(sender, data, error_signal_on_error)
         with self._lock:
             sent = False
             errors = []
@@ -288,6 +617,137 @@ class Signal():
 
             return sent
 
+    def _call_profiled(self, sender, data, error_signal_on_error):
+        """this does the same as __call__() but it will also measure the
+        time spent waiting for the lock and the time spent in every slot
+        and record it in Signal.profiler. This is used instead of the normal
+        __call__() only while profiling is enabled."""
+        profiler = Signal.profiler
+        time_wait = time.time()
+        with self._lock:
+            time_start = time.time()
+            profiler.record_wait(self, time_start - time_wait)
+            sent = False
+            errors = []
+            calls = [(func, (sender, data)) for func in self._functions]
+            for obj, funcs in self._methods.items():
+                calls += [(func, (obj, sender, data)) for func in funcs]
+
+            for func, args in calls:
+                try:
+                    func(*args)
+                    sent = True
+
+                # pylint: disable=W0702
+                except:
+                    errors.append(traceback.format_exc())
+                time_end = time.time()
+                profiler.record_slot(self, func, args, time_end - time_start)
+                time_start = time_end
+
+            for error in errors:
+                if error_signal_on_error:
+                    Signal.signal_error(self, (error), False)
+                else:
+                    logging.critical(error)
+
+            return sent
+
+
+class SignalProfiler:
+    """collects timing statistics of signal dispatching, see Signal.profiler.
+    For every (signal, slot) pair it counts the calls, the total and the
+    maximum time and it maintains a histogram of the durations. Bucket i of
+    the histogram counts the calls that took less than 2**i microseconds
+    (but not less than 2**(i-1)). For every signal it also records the time
+    spent waiting to acquire the global Signal._lock. The statistics are
+    only modified while Signal._lock is held."""
+
+    HISTOGRAM_SIZE = 25 # last bucket is everything above 8 seconds
+
+    def __init__(self):
+        self.time_started = time.time()
+        self.slots = {} # (signal name, slot name) -> [cnt, sum, max, hist]
+        self.waits = {} # signal name -> [cnt, sum, max]
+        self._names = weakref.WeakKeyDictionary() # Signal -> name
+
+    def name_signals(self, obj, prefix):
+        """give all the signals that are attributes of obj a readable name
+        composed of prefix and the attribute name, this must be called for
+        every object whose signals should appear with names in the stats.
+        Signals without name will be called Signal@<address>"""
+        for attr, value in vars(obj).items():
+            if isinstance(value, Signal):
+                self._names[value] = "%s.%s" % (prefix, attr)
+
+    def signal_name(self, signal):
+        """return the readable name of this signal"""
+        name = self._names.get(signal)
+        if not name:
+            name = "Signal@%x" % id(signal)
+        return name
+
+    def record_wait(self, signal, duration):
+        """record the time spent waiting for the lock"""
+        name = self.signal_name(signal)
+        stat = self.waits.get(name)
+        if not stat:
+            stat = self.waits[name] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += duration
+        if duration > stat[2]:
+            stat[2] = duration
+
+    def record_slot(self, signal, func, args, duration):
+        """record the time spent in one slot"""
+        if isinstance(func, Signal):
+            slot_name = self.signal_name(func)
+        elif len(args) == 3:
+            slot_name = "%s.%s" % (args[0].__class__.__name__, func.__name__)
+        else:
+            slot_name = getattr(func, "__name__", repr(func))
+        key = (self.signal_name(signal), slot_name)
+        stat = self.slots.get(key)
+        if not stat:
+            stat = self.slots[key] = [0, 0.0, 0.0, [0] * self.HISTOGRAM_SIZE]
+        stat[0] += 1
+        stat[1] += duration
+        if duration > stat[2]:
+            stat[2] = duration
+        bucket = min(int(duration * 1E6).bit_length(), self.HISTOGRAM_SIZE - 1)
+        stat[3][bucket] += 1
+
+    def get_stats(self):
+        """return a list of dicts, one for each (signal, slot) pair, sorted
+        by total time spent in the slot, highest first. Times are seconds."""
+        with Signal._lock:
+            result = []
+            for (signal_name, slot_name), stat in self.slots.items():
+                wait = self.waits.get(signal_name, [0, 0.0, 0.0])
+                result.append({
+                    "signal": signal_name,
+                    "slot": slot_name,
+                    "count": stat[0],
+                    "total": stat[1],
+                    "max": stat[2],
+                    "histogram": list(stat[3]),
+                    "lock_wait_total": wait[1],
+                    "lock_wait_max": wait[2]
+                })
+        result.sort(key=lambda entry: -entry["total"])
+        return result
+
+    def summary(self, num=10):
+        """return a list of text lines with the num most expensive slots"""
+        elapsed = time.time() - self.time_started
+        lines = ["signal profile of the last %d seconds:" % elapsed]
+        for entry in self.get_stats()[:num]:
+            lines.append("%7d calls %8.3fs (max %6.1fms, lock wait %6.3fs) "
+                "%s -> %s" % (entry["count"], entry["total"],
+                entry["max"] * 1000, entry["lock_wait_total"],
+                entry["signal"], entry["slot"]))
+        return lines
+
 
 class BaseObject():
     """This base class only exists because of the debug() method that is used
@@ -305,13 +765,146 @@ class BaseObject():
             logging.debug(msg)
 
 
+class SignalQueue(BaseObject):
+    """opt-in asynchronous dispatch for slow consumers. Slots connected to
+    a signal through a SignalQueue (with SignalQueue.connect()) will not be
+    called by the thread that emits the signal, instead the call is put into
+    a bounded queue and the queue's own worker thread will call them later,
+    in the same order they were emitted. The emitting thread only holds the
+    global Signal._lock for the time it takes to enqueue, so a slow consumer
+    (a UI repainting everything) can no longer stall the receive thread.
+
+    The slots are called without holding Signal._lock, they hold the
+    queue's own lock instead, code that must not run concurrently with them
+    (the consumer's main loop for example) can acquire SignalQueue.lock.
+    If the queue is full the oldest pending call will be dropped."""
+
+    def __init__(self, name, maxlen=1000):
+        BaseObject.__init__(self)
+        self.name = name
+        self.maxlen = maxlen
+        self.lock = threading.RLock()
+        self.count_queued = 0
+        self.count_dropped = 0
+        self.count_processed = 0
+        self.max_depth = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._proxies = []
+        self._terminating = False
+        self._thread = start_thread(self._worker_func)
+
+    def connect(self, signal, slot):
+        """connect the slot to the signal through this queue. Like with
+        Signal.connect() the queue will only hold a weak reference to the
+        object of a method, it won't be kept alive by this connection."""
+        proxy = _QueuedSlot(self, slot)
+        with self._cond:
+            self._proxies = [prx for prx in self._proxies if prx.alive()]
+            self._proxies.append(proxy)
+        signal.connect(proxy.slot)
+
+    def put(self, func, sender, data):
+        """enqueue a call func(sender, data), returns immediately"""
+        # calls that are dropped are only released after the lock, their
+        # objects might have a __del__() that emits a signal again
+        dropped = None
+        with self._cond:
+            if self._terminating:
+                return
+            if len(self._queue) >= self.maxlen:
+                dropped = self._queue.popleft()
+                self.count_dropped += 1
+            self._queue.append((func, sender, data))
+            self.count_queued += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify()
+        del dropped
+
+    def depth(self):
+        """return the number of calls currently waiting in the queue"""
+        return len(self._queue)
+
+    def stats(self):
+        """return a dict with the queue depth and counters"""
+        return {"name": self.name, "depth": self.depth(),
+            "max_depth": self.max_depth, "queued": self.count_queued,
+            "dropped": self.count_dropped, "processed": self.count_processed}
+
+    def stop(self):
+        """stop the worker thread and wait until the slot it is currently
+        calling (if any) has returned, pending calls will be discarded"""
+        with self._cond:
+            self._terminating = True
+            (dropped, self._queue) = (self._queue, collections.deque())
+            self._cond.notify()
+        dropped.clear()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _worker_func(self):
+        """the worker thread, call the queued slots in order"""
+        while True:
+            with self._cond:
+                while not self._queue and not self._terminating:
+                    self._cond.wait()
+                if self._terminating:
+                    return
+                (func, sender, data) = self._queue.popleft()
+            with self.lock:
+                try:
+                    func(sender, data)
+
+                # pylint: disable=W0702
+                except:
+                    Signal.signal_error(self, (traceback.format_exc()), False)
+            self.count_processed += 1
+            del func, sender, data # not while holding self._cond
+
+
+class _QueuedSlot(object):
+    """connected to a signal on behalf of a SignalQueue, it will put the
+    calls into the queue instead of calling the real slot. The queue keeps
+    it alive until the object of the real slot is gone, the signal itself
+    only has a weak reference to it."""
+
+    def __init__(self, queue, slot):
+        self._queue = queue
+        if inspect.ismethod(slot):
+            self._obj = weakref.ref(slot.__self__)
+            self._func = slot.__func__
+        else:
+            self._obj = None
+            self._func = slot
+
+    def alive(self):
+        """False if the slot was a method and its object is gone"""
+        return not self._obj or self._obj() is not None
+
+    def slot(self, sender, data):
+        """enqueue the call"""
+        self._queue.put(self._call, sender, data)
+
+    def _call(self, sender, data):
+        """call the real slot (in the queue's worker thread)"""
+        if self._obj:
+            obj = self._obj()
+            if obj is not None:
+                self._func(obj, sender, data)
+        else:
+            self._func(sender, data)
+
+
 class Timer(Signal):
-    """a simple timer (used for stuff like keepalive)"""
+    """a simple timer (used for stuff like keepalive). If an EventLoop is
+    given the timer will fire in the loop's thread, otherwise every interval
+    will start a new threading.Timer"""
 
-    def __init__(self, interval):
+    def __init__(self, interval, loop=None):
         """create a new timer, interval is in seconds"""
         Signal.__init__(self)
         self._interval = interval
+        self._loop = loop
         self._timer = None
         self._start()
 
@@ -322,15 +915,161 @@ class Timer(Signal):
 
     def _start(self):
         """start the timer"""
-        self._timer = threading.Timer(self._interval, self._fire)
-        self._timer.daemon = True
-        self._timer.start()
+        if self._loop:
+            self._timer = self._loop.call_later(self._interval, self._fire)
+        else:
+            self._timer = threading.Timer(self._interval, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
 
     def cancel(self):
         """cancel the timer"""
         self._timer.cancel()
 
 
+class EventLoop(BaseObject):
+    """a minimal select() based event loop running in its own thread. It
+    calls functions when a socket becomes readable, after a delay (timers)
+    or as soon as possible when requested from another thread. Clients
+    running on an event loop (see BaseClient) don't need their own receive
+    thread and a Timer on the loop does not start a new thread every time
+    it fires. Several Gox instances can share one loop (EventLoop.shared()).
+
+    call_later() and call_soon_threadsafe() can be called from any thread,
+    add_reader() and remove_reader() only from within the loop."""
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        BaseObject.__init__(self)
+        self._lock = threading.Lock()
+        self._timers = [] # heap of (when, seq, _LoopCall)
+        self._seq = itertools.count()
+        self._pending = collections.deque()
+        self._readers = {} # socket -> function
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_send.setblocking(False)
+        self._thread = None
+        self._terminating = False
+
+    @classmethod
+    def shared(cls):
+        """return the application wide event loop, start it if needed"""
+        with cls._shared_lock:
+            if not cls._shared:
+                cls._shared = cls()
+                cls._shared.start()
+            return cls._shared
+
+    def start(self):
+        """start the loop thread"""
+        self._thread = start_thread(self._run)
+
+    def stop(self):
+        """stop the loop thread, pending calls are discarded"""
+        self._terminating = True
+        self._wakeup()
+
+    def call_soon_threadsafe(self, func):
+        """call func() in the loop thread as soon as possible"""
+        self._pending.append(func)
+        self._wakeup()
+
+    def call_later(self, delay, func):
+        """call func() in the loop thread after delay seconds, returns
+        an object with a cancel() method"""
+        call = _LoopCall(func)
+        with self._lock:
+            heapq.heappush(self._timers,
+                (time.time() + delay, next(self._seq), call))
+        self._wakeup()
+        return call
+
+    def add_reader(self, sock, func):
+        """call func() whenever sock is readable (or has been closed)"""
+        self._readers[sock] = func
+
+    def remove_reader(self, sock):
+        """stop watching sock"""
+        self._readers.pop(sock, None)
+
+    def _wakeup(self):
+        """interrupt the select() in the loop thread"""
+        if threading.current_thread() is not self._thread:
+            try:
+                self._wakeup_send.send("x")
+            except socket.error:
+                pass # buffer is full, the loop will wake up anyways
+
+    def _call(self, func):
+        """call func(), log exceptions instead of letting them end the loop"""
+        try:
+            func()
+        except Exception:
+            self.debug(traceback.format_exc())
+
+    def _select(self, timeout):
+        """wait until a socket is readable or the timeout has elapsed,
+        return the list of readable sockets. If another thread has closed
+        one of the sockets then this socket will be reported as readable,
+        so its owner will try to read and find out."""
+        try:
+            return select.select([self._wakeup_recv] + self._readers.keys(),
+                [], [], timeout)[0]
+        except (select.error, socket.error):
+            closed = []
+            for sock in self._readers:
+                try:
+                    sock.fileno()
+                except socket.error:
+                    closed.append(sock)
+            return closed
+
+    def _run(self):
+        """the loop thread"""
+        while not self._terminating:
+            timeout = None
+            if self._pending:
+                timeout = 0
+            else:
+                with self._lock:
+                    if self._timers:
+                        timeout = max(0, self._timers[0][0] - time.time())
+
+            for sock in self._select(timeout):
+                if sock is self._wakeup_recv:
+                    sock.recv(4096)
+                else:
+                    func = self._readers.get(sock)
+                    if func:
+                        self._call(func)
+
+            while self._pending and not self._terminating:
+                self._call(self._pending.popleft())
+
+            now = time.time()
+            due = []
+            with self._lock:
+                while self._timers and self._timers[0][0] <= now:
+                    due.append(heapq.heappop(self._timers)[2])
+            for call in due:
+                if call.func:
+                    self._call(call.func)
+
+
+class _LoopCall(object):
+    """a scheduled call, returned by EventLoop.call_later()"""
+    __slots__ = ["func"]
+
+    def __init__(self, func):
+        self.func = func
+
+    def cancel(self):
+        """don't call it"""
+        self.func = None
+
+
 class Secret:
     """Manage the MtGox API secret. This class has methods to decrypt the
     entries in the ini file and it also provides a method to create these
@@ -491,108 +1230,383 @@ class OHLCV():
         self.vol += volume
 
 
-class History(BaseObject):
-    """represents the trading history"""
+class CandleStore:
+    """keeps candles oldest first in six parallel arrays of 64 bit integers
+    (one per OHLCV attribute) instead of one OHLCV object per candle. The
+    arrays have spare capacity at the end, appending is amortized O(1).
+    If maxlen is not 0 appending to a full store drops the oldest candle.
+    Indexing and iteration return OHLCV() views that are created on the
+    fly, changing them has no effect on the store.
+
+    The arrays are never resized in place, when they are full they are
+    replaced by new ones, so the zero-copy numpy views returned by
+    numpy_columns() stay valid (they just don't see later appends)."""
+
+    COLUMNS = ("tim", "opn", "hig", "low", "cls", "vol")
+
+    def __init__(self, maxlen=0):
+        self.maxlen = maxlen
+        self._start = 0 # index of the oldest candle in the arrays
+        self._size = 0
+        self._columns = self._allocate(16)
+
+    def _allocate(self, capacity):
+        """return a list of new zero filled arrays"""
+        empty = array.array(INT64, [0]) * capacity
+        return [array.array(INT64, empty) for _ in self.COLUMNS]
+
+    def _grow(self):
+        """move the candles into new arrays with room for at least as
+        many candles as are stored now (or maxlen if that is set)"""
+        capacity = 2 * max(self.maxlen or self._size, 8)
+        columns = self._allocate(capacity)
+        end = self._start + self._size
+        for new, old in zip(columns, self._columns):
+            new[:self._size] = old[self._start:end]
+        self._columns = columns
+        self._start = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("candle index out of range")
+        index += self._start
+        return OHLCV(*[int(column[index]) for column in self._columns])
+
+    def __iter__(self):
+        for index in xrange(self._size):
+            yield self[index]
+
+    def append(self, candle):
+        """append the values of this OHLCV as the newest candle"""
+        if self.maxlen and self._size == self.maxlen:
+            self._start += 1
+            self._size -= 1
+        if self._start + self._size == len(self._columns[0]):
+            self._grow()
+        index = self._start + self._size
+        for column, name in zip(self._columns, self.COLUMNS):
+            column[index] = getattr(candle, name)
+        self._size += 1
+
+    def last_tim(self):
+        """return the open time of the newest candle or None if empty"""
+        if self._size:
+            return self._columns[0][self._start + self._size - 1]
+        return None
+
+    def pop(self):
+        """remove the newest candle"""
+        if not self._size:
+            raise IndexError("pop from empty candle store")
+        self._size -= 1
+
+    def update_last(self, price, volume):
+        """like OHLCV.update() but for the newest candle in the store"""
+        if not self._size:
+            raise IndexError("update of empty candle store")
+        (dummy, dummy, hig, low, cls, vol) = self._columns
+        index = self._start + self._size - 1
+        if price > hig[index]:
+            hig[index] = price
+        if price < low[index]:
+            low[index] = price
+        cls[index] = price
+        vol[index] += volume
+
+    def column(self, name, count=0):
+        """return a copy of the named column (one of COLUMNS) as an array,
+        oldest first. If count is not 0 only the newest count candles"""
+        end = self._start + self._size
+        start = self._start
+        if count:
+            start = max(start, end - count)
+        return self._columns[self.COLUMNS.index(name)][start:end]
+
+    def numpy_columns(self):
+        """return a dict of numpy arrays, one for each of the COLUMNS,
+        oldest first. These are views on the store, no data is copied,
+        changes of the current candle will be visible in them but new
+        candles will not. Raises ImportError if numpy is not installed"""
+        if not numpy:
+            raise ImportError("numpy is not installed")
+        end = self._start + self._size
+        return dict((name, numpy.frombuffer(column, numpy.dtype(INT64))
+            [self._start:end]) for name, column
+            in zip(self.COLUMNS, self._columns))
+
 
-    def __init__(self, gox, timeframe):
+class History(BaseObject):
+    """represents the trading history. The candles are kept in a
+    CandleStore, oldest first, new candles are appended at the end and
+    when max_candles is reached the oldest ones are dropped. If
+    max_candles is 0 the history grows without limit. Use candle(index)
+    to access them newest first and numpy_columns() for vectorized
+    calculations.
+
+    Candles of additional timeframes (in seconds) can be maintained from
+    the same trades, each timeframe must be a multiple of the next
+    smaller one. All of them are updated in one pass per trade. The
+    methods that access candles take an optional timeframe, default is
+    the main timeframe (the one shown in the chart)."""
+
+    def __init__(self, gox, timeframe, max_candles=0, timeframes=()):
         BaseObject.__init__(self)
 
         self.signal_changed = Signal()
+        self.signal_new_candle = Signal()
 
         self.gox = gox
-        self.candles = []
         self.timeframe = timeframe
+        self.timeframes = sorted(set([timeframe] + list(timeframes)))
+        if self.timeframes[0] <= 0:
+            raise ValueError("timeframes must be positive")
+        for lower, higher in zip(self.timeframes, self.timeframes[1:]):
+            if higher % lower:
+                raise ValueError("timeframe %d is not a multiple of %d"
+                    % (higher, lower))
+        self.stores = dict((tframe, CandleStore(max_candles))
+            for tframe in self.timeframes)
+        self.candles = self.stores[timeframe]
 
         gox.signal_trade.connect(self.slot_trade)
         gox.signal_fullhistory.connect(self.slot_fullhistory)
 
     def add_candle(self, candle):
-        """add a new candle to the history"""
+        """add a new candle to the history (main timeframe only)"""
         self._add_candle(candle)
         self.signal_changed(self, (self.length()))
 
     def slot_trade(self, dummy_sender, data):
         """slot for gox.signal_trade"""
         (date, price, volume, dummy_typ, own) = data
-        if not own:
-            time_round = int(date / self.timeframe) * self.timeframe
-            candle = self.last_candle()
-            if candle:
-                if candle.tim == time_round:
-                    candle.update(price, volume)
-                    self.signal_changed(self, (1))
-                else:
+        if own:
+            return
+        main_opened = False
+        for timeframe in self.timeframes:
+            store = self.stores[timeframe]
+            time_round = int(date / timeframe) * timeframe
+            if store.last_tim() != time_round:
+                store.append(OHLCV(
+                    time_round, price, price, price, price, volume))
+                if timeframe == self.timeframe:
+                    main_opened = True
                     self.debug("### opening new candle")
-                    self.add_candle(OHLCV(
-                        time_round, price, price, price, price, volume))
+                self.signal_new_candle(self, (timeframe))
             else:
-                self.add_candle(OHLCV(
-                    time_round, price, price, price, price, volume))
+                store.update_last(price, volume)
+        if main_opened:
+            self.signal_changed(self, (self.length()))
+        else:
+            self.signal_changed(self, (1))
 
     def _add_candle(self, candle):
         """add a new candle to the history but don't fire signal_changed"""
-        self.candles.insert(0, candle)
+        self.candles.append(candle)
 
     def slot_fullhistory(self, dummy_sender, data):
-        """process the result of the fullhistory request"""
+        """process the result of the fullhistory request. Every timeframe
+        is built from the trades on its own. The trades are complete from
+        the open time of the last known candle of the main timeframe on
+        (that is what the client requests, see Gox.slot_history_changed)
+        or else from the first trade on. A candle that starts before that
+        is only partially covered, if it already exists it is left as it
+        is and only the candles after it are replaced, otherwise it is
+        built from the trades that are there."""
         (history) = data
+        if not history:
+            return
+        covered = int(history[0]["date"])
+        last_main = self.candles.last_tim()
+        if last_main is not None and last_main <= covered:
+            covered = int(last_main)
+
+        for timeframe in self.timeframes:
+            store = self.stores[timeframe]
+            first = int(covered / timeframe) * timeframe
+
+            #remove existing recent candle(s) if any, we will create them fresh
+            while len(store) and store.last_tim() > first:
+                store.pop()
+            if store.last_tim() == first:
+                if first < covered:
+                    first += timeframe # keep the partial leading candle
+                else:
+                    store.pop()
+
+            candle = None
+            for trade in history:
+                date = int(trade["date"])
+                if date < first:
+                    continue
+                price = int(trade["price_int"])
+                volume = int(trade["amount_int"])
+                time_round = int(date / timeframe) * timeframe
+                if not candle or time_round > candle.tim:
+                    if candle:
+                        store.append(candle)
+                    candle = OHLCV(time_round, price, price, price, price, 0)
+                candle.update(price, volume)
+
+            # insert current (incomplete) candle
+            if candle:
+                store.append(candle)
+
+        self.debug("### got %d trades for the history" % len(history))
+        self.signal_changed(self, (self.length()))
 
-        def get_time_round(date):
-            """round timestamp to current candle timeframe"""
-            return int(date / self.timeframe) * self.timeframe
-
-        #remove existing recent candle(s) if any, we will create them fresh
-        date_begin = get_time_round(int(history[0]["date"]))
-        while len(self.candles) and self.candles[0].tim >= date_begin:
-            self.candles.pop(0)
-
-        new_candle = OHLCV(0, 0, 0, 0, 0, 0) #this is a dummy, not actually inserted
-        count_added = 0
-        for trade in history:
-            date = int(trade["date"])
-            price = int(trade["price_int"])
-            volume = int(trade["amount_int"])
-            time_round = get_time_round(date)
-            if time_round > new_candle.tim:
-                if new_candle.tim > 0:
-                    self._add_candle(new_candle)
-                    count_added += 1
-                new_candle = OHLCV(
-                    time_round, price, price, price, price, volume)
-            new_candle.update(price, volume)
-
-        # insert current (incomplete) candle
-        self._add_candle(new_candle)
-        count_added += 1
-        self.debug("### got %d updated candle(s)" % count_added)
+    def load_candles(self, candles):
+        """replace the candles of the timeframes in the dict candles
+        (timeframe -> list of OHLCV, oldest first, as returned by
+        TradeStore.candles()), the other timeframes are left as they are"""
+        for timeframe, tf_candles in candles.items():
+            store = self.stores[timeframe]
+            while len(store):
+                store.pop()
+            for candle in tf_candles:
+                store.append(candle)
         self.signal_changed(self, (self.length()))
 
-    def last_candle(self):
+    def last_candle(self, timeframe=None):
         """return the last (current) candle or None if empty"""
-        if self.length() > 0:
-            return self.candles[0]
+        store = self.stores[timeframe or self.timeframe]
+        if len(store) > 0:
+            return store[-1]
         else:
             return None
 
-    def length(self):
+    def candle(self, index, timeframe=None):
+        """return the candle at index counted from the newest, candle(0)
+        is the last (current) candle. Raises IndexError if out of range"""
+        if index < 0:
+            raise IndexError("candle index out of range")
+        return self.stores[timeframe or self.timeframe][-1 - index]
+
+    def column(self, name, count=0, timeframe=None):
+        """return a copy of one column (tim, opn, hig, low, cls or vol) of
+        the newest count candles (all if count is 0) as an array, oldest
+        first, see CandleStore.column()"""
+        return self.stores[timeframe or self.timeframe].column(name, count)
+
+    def numpy_columns(self, timeframe=None):
+        """return the candles as a dict of zero-copy numpy arrays, see
+        CandleStore.numpy_columns()"""
+        return self.stores[timeframe or self.timeframe].numpy_columns()
+
+    def length(self, timeframe=None):
         """return the number of candles in the history"""
-        return len(self.candles)
+        return len(self.stores[timeframe or self.timeframe])
+
+
+class TradeStore:
+    """append-only SQLite database of the trades received with fullhistory.
+    Trades are identified by their tid, adding a trade that is already
+    stored has no effect. The trades are returned as dicts in the same
+    format as money/trades so they can be sent through signal_fullhistory,
+    candles of any timeframe are aggregated by SQLite. All methods are
+    thread safe, after close() they do nothing."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS trades ("
+            "tid INTEGER PRIMARY KEY, date INTEGER, price INTEGER, "
+            "volume INTEGER, type TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS trades_date "
+            "ON trades (date)")
+        self._db.commit()
+
+    def close(self):
+        """close the database"""
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def add_trades(self, trades):
+        """store a list of trades as returned by money/trades, return the
+        number of trades that were not yet stored"""
+        with self._lock:
+            if not self._db:
+                return 0
+            count_before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO trades "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(int(trade["tid"]), int(trade["date"]),
+                    int(trade["price_int"]), int(trade["amount_int"]),
+                    trade.get("trade_type", "")) for trade in trades])
+            self._db.commit()
+            return self._db.total_changes - count_before
+
+    def last_tid(self):
+        """return the highest stored tid or 0 if the store is empty"""
+        with self._lock:
+            if not self._db:
+                return 0
+            return self._db.execute(
+                "SELECT MAX(tid) FROM trades").fetchone()[0] or 0
+
+    def trades(self, start=0, end=None):
+        """return the trades with start <= date < end (POSIX timestamps,
+        end=None means all until now), ordered by tid"""
+        with self._lock:
+            if not self._db:
+                return []
+            rows = self._db.execute("SELECT tid, date, price, volume, type "
+                "FROM trades WHERE date >= ? AND date < ? ORDER BY tid",
+                (int(start), int(end or sys.maxint))).fetchall()
+        return [{"tid": str(tid), "date": date, "price_int": str(price),
+            "amount_int": str(volume), "trade_type": typ}
+            for (tid, date, price, volume, typ) in rows]
+
+    def candles(self, timeframe, start=0, end=None):
+        """return a list of OHLCV for the given timeframe (seconds) with
+        start <= open time < end, oldest first"""
+        with self._lock:
+            if not self._db:
+                return []
+            rows = self._db.execute("SELECT c.tim, o.price, c.hig, c.low, "
+                "l.price, c.vol FROM (SELECT date / :tf * :tf AS tim, "
+                "MIN(tid) AS first, MAX(tid) AS last, MAX(price) AS hig, "
+                "MIN(price) AS low, SUM(volume) AS vol FROM trades "
+                "WHERE date >= :start AND date < :end GROUP BY tim) c "
+                "JOIN trades o ON o.tid = c.first "
+                "JOIN trades l ON l.tid = c.last ORDER BY c.tim",
+                {"tf": int(timeframe),
+                 "start": int(start) // int(timeframe) * int(timeframe),
+                 "end": int(end or sys.maxint)}).fetchall()
+        return [OHLCV(*row) for row in rows]
 
 
 class BaseClient(BaseObject):
-    """abstract base class for SocketIOClient and WebsocketClient"""
+    """abstract base class for SocketIOClient and WebsocketClient. If an
+    EventLoop is given the client will not start its own receive thread,
+    connection, reconnect, receiving and timers will then all be handled
+    on the loop (only the connect itself is done in a short lived thread
+    because it blocks). The HTTP API is still used from separate threads."""
 
     _last_nonce = 0
     _nonce_lock = threading.Lock()
 
-    def __init__(self, currency, secret, config):
+    # api key -> lock held while a signed HTTP request gets its nonce and
+    # is sent, so the requests leave in the order of their nonces
+    _http_send_locks = {}
+
+    def __init__(self, currency, secret, config, loop=None):
         BaseObject.__init__(self)
 
         self.signal_recv        = Signal()
         self.signal_fulldepth   = Signal()
+        self.signal_partialdepth = Signal()
         self.signal_fullhistory = Signal()
 
-        self._timer = Timer(60)
+        self.loop = loop
+        self._timer = Timer(60, loop)
         self._timer.connect(self.slot_timer)
 
         self.currency = currency
@@ -600,18 +1614,26 @@ class BaseClient(BaseObject):
         self.config = config
         self.socket = None
         self.http_requests = Queue.Queue()
+        self._http_endpoint_limits = {}
+        self._http_endpoint_lock = threading.Lock()
 
         self._recv_thread = None
-        self._http_thread = None
+        self._http_threads = []
         self._terminating = False
         self.connected = False
         self._time_last_received = 0
         self.history_last_candle = None
+        self.history_since_tid = 0
 
     def start(self):
         """start the client"""
-        self._recv_thread = start_thread(self._recv_thread_func)
-        self._http_thread = start_thread(self._http_thread_func)
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._loop_connect)
+        else:
+            self._recv_thread = start_thread(self._recv_thread_func)
+        workers = max(1, self.config.get_int("gox", "http_workers"))
+        self._http_threads = [start_thread(self._http_thread_func)
+            for dummy in range(workers)]
 
     def stop(self):
         """stop the client"""
@@ -648,26 +1670,41 @@ class BaseClient(BaseObject):
 
     def request_fulldepth(self):
         """start the fulldepth thread"""
-
-        def fulldepth_thread():
-            """request the full market depth, initialize the order book
-            and then terminate. This is called in a separate thread after
-            the streaming API has been connected."""
-            self.debug("requesting initial full depth")
-            use_ssl = self.config.get_bool("gox", "use_ssl")
+        self.debug("requesting full depth")
+        self._request_depth("full", self.signal_fulldepth)
+
+    def request_partialdepth(self):
+        """start a thread to request the depth around the current price,
+        the result will be sent with signal_partialdepth"""
+        self.debug("requesting partial depth")
+        self._request_depth("fetch", self.signal_partialdepth)
+
+    def _request_depth(self, which, signal):
+        """request money/depth/<which> in a separate thread, parse it while
+        it is downloading and send the result with the signal"""
+
+        def depth_thread():
+            """request the market depth, emit the signal and then
+            terminate. This is called in a separate thread after the
+            streaming API has been connected."""
+            use_ssl = self._use_ssl()
             proto = {True: "https", False: "http"}[use_ssl]
-            fulldepth = http_request(proto + "://" +  HTTP_HOST \
-                + "/api/2/BTC" + self.currency + "/money/depth/full")
-            self.signal_fulldepth(self, (json.loads(fulldepth)))
+            parser = FulldepthParser()
+            HTTP_POOL.receive_stream(HTTP_POOL.send(proto + "://" + HTTP_HOST \
+                + "/api/2/BTC" + self.currency + "/money/depth/" + which),
+                parser.feed)
+            signal(self, (parser.close()))
 
-        start_thread(fulldepth_thread)
+        start_thread(depth_thread)
 
     def request_history(self):
         """request trading history"""
 
         # Gox() will have set this field to the timestamp of the last
-        # known candle, so we only request data since this time
+        # known candle, so we only request data since this time. If it
+        # keeps a TradeStore it sets the last stored tid instead
         since = self.history_last_candle
+        since_tid = self.history_since_tid
 
         def history_thread():
             """request trading history"""
@@ -675,13 +1712,15 @@ class BaseClient(BaseObject):
             # 1308503626, 218868 <-- last small transacion ID
             # 1309108565, 1309108565842636 <-- first big transaction ID
 
-            if since:
+            if since_tid:
+                querystring = "?since=" + str(since_tid)
+            elif since:
                 querystring = "?since=" + str(since * 1000000)
             else:
                 querystring = ""
 
             self.debug("requesting history")
-            use_ssl = self.config.get_bool("gox", "use_ssl")
+            use_ssl = self._use_ssl()
             proto = {True: "https", False: "http"}[use_ssl]
             json_hist = http_request(proto + "://" +  HTTP_HOST \
                 + "/api/2/BTC" + self.currency + "/money/trades"
@@ -692,11 +1731,115 @@ class BaseClient(BaseObject):
 
         start_thread(history_thread)
 
-    def _recv_thread_func(self):
-        """this will be executed as the main receiving thread, each type of
-        client (websocket or socketio) will implement its own"""
+    def _use_ssl(self):
+        """return True if the connections should use SSL, see ssl_enabled()"""
+        return ssl_enabled(self.config)
+
+    def _connect_socket(self):
+        """create self.socket and connect it, each type of client
+        (websocket or socketio) will implement its own"""
+        raise NotImplementedError()
+
+    def _handle_message(self, msg):
+        """handle one received message (a memoryview that is only valid
+        until the next recv), each type of client will implement its own"""
         raise NotImplementedError()
 
+    def _on_connected(self):
+        """the socket is connected, subscribe and start receiving"""
+        self._time_last_received = time.time()
+        self.connected = True
+        self.debug("connected, subscribing needed channels")
+        self.channel_subscribe()
+        self.debug("waiting for data...")
+
+    def _recv_thread_func(self):
+        """this is the main thread that is running all the time. It will
+        connect and then read (blocking) on the socket in an infinite
+        loop. Try to reconnect whenever connection is lost."""
+        while not self._terminating: #loop 0 (connect, reconnect)
+            try:
+                self._connect_socket()
+                self._on_connected()
+                while not self._terminating: #loop1 (read messages)
+                    # the view points into the socket's receive buffer
+                    dummy_opcode, msg = self.socket.recv_data_view()
+                    if msg is None:
+                        raise IOError("connection closed by server")
+                    self._handle_message(msg)
+
+            except Exception as exc:
+                self.connected = False
+                if not self._terminating:
+                    self.debug(exc.__class__.__name__, exc,
+                        "reconnecting in 1 seconds...")
+                    if self.socket:
+                        self.socket.close()
+                    time.sleep(1)
+
+    def _loop_connect(self):
+        """(event loop) connect in a short lived thread, when connected
+        the socket will be added to the loop (see _loop_connected())"""
+
+        def connect_thread():
+            """connect and then hand the socket over to the loop"""
+            try:
+                self._connect_socket()
+                self.loop.call_soon_threadsafe(self._loop_connected)
+            except Exception as exc:
+                if not self._terminating:
+                    self.debug(exc.__class__.__name__, exc,
+                        "reconnecting in 1 seconds...")
+                    if self.socket:
+                        self.socket.close()
+                    self.loop.call_later(1, self._loop_connect)
+
+        if not self._terminating:
+            start_thread(connect_thread)
+
+    def _loop_connected(self):
+        """(event loop) the socket is connected, start receiving"""
+        if self._terminating:
+            self.socket.close()
+            return
+        self.loop.add_reader(self.socket.sock, self._loop_readable)
+        try:
+            self._on_connected()
+            # the handshake might have received more than it needed
+            self._loop_handle_frames(self.socket)
+        except Exception as exc:
+            self._loop_disconnected(self.socket, exc)
+
+    def _loop_readable(self):
+        """(event loop) read what has arrived and handle all complete
+        messages, reconnect if anything goes wrong"""
+        sock = self.socket
+        try:
+            sock.recv_available()
+            self._loop_handle_frames(sock)
+        except Exception as exc:
+            self._loop_disconnected(sock, exc)
+
+    def _loop_handle_frames(self, sock):
+        """(event loop) handle all complete frames in the receive buffer"""
+        while sock.frame_ready():
+            opcode, msg = sock.recv_frame_view()
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                raise IOError("connection closed by server")
+            if opcode in (websocket.ABNF.OPCODE_TEXT,
+                          websocket.ABNF.OPCODE_BINARY):
+                self._handle_message(msg)
+
+    def _loop_disconnected(self, sock, exc):
+        """(event loop) remove the socket from the loop and reconnect"""
+        self.loop.remove_reader(sock.sock)
+        self.connected = False
+        sock.close()
+        if not self._terminating:
+            self.debug(exc.__class__.__name__, exc,
+                "reconnecting in 1 seconds...")
+            self.loop.call_later(1, self._loop_connect)
+
     def channel_subscribe(self):
         """subscribe to the needed channels and alo initiate the
         download of the initial full market depth"""
@@ -715,7 +1858,7 @@ class BaseClient(BaseObject):
             self.send_signed_call("private/orders", {}, "orders")
             self.send_signed_call("private/info", {}, "info")
 
-        if self.config.get_bool("gox", "load_fulldepth"):
+        if self.config.get_string("gox", "load_fulldepth") in ("True", "snapshot"):
             if not FORCE_NO_FULLDEPTH:
                 self.request_fulldepth()
 
@@ -725,11 +1868,15 @@ class BaseClient(BaseObject):
 
     def _http_thread_func(self):
         """send queued http requests to the http API (only used when
-        http api is forced, normally this is much slower)"""
+        http api is forced, normally this is much slower). There are
+        http_workers of these threads, so requests are sent one after
+        the other but their responses are awaited in parallel, see
+        http_signed_call()"""
         while not self._terminating:
-            (api_endpoint, params, reqid) = self.http_requests.get(True)
+            (api_endpoint, params, reqid, attempt) = self.http_requests.get(True)
             try:
-                answer = self.http_signed_call(api_endpoint, params)
+                with self._http_endpoint_limit(api_endpoint):
+                    answer = self.http_signed_call(api_endpoint, params)
                 if answer["result"] == "success":
                     # the following will reformat the answer in such a way
                     # that we can pass it directly to signal_recv()
@@ -756,7 +1903,8 @@ class BaseClient(BaseObject):
                         retry = False
 
                     if retry:
-                        self.enqueue_http_request(api_endpoint, params, reqid)
+                        self._retry_http_request(
+                            api_endpoint, params, reqid, attempt)
 
             except Exception as exc:
                 # should this ever happen? HTTP 5xx wont trigger this,
@@ -767,14 +1915,47 @@ class BaseClient(BaseObject):
 
             self.http_requests.task_done()
 
+    def _http_endpoint_limit(self, api_endpoint):
+        """return the semaphore that limits the number of concurrent
+        requests to this endpoint to http_endpoint_concurrency"""
+        with self._http_endpoint_lock:
+            limit = self._http_endpoint_limits.get(api_endpoint)
+            if not limit:
+                count = self.config.get_int("gox", "http_endpoint_concurrency")
+                limit = threading.BoundedSemaphore(max(1, count))
+                self._http_endpoint_limits[api_endpoint] = limit
+            return limit
+
+    def _retry_http_request(self, api_endpoint, params, reqid, attempt):
+        """enqueue the failed request again after an exponentially growing
+        and randomized delay (see HTTP_RETRY_DELAY), give up after
+        HTTP_MAX_RETRIES attempts"""
+        if attempt >= HTTP_MAX_RETRIES:
+            self.debug("### giving up after %d retries:" % attempt,
+                api_endpoint, reqid)
+            return
+        delay = min(HTTP_RETRY_DELAY * 2 ** attempt, HTTP_RETRY_MAX_DELAY)
+        delay *= random.uniform(0.5, 1.5)
+        timer = threading.Timer(delay, self.http_requests.put,
+            ((api_endpoint, params, reqid, attempt + 1),))
+        timer.daemon = True
+        timer.start()
+
     def enqueue_http_request(self, api_endpoint, params, reqid):
         """enqueue a request for sending to the HTTP API, returns
         immediately, behaves exactly like sending it over the websocket."""
         if self.secret and self.secret.know_secret():
-            self.http_requests.put((api_endpoint, params, reqid))
+            self.http_requests.put((api_endpoint, params, reqid, 0))
 
     def http_signed_call(self, api_endpoint, params):
-        """send a signed request to the HTTP API V2"""
+        """send a signed request to the HTTP API V2. This can be called
+        from more than one thread at the same time, the nonce is created
+        and the request is sent while holding a lock for this api key so
+        the requests leave in the order of their nonces, only the
+        responses are awaited in parallel. The pooled connections are
+        independent, so a request can still overtake an earlier one on
+        the way, if the server rejects its nonce the error result makes
+        _http_thread_func() send it again with a new one."""
         if (not self.secret) or (not self.secret.know_secret()):
             self.debug("### don't know secret, cannot call %s" % api_endpoint)
             return
@@ -782,27 +1963,28 @@ class BaseClient(BaseObject):
         key = self.secret.key
         sec = self.secret.secret
 
-        params["nonce"] = self.get_nonce()
-        post = urlencode(params)
-        prefix = api_endpoint + chr(0)
-        # pylint: disable=E1101
-        sign = hmac.new(base64.b64decode(sec), prefix + post, hashlib.sha512).digest()
-
-        headers = {
-            'Rest-Key': key,
-            'Rest-Sign': base64.b64encode(sign)
-        }
-
-        use_ssl = self.config.get_bool("gox", "use_ssl")
+        use_ssl = self._use_ssl()
         proto = {True: "https", False: "http"}[use_ssl]
         url = proto + "://" + HTTP_HOST + "/api/2/" + api_endpoint
-
         self.debug("### (%s) calling %s" % (proto, url))
-        return json.loads(http_request(url, post, headers))
 
-        #req = URLRequest(url, post, headers)
-        #with contextlib.closing(urlopen(req, post)) as res:
-        #    return json.load(res)
+        with self._nonce_lock:
+            send_lock = self._http_send_locks.setdefault(key, threading.Lock())
+        with send_lock:
+            params["nonce"] = self.get_nonce()
+            post = urlencode(params)
+            prefix = api_endpoint + chr(0)
+            # pylint: disable=E1101
+            sign = hmac.new(base64.b64decode(sec), prefix + post, hashlib.sha512).digest()
+
+            headers = {
+                'Rest-Key': key,
+                'Rest-Sign': base64.b64encode(sign)
+            }
+            sent = HTTP_POOL.send(url, post, headers)
+
+        dummy_status, data = HTTP_POOL.receive(sent)
+        return json.loads(data)
 
 
     def send_signed_call(self, api_endpoint, params, reqid):
@@ -878,49 +2060,31 @@ class WebsocketClient(BaseClient):
     """this implements a connection to MtGox through the older (but faster)
     websocket protocol. Unfortuntely its just as unreliable as the socket.io."""
 
-    def __init__(self, currency, secret, config):
-        BaseClient.__init__(self, currency, secret, config)
+    def __init__(self, currency, secret, config, loop=None):
+        BaseClient.__init__(self, currency, secret, config, loop)
         self.hostname = WEBSOCKET_HOST
 
-    def _recv_thread_func(self):
-        """connect to the websocket and start receiving in an infinite loop.
-        Try to reconnect whenever connection is lost. Each received json
-        string will be dispatched with a signal_recv signal"""
-        reconnect_time = 1
-        use_ssl = self.config.get_bool("gox", "use_ssl")
+    def _connect_socket(self):
+        """connect to the websocket"""
+        use_ssl = self._use_ssl()
         wsp = {True: "wss://", False: "ws://"}[use_ssl]
         port = {True: 443, False: 80}[use_ssl]
-        ws_origin = "%s:%d" % (self.hostname, port)
+        # the hostname might contain a port already (a test server)
+        ws_origin = "%s:%d" % (self.hostname.split(":")[0], port)
         ws_headers = ["User-Agent: %s" % USER_AGENT]
-        while not self._terminating:  #loop 0 (connect, reconnect)
-            try:
-                ws_url = wsp + self.hostname \
-                    + "/mtgox?Currency=" + self.currency
-
-                self.debug("trying plain old Websocket: %s ... " % ws_url)
+        ws_url = wsp + self.hostname + "/mtgox?Currency=" + self.currency
 
-                self.socket = websocket.WebSocket()
-                self.socket.connect(ws_url, origin=ws_origin, header=ws_headers)
-                self._time_last_received = time.time()
-                self.connected = True
-                self.debug("connected, subscribing needed channels")
-                self.channel_subscribe()
+        self.debug("trying plain old Websocket: %s ... " % ws_url)
 
-                self.debug("waiting for data...")
-                while not self._terminating: #loop1 (read messages)
-                    str_json = self.socket.recv()
-                    self._time_last_received = time.time()
-                    if str_json[0] == "{":
-                        self.signal_recv(self, (str_json))
+        self.socket = websocket.WebSocket()
+        self.socket.connect(ws_url, origin=ws_origin, header=ws_headers)
 
-            except Exception as exc:
-                self.connected = False
-                if not self._terminating:
-                    self.debug(exc.__class__.__name__, exc,
-                        "reconnecting in %i seconds..." % reconnect_time)
-                    if self.socket:
-                        self.socket.close()
-                    time.sleep(reconnect_time)
+    def _handle_message(self, msg):
+        """each received json string will be dispatched
+        with a signal_recv signal"""
+        self._time_last_received = time.time()
+        if msg[:1].tobytes() == "{":
+            self.signal_recv(self, (msg.tobytes()))
 
     def send(self, json_str):
         """send the json encoded string over the websocket"""
@@ -939,21 +2103,18 @@ class SocketIO(websocket.WebSocket):
         """connect to socketio and then upgrade to websocket transport. Example:
         connect('wss://websocket.mtgox.com/socket.io/1', query='Currency=EUR')"""
 
-        def read_block(sock):
+        def read_block():
             """read from the socket until empty line, return list of lines"""
             lines = []
-            line = ""
             while True:
-                res = sock.recv(1)
-                line += res
-                if res == "":
+                try:
+                    # pylint: disable=W0212
+                    line = self._recv_line().strip()
+                except websocket.WebSocketConnectionClosedException:
                     return None
-                if res == "\n":
-                    line = line.strip()
-                    if line == "":
-                        return lines
-                    lines.append(line)
-                    line = ""
+                if line == "":
+                    return lines
+                lines.append(line)
 
         # pylint: disable=W0212
         hostname, port, resource, is_secure = websocket._parse_url(url)
@@ -971,12 +2132,12 @@ class SocketIO(websocket.WebSocket):
         self.io_sock.send("Connection: keep-alive\r\n")
         self.io_sock.send("\r\n")
 
-        headers = read_block(self.io_sock)
+        headers = read_block()
         if not headers:
             raise IOError("disconnected while reading headers")
         if not "200" in headers[0]:
             raise IOError("wrong answer: %s" % headers[0])
-        result = read_block(self.io_sock)
+        result = read_block()
         if not result:
             raise IOError("disconnected while reading socketio session ID")
         if len(result) != 3:
@@ -994,58 +2155,39 @@ class SocketIOClient(BaseClient):
     """this implements a connection to MtGox using the new socketIO protocol.
     This should replace the older plain websocket API"""
 
-    def __init__(self, currency, secret, config):
-        BaseClient.__init__(self, currency, secret, config)
+    def __init__(self, currency, secret, config, loop=None):
+        BaseClient.__init__(self, currency, secret, config, loop)
         self.hostname = SOCKETIO_HOST
         self._timer.connect(self.slot_keepalive_timer)
 
-    def _recv_thread_func(self):
-        """this is the main thread that is running all the time. It will
-        connect and then read (blocking) on the socket in an infinite
-        loop. SocketIO messages ('2::', etc.) are handled here immediately
-        and all received json strings are dispathed with signal_recv."""
-        use_ssl = self.config.get_bool("gox", "use_ssl")
+    def _connect_socket(self):
+        """connect to socket.io and join the mtgox endpoint"""
+        use_ssl = self._use_ssl()
         wsp = {True: "wss://", False: "ws://"}[use_ssl]
-        while not self._terminating: #loop 0 (connect, reconnect)
-            try:
-                self.debug("trying Socket.IO: %s ..." % self.hostname)
+        self.debug("trying Socket.IO: %s ..." % self.hostname)
 
-                self.socket = SocketIO()
-                self.socket.connect(wsp + self.hostname + "/socket.io/1",
-                    query="Currency=" + self.currency)
+        self.socket = SocketIO()
+        self.socket.connect(wsp + self.hostname + "/socket.io/1",
+            query="Currency=" + self.currency)
 
-                self._time_last_received = time.time()
-                self.connected = True
-                self.debug("connected")
-                self.socket.send("1::/mtgox")
+        self.debug("connected")
+        self.socket.send("1::/mtgox")
+        self.debug(self.socket.recv())
+        self.debug(self.socket.recv())
 
-                self.debug(self.socket.recv())
-                self.debug(self.socket.recv())
-
-                self.debug("subscribing to channels")
-                self.channel_subscribe()
-
-                self.debug("waiting for data...")
-                while not self._terminating: #loop1 (read messages)
-                    msg = self.socket.recv()
-                    if msg == "2::":
-                        self.debug("### ping -> pong")
-                        self.socket.send("2::")
-                        continue
-                    prefix = msg[:10]
-                    if prefix == "4::/mtgox:":
-                        str_json = msg[10:]
-                        if str_json[0] == "{":
-                            self._time_last_received = time.time()
-                            self.signal_recv(self, (str_json))
-
-            except Exception as exc:
-                self.connected = False
-                if not self._terminating:
-                    self.debug(exc.__class__.__name__, exc, \
-                        "reconnecting in 1 seconds...")
-                    self.socket.close()
-                    time.sleep(1)
+    def _handle_message(self, msg):
+        """SocketIO messages ('2::', etc.) are handled here immediately
+        and all received json strings are dispathed with signal_recv."""
+        prefix = msg[:10].tobytes()
+        if prefix == "2::":
+            self.debug("### ping -> pong")
+            self.socket.send("2::")
+        elif prefix == "4::/mtgox:":
+            # copy only the json part out of the receive buffer
+            str_json = msg[10:].tobytes()
+            if str_json[:1] == "{":
+                self._time_last_received = time.time()
+                self.signal_recv(self, (str_json))
 
     def send(self, json_str):
         """send a string to the websocket. This method will prepend it
@@ -1061,6 +2203,387 @@ class SocketIOClient(BaseClient):
             self._try_send_raw("2::")
 
 
+class FeedRecorder(BaseObject):
+    """record everything a client receives (signal_recv) and the results
+    of its HTTP requests (fulldepth, partial depth and history) to an
+    append-only file, for replaying it later with FeedReader. The slots
+    only put the records into a bounded queue, a background thread
+    compresses and writes them. If the queue is full records are dropped
+    (and counted) instead of blocking the receive thread.
+
+    The file is a sequence of blocks, each starts with _BLOCK_HEADER
+    (magic, type, time of first record, number of records, size) followed
+    by the zlib compressed payload. A data block ("D") contains records,
+    each is _RECORD_HEADER (time, kind, size) followed by the data. An
+    index block ("I") contains the offset of the previous index block
+    (-1 if none) followed by one _INDEX_ENTRY (offset, first time, last
+    time, records) per data block since the previous index block. When
+    the file is closed a last index block and _TRAILER (magic, offset of
+    the last index block) are appended."""
+
+    KINDS = ("recv", "fulldepth", "partialdepth", "fullhistory")
+
+    _BLOCK_HEADER = struct.Struct("<4scdII")
+    _RECORD_HEADER = struct.Struct("<dBI")
+    _INDEX_PREV = struct.Struct("<q")
+    _INDEX_ENTRY = struct.Struct("<QddI")
+    _TRAILER = struct.Struct("<4sQ")
+    _BLOCK_MAGIC = "GOXF"
+    _TRAILER_MAGIC = "GOXT"
+
+    def __init__(self, basename, rotate_bytes=FEED_ROTATE_BYTES,
+            rotate_seconds=FEED_ROTATE_SECONDS):
+        """record into files named basename.YYYYmmdd-HHMMSS, a new one is
+        started after rotate_bytes or rotate_seconds (0 means never)"""
+        BaseObject.__init__(self)
+        self.basename = basename
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.filename = None
+        self.count_records = 0
+        self.count_dropped = 0
+        self.count_blocks = 0
+        self._queue = Queue.Queue(FEED_QUEUE_SIZE)
+        self._file = None
+        self._time_opened = 0
+        self._records = []      # serialized records of the current block
+        self._records_size = 0
+        self._time_first = 0
+        self._time_last = 0
+        self._index = []        # index entries since the last index block
+        self._index_offset = -1 # offset of the last index block
+        self._thread = start_thread(self._writer_func)
+
+    def connect(self, client):
+        """record the signals of this client"""
+        client.signal_recv.connect(self.slot_recv)
+        client.signal_fulldepth.connect(self.slot_fulldepth)
+        client.signal_partialdepth.connect(self.slot_partialdepth)
+        client.signal_fullhistory.connect(self.slot_fullhistory)
+
+    def slot_recv(self, dummy_sender, data):
+        """Slot for signal_recv, record the raw message"""
+        self.record("recv", data)
+
+    def slot_fulldepth(self, dummy_sender, data):
+        """Slot for signal_fulldepth, record the parsed depth"""
+        self.record("fulldepth", data)
+
+    def slot_partialdepth(self, dummy_sender, data):
+        """Slot for signal_partialdepth, record the parsed depth"""
+        self.record("partialdepth", data)
+
+    def slot_fullhistory(self, dummy_sender, data):
+        """Slot for signal_fullhistory, record the list of trades"""
+        self.record("fullhistory", data)
+
+    def record(self, kind, data):
+        """enqueue a record, data is a string or (for anything else than
+        recv) an object that will be serialized with json.dumps()"""
+        try:
+            self._queue.put_nowait((time.time(), kind, data))
+        except Queue.Full:
+            self.count_dropped += 1
+
+    def close(self):
+        """write everything that is still queued and close the file"""
+        self._queue.put((0, None, None))
+        self._thread.join()
+
+    def _writer_func(self):
+        """the writer thread, collect records into blocks and write them"""
+        while True:
+            try:
+                (timestamp, kind, data) = self._queue.get(
+                    True, FEED_FLUSH_INTERVAL)
+            except Queue.Empty:
+                self._write_block()
+                continue
+            if kind is None:
+                self._write_block()
+                self._close_file()
+                return
+            if kind != "recv":
+                data = json.dumps(data, separators=(",", ":"))
+            if not self._records:
+                self._time_first = timestamp
+            self._time_last = timestamp
+            self._records.append(self._RECORD_HEADER.pack(
+                timestamp, self.KINDS.index(kind), len(data)))
+            self._records.append(data)
+            self._records_size += self._RECORD_HEADER.size + len(data)
+            self.count_records += 1
+            if self._records_size >= FEED_BLOCK_SIZE \
+                    or timestamp - self._time_first > FEED_FLUSH_INTERVAL:
+                self._write_block()
+
+    def _write_block(self):
+        """compress and write the current block, rotate if needed"""
+        if not self._records:
+            return
+        try:
+            if self._file and self._need_rotate():
+                self._close_file()
+            if not self._file:
+                self._open_file()
+            offset = self._file.tell()
+            count = len(self._records) / 2
+            self._write(self._file, "D", self._time_first, count,
+                "".join(self._records))
+            self._index.append(self._INDEX_ENTRY.pack(
+                offset, self._time_first, self._time_last, count))
+            self.count_blocks += 1
+            if len(self._index) >= FEED_INDEX_INTERVAL:
+                self._write_index()
+            self._file.flush()
+        except (IOError, OSError) as exc:
+            self.debug("### could not write feed record:", exc)
+        self._records = []
+        self._records_size = 0
+
+    def _write(self, outfile, typ, timestamp, count, payload):
+        """write one block"""
+        compressed = zlib.compress(payload)
+        outfile.write(self._BLOCK_HEADER.pack(self._BLOCK_MAGIC, typ,
+            timestamp, count, len(compressed)))
+        outfile.write(compressed)
+
+    def _write_index(self):
+        """write an index block for the data blocks since the last one"""
+        if not self._index:
+            return
+        offset = self._file.tell()
+        self._write(self._file, "I", time.time(), len(self._index),
+            self._INDEX_PREV.pack(self._index_offset) + "".join(self._index))
+        self._index_offset = offset
+        self._index = []
+
+    def _need_rotate(self):
+        """return True if the current file is big or old enough"""
+        if self.rotate_bytes and self._file.tell() >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds \
+                and time.time() - self._time_opened >= self.rotate_seconds:
+            return True
+        return False
+
+    def _open_file(self):
+        """start a new file named after the current time"""
+        filename = "%s.%s" % (self.basename,
+            time.strftime("%Y%m%d-%H%M%S"))
+        number = 1
+        while os.path.exists(filename):
+            number += 1
+            filename = "%s.%s-%d" % (self.basename,
+                time.strftime("%Y%m%d-%H%M%S"), number)
+        self.debug("### recording feed to", filename)
+        self.filename = filename
+        self._file = open(filename, "ab")
+        self._time_opened = time.time()
+        self._index_offset = -1
+
+    def _close_file(self):
+        """write the last index block and the trailer, close the file"""
+        if not self._file:
+            return
+        try:
+            self._write_index()
+            self._file.write(self._TRAILER.pack(
+                self._TRAILER_MAGIC, self._index_offset))
+            self._file.close()
+        except (IOError, OSError) as exc:
+            self.debug("### could not close feed file:", exc)
+        self._file = None
+
+
+class FeedReader:
+    """read the records of files written by FeedRecorder. The files are
+    read in the given order (for rotated files the alphabetical order of
+    their names is also their time order, see feed_files())"""
+
+    def __init__(self, filenames):
+        if isinstance(filenames, basestring):
+            filenames = [filenames]
+        self.filenames = filenames
+
+    def blocks(self, filename):
+        """return a list of (offset, first time, last time, records) of the
+        data blocks in the file. If the file has been closed properly this
+        is read from the index blocks, otherwise all block headers are
+        scanned (a file that was not closed can be read nevertheless)"""
+        with open(filename, "rb") as infile:
+            infile.seek(0, os.SEEK_END)
+            size = infile.tell()
+            trailer = FeedRecorder._TRAILER
+            if size >= trailer.size:
+                infile.seek(size - trailer.size)
+                (magic, offset) = trailer.unpack(infile.read(trailer.size))
+                if magic == FeedRecorder._TRAILER_MAGIC:
+                    return self._blocks_from_index(infile, offset)
+            return self._blocks_from_headers(infile, size)
+
+    def _blocks_from_index(self, infile, offset):
+        """follow the chain of index blocks backwards"""
+        groups = []
+        while offset >= 0:
+            (dummy_typ, dummy_time, count, payload) = \
+                self._read_block(infile, offset)
+            (offset,) = FeedRecorder._INDEX_PREV.unpack_from(payload)
+            entry = FeedRecorder._INDEX_ENTRY
+            groups.append([entry.unpack_from(payload,
+                FeedRecorder._INDEX_PREV.size + i * entry.size)
+                for i in range(count)])
+        return [block for group in reversed(groups) for block in group]
+
+    def _blocks_from_headers(self, infile, size):
+        """scan all block headers from the start of the file"""
+        header = FeedRecorder._BLOCK_HEADER
+        result = []
+        offset = 0
+        while offset + header.size <= size:
+            infile.seek(offset)
+            (magic, typ, timestamp, count, length) = header.unpack(
+                infile.read(header.size))
+            if magic != FeedRecorder._BLOCK_MAGIC \
+                    or offset + header.size + length > size:
+                break # the end of a file that was not closed
+            if typ == "D":
+                result.append((offset, timestamp, None, count))
+            offset += header.size + length
+        return result
+
+    def _read_block(self, infile, offset):
+        """return (type, time, count, payload) of the block at offset"""
+        header = FeedRecorder._BLOCK_HEADER
+        infile.seek(offset)
+        (magic, typ, timestamp, count, length) = header.unpack(
+            infile.read(header.size))
+        if magic != FeedRecorder._BLOCK_MAGIC:
+            raise ValueError("not a feed block at offset %d" % offset)
+        return typ, timestamp, count, zlib.decompress(infile.read(length))
+
+    def records(self, start=0):
+        """generator of (time, kind, data) for all records, the data of
+        the recv records is the string as it was received, everything else
+        is decoded with json.loads(). Records before start are skipped,
+        whole blocks are skipped with the help of the index."""
+        record = FeedRecorder._RECORD_HEADER
+        for filename in self.filenames:
+            with open(filename, "rb") as infile:
+                for (offset, dummy_first, last, dummy_count) \
+                        in self.blocks(filename):
+                    if last is not None and last < start:
+                        continue
+                    (dummy_typ, dummy_time, count, payload) = \
+                        self._read_block(infile, offset)
+                    pos = 0
+                    for dummy in xrange(count):
+                        (timestamp, kind, length) = \
+                            record.unpack_from(payload, pos)
+                        pos += record.size
+                        data = payload[pos:pos + length]
+                        pos += length
+                        if timestamp < start:
+                            continue
+                        kind = FeedRecorder.KINDS[kind]
+                        if kind != "recv":
+                            data = json.loads(data)
+                        yield timestamp, kind, data
+
+
+class ReplayClient(BaseClient):
+    """plays back recorded feed files (see FeedRecorder) instead of
+    connecting to MtGox. Gox will use it in place of SocketIOClient or
+    WebsocketClient when FORCE_REPLAY is set. The records are emitted with
+    the same signals the other clients use, with the original timing
+    divided by speed, or as fast as possible if speed is 0. Nothing is ever
+    sent, orders and API calls will only be logged."""
+
+    def __init__(self, currency, secret, config, filenames, speed=1):
+        BaseClient.__init__(self, currency, secret, config)
+        self._timer.cancel() # there is no socket that could time out
+        self.reader = FeedReader(filenames)
+        self.speed = speed
+        self.count_replayed = 0
+        self.duration = 0
+        self.finished = threading.Event()
+        self._signals = {
+            "recv": self.signal_recv,
+            "fulldepth": self.signal_fulldepth,
+            "partialdepth": self.signal_partialdepth,
+            "fullhistory": self.signal_fullhistory}
+
+    def start(self):
+        """start the replay thread"""
+        self._recv_thread = start_thread(self._replay_thread_func)
+
+    def stop(self):
+        """stop the replay"""
+        self._terminating = True
+        self._timer.cancel()
+
+    def _replay_thread_func(self):
+        """emit all records, wait between them unless speed is 0"""
+        self.debug("### replaying %s" % ", ".join(self.reader.filenames))
+        self.connected = True
+        time_start = time.time()
+        time_first = None
+        for (timestamp, kind, data) in self.reader.records():
+            if self._terminating:
+                break
+            if self.speed:
+                if time_first is None:
+                    time_first = timestamp
+                delay = time_start + (timestamp - time_first) / self.speed \
+                    - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self._time_last_received = time.time()
+            self._signals[kind](self, (data))
+            self.count_replayed += 1
+        self.duration = time.time() - time_start
+        self.connected = False
+        self.debug("### replay finished: %d records in %.1f seconds" %
+            (self.count_replayed, self.duration))
+        self.finished.set()
+
+    def slot_timer(self, _sender, _data):
+        """there is no socket, pauses in the recording are not a timeout"""
+        pass
+
+    def send(self, json_str):
+        """nothing is sent during replay"""
+        self.debug("### replay, not sending:", json_str)
+
+    def send_signed_call(self, api_endpoint, params, reqid):
+        """nothing is sent during replay"""
+        self.debug("### replay, not calling %s" % api_endpoint, params)
+
+    def enqueue_http_request(self, api_endpoint, params, reqid):
+        """nothing is sent during replay"""
+        self.debug("### replay, not calling %s" % api_endpoint, params)
+
+    def request_fulldepth(self):
+        """the recorded fulldepth will be replayed"""
+        pass
+
+    def request_partialdepth(self):
+        """the recorded partial depth will be replayed"""
+        pass
+
+    def request_history(self):
+        """the recorded history will be replayed"""
+        pass
+
+
+def feed_files(basename):
+    """return the sorted names of all files FeedRecorder(basename) has
+    written, or [basename] if that is the name of a single file"""
+    if os.path.isfile(basename):
+        return [basename]
+    return sorted(glob.glob(basename + ".*"))
+
+
 # pylint: disable=R0902
 class Gox(BaseObject):
     """represents the API of the MtGox exchange. An Instance of this
@@ -1072,15 +2595,25 @@ class Gox(BaseObject):
         """initialize the gox API but do not yet connect to it."""
         BaseObject.__init__(self)
 
+        # debug output of the constructor, nobody can have connected to
+        # signal_debug yet, it will be sent when start() is called
+        self._startup_messages = []
+
         self.signal_depth           = Signal()
         self.signal_trade           = Signal()
         self.signal_ticker          = Signal()
         self.signal_fulldepth       = Signal()
+        self.signal_partialdepth    = Signal()
         self.signal_fullhistory     = Signal()
         self.signal_wallet          = Signal()
         self.signal_userorder       = Signal()
         self.signal_orderlag        = Signal()
 
+        # the same as signal_depth with the "now" stamp of the message as
+        # fifth element, the OrderBook needs it to detect stale and lost
+        # depth messages. Strategies should use signal_depth
+        self.signal_depth_stamped   = Signal()
+
         # the following are not fired by gox itself but by the
         # application controlling it to pass some of its events
         self.signal_keypress        = Signal()
@@ -1091,50 +2624,185 @@ class Gox(BaseObject):
         self.order_lag = 0
         self.last_tid = 0
         self.count_submitted = 0  # number of submitted orders not yet acked
+        self.count_prefiltered = 0  # messages dropped without decoding
+
+        # handler tables for slot_recv() and _on_op_private(), the key is
+        # the "op" or "private" field of the message
+        self._op_handlers = self._handler_table("_on_op_")
+        self._private_handlers = self._handler_table("_on_op_private_")
 
         self.config = config
         self.currency = config.get("gox", "currency", "USD")
 
+        self._json_loads = json_decoder(config.get_string("gox", "json_decoder"))
+        # raw message markers for _prefilter(), see there
+        self._prefilter_markers = [
+            ('"private":"depth"', '"currency":"%s"' % self.currency),
+            ('"private":"trade"', '"price_currency":"%s"' % self.currency),
+            ('"private":"ticker"', '"currency":"%s"' % self.currency)]
+
         Signal.signal_error.connect(self.signal_debug)
 
         timeframe = 60 * config.get_int("gox", "history_timeframe")
         if not timeframe:
             timeframe = 60 * 15
-        self.history = History(self, timeframe)
+        max_candles = config.get_int("gox", "history_max_candles")
+        try:
+            timeframes = [60 * int(minutes) for minutes in config.get_string(
+                "gox", "history_timeframes").split(",") if minutes.strip()]
+            self.history = History(self, timeframe, max_candles, timeframes)
+        except ValueError as exc:
+            self._debug_later("### ignoring history_timeframes:", exc)
+            self.history = History(self, timeframe, max_candles)
         self.history.signal_debug.connect(self.signal_debug)
 
-        self.orderbook = OrderBook(self)
+        # no event loop when replaying, the ReplayClient has its own thread
+        # and no sockets, there would be nothing for the loop to do
+        loop = None
+        if self.config.get_bool("gox", "use_event_loop") and not FORCE_REPLAY:
+            loop = EventLoop.shared()
+            loop.signal_debug.connect(self.signal_debug)
+        self._loop = loop
+
+        self.orderbook = OrderBook(self,
+            self.config.get_bool("gox", "orderbook_compact"),
+            self.config.get_int("gox", "orderbook_notify_rate"), loop)
         self.orderbook.signal_debug.connect(self.signal_debug)
+        self.orderbook.signal_resync.connect(self.slot_orderbook_resync)
+        self._time_resync = {False: 0, True: 0} # full -> time of request
+        self._resync_deferred = {False: False, True: False} # full -> pending
+
+        # with load_fulldepth = snapshot the last book is saved on exit and
+        # loaded at startup, it will be replaced when fulldepth arrives
+        self.snapshot_filename = None
+        # (but not when replaying, that would overwrite it with old data)
+        if self.config.get_string("gox", "load_fulldepth") == "snapshot" \
+                and not FORCE_REPLAY:
+            self.snapshot_filename = "%s.%s.book" % (
+                os.path.splitext(config.filename)[0], self.currency)
+            if self.orderbook.load_snapshot(self.snapshot_filename,
+                    ORDERBOOK_SNAPSHOT_MAX_AGE):
+                self._debug_later("### loaded orderbook snapshot from %s"
+                    % self.snapshot_filename)
+
+        HTTP_POOL.size = self.config.get_int("gox", "http_pool_size")
+        HTTP_POOL.idle_timeout = self.config.get_int("gox",
+            "http_pool_idle_timeout")
 
         use_websocket = self.config.get_bool("gox", "use_plain_old_websocket")
         if "socketio" in FORCE_PROTOCOL:
             use_websocket = False
         if "websocket" in FORCE_PROTOCOL:
             use_websocket = True
-        if use_websocket:
-            self.client = WebsocketClient(self.currency, secret, config)
+        if FORCE_REPLAY:
+            self.client = ReplayClient(self.currency, secret, config,
+                feed_files(FORCE_REPLAY), FORCE_REPLAY_SPEED)
+        elif use_websocket:
+            self.client = WebsocketClient(self.currency, secret, config, loop)
         else:
-            self.client = SocketIOClient(self.currency, secret, config)
+            self.client = SocketIOClient(self.currency, secret, config, loop)
 
         self.client.signal_debug.connect(self.signal_debug)
         self.client.signal_recv.connect(self.slot_recv)
         self.client.signal_fulldepth.connect(self.signal_fulldepth)
-        self.client.signal_fullhistory.connect(self.signal_fullhistory)
+        self.client.signal_partialdepth.connect(self.signal_partialdepth)
 
-        self.timer_poll = Timer(120)
+        self.timer_poll = Timer(120, loop)
         self.timer_poll.connect(self.slot_poll)
 
         self.history.signal_changed.connect(self.slot_history_changed)
 
+        # with history_store the received trades are kept in a database,
+        # the history is loaded from it at startup and only newer trades
+        # are requested (again not when replaying)
+        # and if the database can't be used we just go on without it
+        self.trade_store = None
+        if self.config.get_bool("gox", "history_store") and not FORCE_REPLAY:
+            try:
+                self.trade_store = TradeStore("%s.%s.history" % (
+                    os.path.splitext(config.filename)[0], self.currency))
+                self._load_trade_store(max_candles)
+            except sqlite3.Error as exc:
+                self._debug_later("### not using history_store:", exc)
+                if self.trade_store:
+                    self.trade_store.close()
+                self.trade_store = None
+        if self.trade_store:
+            self.client.signal_fullhistory.connect(self.slot_fullhistory)
+        else:
+            self.client.signal_fullhistory.connect(self.signal_fullhistory)
+
+        self.timer_profile = None
+        profile_interval = self.config.get_int("gox", "signal_profile_interval")
+        if profile_interval:
+            self.enable_profiling(profile_interval)
+
     def start(self):
         """connect to MtGox and start receiving events."""
+        for args in self._startup_messages:
+            self.debug(*args)
+        self._startup_messages = []
         self.debug("starting gox streaming API, currency=" + self.currency)
         self.client.start()
 
+    def _debug_later(self, *args):
+        """debug output from within the constructor, see start()"""
+        self._startup_messages.append(args)
+
     def stop(self):
         """shutdown the client"""
         self.debug("shutdown...")
         self.client.stop()
+        self.orderbook.stop()
+        if self.timer_profile:
+            self.timer_profile.cancel()
+            self.timer_profile = None
+        if self.trade_store:
+            self.trade_store.close()
+        if self.snapshot_filename and len(self.orderbook.asks):
+            try:
+                self.orderbook.save_snapshot(self.snapshot_filename)
+            except (IOError, OSError) as exc:
+                self.debug("### could not save orderbook snapshot:", exc)
+
+    def enable_profiling(self, summary_interval=0):
+        """start recording the time spent in all signal slots. If
+        summary_interval is not 0 then a summary of the most expensive
+        slots will be sent to signal_debug every summary_interval seconds.
+        Profiling is global for all signals in the application."""
+        profiler = SignalProfiler()
+        profiler.name_signals(self, "gox")
+        profiler.name_signals(self.client, "client")
+        profiler.name_signals(self.orderbook, "orderbook")
+        profiler.name_signals(self.history, "history")
+        profiler.name_signals(Signal, "Signal")
+        Signal.profiler = profiler
+        if self.timer_profile:
+            self.timer_profile.cancel()
+            self.timer_profile = None
+        if summary_interval:
+            self.timer_profile = Timer(summary_interval, self._loop)
+            self.timer_profile.connect(self.slot_profile_timer)
+
+    def disable_profiling(self):
+        """stop recording signal timing statistics"""
+        Signal.profiler = None
+        if self.timer_profile:
+            self.timer_profile.cancel()
+            self.timer_profile = None
+
+    def get_signal_stats(self):
+        """return the signal timing statistics (see SignalProfiler), this
+        is an empty list if profiling is not enabled"""
+        if Signal.profiler:
+            return Signal.profiler.get_stats()
+        return []
+
+    def slot_profile_timer(self, _sender, _data):
+        """send a summary of the signal timing statistics to signal_debug"""
+        if Signal.profiler:
+            for line in Signal.profiler.summary():
+                self.debug(line)
 
     def order(self, typ, price, volume):
         """place pending order. If price=0 then it will be filled at market"""
@@ -1155,11 +2823,9 @@ class Gox(BaseObject):
 
     def cancel_by_price(self, price):
         """cancel all orders at price"""
-        for i in reversed(range(len(self.orderbook.owns))):
-            order = self.orderbook.owns[i]
-            if order.price == price:
-                if order.oid != "":
-                    self.cancel(order.oid)
+        for order in self.orderbook.get_own_orders_at(price):
+            if order.oid != "":
+                self.cancel(order.oid)
 
     def cancel_by_type(self, typ=None):
         """cancel all orders of type (or all orders if type=None)"""
@@ -1174,20 +2840,35 @@ class Gox(BaseObject):
         JSON string into a Python object and dispatch it to the method that
         can handle it."""
         (str_json) = data
-        handler = None
-        msg = json.loads(str_json)
+        if not self._prefilter(str_json):
+            self.count_prefiltered += 1
+            return
+        msg = self._json_loads(str_json)
         if "op" in msg:
-            try:
-                msg_op = msg["op"]
-                handler = getattr(self, "_on_op_" + msg_op)
-
-            except AttributeError:
+            msg_op = msg["op"]
+            handler = self._op_handlers.get(msg_op)
+            if handler:
+                handler(msg)
+            else:
                 self.debug("slot_recv() ignoring: op=%s" % msg_op)
         else:
             self.debug("slot_recv() ignoring:", msg)
 
-        if handler:
-            handler(msg)
+    def _handler_table(self, prefix):
+        """return a dict of all methods whose name starts with prefix,
+        the key is the rest of the name"""
+        return dict((name[len(prefix):], getattr(self, name))
+            for name in dir(self) if name.startswith(prefix))
+
+    def _prefilter(self, str_json):
+        """look at the raw JSON string of depth, trade and ticker messages
+        and return False if it does not contain our currency at all, then
+        it can be dropped without decoding it. Only the compact format
+        without spaces is recognized, everything else will pass."""
+        for (private, currency) in self._prefilter_markers:
+            if private in str_json:
+                return currency in str_json
+        return True
 
     def slot_poll(self, _sender, _data):
         """poll stuff from http in regular intervals, not yet implemented"""
@@ -1196,6 +2877,80 @@ class Gox(BaseObject):
             # fixme: how do i do this, whats the api for this?
             pass
 
+    def slot_orderbook_resync(self, _sender, full):
+        """the orderbook has found a gap in the depth feed, fetch the depth
+        around the current price (or the full depth if full is True) in the
+        background, but not more often than DEPTH_RESYNC_INTERVAL (or
+        DEPTH_FULL_RESYNC_INTERVAL) seconds. A request within that interval
+        is deferred until the interval has passed, so no gap is left
+        unrepaired (further requests until then are covered by it)"""
+        interval = {True: DEPTH_FULL_RESYNC_INTERVAL,
+                    False: DEPTH_RESYNC_INTERVAL}[full]
+        wait = self._time_resync[full] + interval - time.time()
+        if wait > 0:
+            if not self._resync_deferred[full]:
+                self._resync_deferred[full] = True
+                if self._loop:
+                    self._loop.call_later(wait, self._deferred_resync, full)
+                else:
+                    timer = threading.Timer(wait, self._deferred_resync,
+                        (full,))
+                    timer.daemon = True
+                    timer.start()
+            return
+        self._time_resync[full] = time.time()
+        if full:
+            self.client.request_fulldepth()
+        else:
+            self.client.request_partialdepth()
+
+    def _deferred_resync(self, full):
+        """the throttle interval of a deferred resync has passed"""
+        self._resync_deferred[full] = False
+        self.slot_orderbook_resync(self, full)
+
+    def _load_trade_store(self, max_candles):
+        """fill every timeframe of the history with its newest max_candles
+        candles (all if max_candles is 0), aggregated by the TradeStore so
+        only as many trades as needed are ever read"""
+        now = time.time()
+        candles = {}
+        for timeframe in self.history.timeframes:
+            start = 0
+            if max_candles:
+                start = now - max_candles * timeframe
+            candles[timeframe] = self.trade_store.candles(timeframe, start)
+        if candles[self.history.timeframe]:
+            self.history.load_candles(candles)
+            self._debug_later("### loaded %d candles from %s"
+                % (len(candles[self.history.timeframe]),
+                self.trade_store.filename))
+        self.client.history_since_tid = self.trade_store.last_tid()
+
+    def slot_fullhistory(self, dummy_sender, data):
+        """Slot for client.signal_fullhistory when there is a TradeStore.
+        The new trades are stored and then sent to signal_fullhistory
+        together with the stored trades since the open time of the current
+        candle of the highest timeframe, so the history can build all its
+        current candles from scratch. If the database fails the received
+        trades are passed on as they are"""
+        (history) = data
+        if not history:
+            return
+        highest = self.history.timeframes[-1]
+        start = int(history[0]["date"])
+        last = self.history.last_candle(highest)
+        if last:
+            start = min(start, last.tim)
+        start = int(start / highest) * highest
+        try:
+            self.trade_store.add_trades(history)
+            self.client.history_since_tid = self.trade_store.last_tid()
+            history = self.trade_store.trades(start)
+        except sqlite3.Error as exc:
+            self.debug("### could not use history_store:", exc)
+        self.signal_fullhistory(self, history)
+
     def slot_history_changed(self, _sender, _data):
         """this is a small optimzation, if we tell the client the time
         of the last known candle then it won't fetch full history next time"""
@@ -1274,15 +3029,12 @@ class Gox(BaseObject):
         we subscribed (trade, depth, ticker) and also the per-account messages
         (user_order, wallet, own trades, etc)"""
         private = msg["private"]
-        handler = None
-        try:
-            handler = getattr(self, "_on_op_private_" + private)
-        except AttributeError:
-            self.debug("_on_op_private() ignoring: private=%s" % private)
-            self.debug(pretty_format(msg))
-
+        handler = self._private_handlers.get(private)
         if handler:
             handler(msg)
+        else:
+            self.debug("_on_op_private() ignoring: private=%s" % private)
+            self.debug(pretty_format(msg))
 
     def _on_op_private_ticker(self, msg):
         """handle incoming ticker message (op=private, private=ticker)"""
@@ -1305,11 +3057,14 @@ class Gox(BaseObject):
         price = int(msg["price_int"])
         volume = int(msg["volume_int"])
         total_volume = int(msg["total_volume_int"])
+        now = int(msg["now"])
 
         self.debug(
             "depth: ", type_str+":", int2str(price, self.currency),
             "vol:", int2str(volume, "BTC"),
             "total vol:", int2str(total_volume, "BTC"))
+        self.signal_depth_stamped(self,
+            (type_str, price, volume, total_volume, now))
         self.signal_depth(self, (type_str, price, volume, total_volume))
 
     def _on_op_private_trade(self, msg):
@@ -1432,9 +3187,13 @@ class Gox(BaseObject):
         self._on_op_private_user_order(fakemsg)
 
 
-class Order:
+class Order(object):
     """represents an order in the orderbook"""
 
+    # there can be tens of thousands of these in a full orderbook,
+    # without a per-instance __dict__ they need only a fraction of memory
+    __slots__ = ("price", "volume", "typ", "oid", "status")
+
     def __init__(self, price, volume, typ, oid="", status=""):
         """initialize a new order object"""
         self.price = price
@@ -1444,35 +3203,417 @@ class Order:
         self.status = status
 
 
+class BookSide:
+    """one side (bids or asks) of the orderbook. The price levels are kept
+    in a dict price->Order and additionally in a sorted list of keys, so a
+    level can be found, inserted or removed with bisect instead of walking
+    the entire side. For the bids the keys are the negated prices, this way
+    index 0 is always the best price on both sides. Indexing, len() and
+    iteration behave exactly like the plain list of Order() it used to be,
+    so existing code reading book.bids[i].price will continue to work."""
+
+    def __init__(self, typ):
+        """create an empty side, typ is either "bid" or "ask" """
+        self.typ = typ
+        self._sign = {"ask": 1, "bid": -1}[typ]
+        self._keys = []   # sorted list of sign * price
+        self._levels = {} # price -> Order
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._levels[key * self._sign]
+                for key in self._keys[index]]
+        return self._levels[self._keys[index] * self._sign]
+
+    def __iter__(self):
+        for key in self._keys:
+            yield self._levels[key * self._sign]
+
+    def __contains__(self, price):
+        return price in self._levels
+
+    def get(self, price):
+        """return the level at this price or None if there is none"""
+        return self._levels.get(price)
+
+    def best(self):
+        """return the level with the best price or None if empty"""
+        if self._keys:
+            return self._levels[self._keys[0] * self._sign]
+        return None
+
+    def index(self, price):
+        """return the position at which a level with this price is or would
+        be inserted, 0 is the best price"""
+        return bisect.bisect_left(self._keys, price * self._sign)
+
+    def set_volume(self, price, volume):
+        """set the total volume at this price level, remove the entire level
+        if volume is 0 and insert a new level if needed. Returns the
+        difference between new and old volume at this price."""
+        level = self._levels.get(price)
+        if level:
+            voldiff = volume - level.volume
+            if volume <= 0:
+                self._remove(price)
+            else:
+                level.volume = volume
+            return voldiff
+        if volume > 0:
+            self._insert(Order(price, volume, self.typ))
+            return volume
+        return 0
+
+    def add_dummy(self, price):
+        """make sure a level exists at this price, add one with volume 0
+        if needed (used to make own orders visible before the book is known)"""
+        if not price in self._levels:
+            self._insert(Order(price, 0, self.typ))
+
+    def pop_best(self):
+        """remove the best level and return it"""
+        key = self._keys.pop(0)
+        return self._levels.pop(key * self._sign)
+
+    def clear(self):
+        """remove all levels"""
+        self._keys = []
+        self._levels = {}
+
+    def load(self, levels):
+        """replace the entire contents with the levels from the iterable of
+        (price, volume) tuples, this is much faster than inserting them one
+        by one. The levels need not be sorted, duplicate prices will be
+        summed up. Returns the sum of all volumes"""
+        self.clear()
+        total = 0
+        for (price, volume) in levels:
+            level = self._levels.get(price)
+            if level:
+                level.volume += volume
+            else:
+                self._levels[price] = Order(price, volume, self.typ)
+            total += volume
+        self._keys = sorted(price * self._sign for price in self._levels)
+        return total
+
+    def pairs(self):
+        """return all levels as a sorted list of (price, volume) tuples"""
+        return [(level.price, level.volume) for level in self]
+
+    def total_volume(self):
+        """return the sum of the volume of all levels"""
+        return sum(level.volume for level in self._levels.itervalues())
+
+    def total_value(self):
+        """return the sum of price * volume of all levels"""
+        return sum(level.price * level.volume
+            for level in self._levels.itervalues())
+
+    def _insert(self, level):
+        """insert a new level object (price must not yet exist)"""
+        bisect.insort(self._keys, level.price * self._sign)
+        self._levels[level.price] = level
+
+    def _remove(self, price):
+        """remove an existing level"""
+        index = bisect.bisect_left(self._keys, price * self._sign)
+        del self._keys[index]
+        del self._levels[price]
+
+
+def _int64_typecode():
+    """return the array typecode for 64 bit integers. Python 2 has no "q",
+    "l" is 64 bit almost everywhere except on Windows, there we fall back to
+    doubles which are still exact for all integers up to 2**53"""
+    for code in ("q", "l"):
+        try:
+            if array.array(code).itemsize == 8:
+                return code
+        except ValueError:
+            pass
+    return "d"
+
+INT64 = _int64_typecode()
+
+
+class CompactBookSide:
+    """drop-in replacement for BookSide that keeps the levels in two parallel
+    arrays of 64 bit integers (sorted keys and volumes) instead of one Order
+    object per level. This needs only 16 bytes per level and creates no work
+    for the garbage collector. Indexing and iteration return lightweight
+    Order() views that are created on the fly, changing them has no effect
+    on the book, all changes must be done through the methods."""
+
+    def __init__(self, typ):
+        """create an empty side, typ is either "bid" or "ask" """
+        self.typ = typ
+        self._sign = {"ask": 1, "bid": -1}[typ]
+        self._keys = array.array(INT64) # sorted sign * price
+        self._vols = array.array(INT64) # volume at same index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._view(i)
+                for i in range(*index.indices(len(self._keys)))]
+        if index < 0:
+            index += len(self._keys)
+        if index < 0 or index >= len(self._keys):
+            raise IndexError("book index out of range")
+        return self._view(index)
+
+    def __iter__(self):
+        for i in xrange(len(self._keys)):
+            yield self._view(i)
+
+    def __contains__(self, price):
+        return self._find(price) >= 0
+
+    def get(self, price):
+        """return the level at this price or None if there is none"""
+        index = self._find(price)
+        if index >= 0:
+            return self._view(index)
+        return None
+
+    def best(self):
+        """return the level with the best price or None if empty"""
+        if len(self._keys):
+            return self._view(0)
+        return None
+
+    def index(self, price):
+        """return the position at which a level with this price is or would
+        be inserted, 0 is the best price"""
+        return bisect.bisect_left(self._keys, price * self._sign)
+
+    def set_volume(self, price, volume):
+        """set the total volume at this price level, remove the entire level
+        if volume is 0 and insert a new level if needed. Returns the
+        difference between new and old volume at this price."""
+        key = price * self._sign
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            voldiff = volume - int(self._vols[index])
+            if volume <= 0:
+                del self._keys[index]
+                del self._vols[index]
+            else:
+                self._vols[index] = volume
+            return voldiff
+        if volume > 0:
+            self._keys.insert(index, key)
+            self._vols.insert(index, volume)
+            return volume
+        return 0
+
+    def add_dummy(self, price):
+        """make sure a level exists at this price, add one with volume 0
+        if needed (used to make own orders visible before the book is known)"""
+        key = price * self._sign
+        index = bisect.bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            self._keys.insert(index, key)
+            self._vols.insert(index, 0)
+
+    def pop_best(self):
+        """remove the best level and return it"""
+        level = self._view(0)
+        del self._keys[0]
+        del self._vols[0]
+        return level
+
+    def clear(self):
+        """remove all levels"""
+        self._keys = array.array(INT64)
+        self._vols = array.array(INT64)
+
+    def load(self, levels):
+        """replace the entire contents with the levels from the iterable of
+        (price, volume) tuples. The levels need not be sorted, duplicate
+        prices will be summed up. Returns the sum of all volumes"""
+        volumes = {}
+        total = 0
+        for (price, volume) in levels:
+            volumes[price] = volumes.get(price, 0) + volume
+            total += volume
+        keys = sorted(price * self._sign for price in volumes)
+        self._keys = array.array(INT64, keys)
+        self._vols = array.array(INT64,
+            [volumes[key * self._sign] for key in keys])
+        return total
+
+    def pairs(self):
+        """return all levels as a sorted list of (price, volume) tuples"""
+        sign = self._sign
+        return [(int(key) * sign, int(vol))
+            for key, vol in itertools.izip(self._keys, self._vols)]
+
+    def total_volume(self):
+        """return the sum of the volume of all levels"""
+        return sum(int(vol) for vol in self._vols)
+
+    def total_value(self):
+        """return the sum of price * volume of all levels"""
+        return self._sign * sum(int(key) * int(vol) for (key, vol) in
+            itertools.izip(self._keys, self._vols))
+
+    def _find(self, price):
+        """return index of the level at this price or -1 if not found"""
+        key = price * self._sign
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return index
+        return -1
+
+    def _view(self, index):
+        """create an Order() object representing the level at index"""
+        return Order(int(self._keys[index]) * self._sign,
+            int(self._vols[index]), self.typ)
+
+
+class BookChange:
+    """describes what has changed in the orderbook, this is the payload of
+    OrderBook.signal_changed. sides is a set of "bid", "ask" and "own",
+    ranges maps each changed side to a (lowest, highest) tuple of the prices
+    that were touched or to None if the exact prices are not known. If full
+    is True then the entire book has been replaced (fulldepth, owns list)."""
+
+    def __init__(self):
+        self.sides = set()
+        self.ranges = {}
+        self.full = False
+
+    def add(self, side, price=None):
+        """add a change on this side at this price, side=None means all"""
+        if side is None:
+            self.full = True
+            self.sides.update(("bid", "ask", "own"))
+            return
+        if price is None or self.ranges.get(side, 0) is None:
+            self.ranges[side] = None
+        elif side in self.ranges:
+            (low, high) = self.ranges[side]
+            self.ranges[side] = (min(low, price), max(high, price))
+        else:
+            self.ranges[side] = (price, price)
+        self.sides.add(side)
+
+    def affects(self, side, price=None):
+        """does this change affect this side (optionally at this price)?"""
+        if self.full:
+            return True
+        if not side in self.sides:
+            return False
+        if price is None or self.ranges[side] is None:
+            return True
+        (low, high) = self.ranges[side]
+        return low <= price <= high
+
+
 class OrderBook(BaseObject):
     """represents the orderbook. Each Gox instance has one
     instance of OrderBook to maintain the open orders. This also
-    maintains a list of own orders belonging to this account"""
-
-    def __init__(self, gox):
+    maintains a list of own orders belonging to this account.
+
+    Once the book has been initialized from fulldepth every depth message
+    is checked against it: the volume at the price before the update
+    (total volume minus volume difference) must match the volume in the
+    book. If it does not then messages have been lost and signal_resync
+    is sent to request a partial (data=False) or full (data=True) depth
+    refetch, the result is merged with slot_partialdepth(). The counters
+    count_gaps, count_stale, count_repairs and count_resyncs tell how
+    often this has happened."""
+
+    # magic, version, byte order, array typecode, currency, time, asks, bids
+    _SNAPSHOT_HEADER = struct.Struct("<4sBcc3sdII")
+    _SNAPSHOT_MAGIC = "GOXB"
+    _SNAPSHOT_VERSION = 1
+
+    def __init__(self, gox, compact=False, notify_rate=0, loop=None):
         """create a new empty orderbook and associate it with its
-        Gox instance"""
+        Gox instance. If compact is True the price levels will be stored in
+        arrays (CompactBookSide) instead of Order objects (BookSide).
+        If notify_rate is not 0 then signal_changed will be coalesced and
+        fired at most notify_rate times per second (see flush_changes()),
+        by a timer on the given EventLoop if there is one. Call stop()
+        when the book is not used anymore."""
         BaseObject.__init__(self)
         self.gox = gox
 
         self.signal_changed = Signal()
         self.signal_owns_changed = Signal()
+        self.signal_resync = Signal()
 
         gox.signal_ticker.connect(self.slot_ticker)
-        gox.signal_depth.connect(self.slot_depth)
+        gox.signal_depth_stamped.connect(self.slot_depth)
         gox.signal_trade.connect(self.slot_trade)
         gox.signal_userorder.connect(self.slot_user_order)
         gox.signal_fulldepth.connect(self.slot_fulldepth)
+        gox.signal_partialdepth.connect(self.slot_partialdepth)
 
-        self.bids = [] # list of Order(), lowest ask first
-        self.asks = [] # list of Order(), highest bid first
+        side_class = {True: CompactBookSide, False: BookSide}[compact]
+        self.bids = side_class("bid") # sorted levels, highest bid first
+        self.asks = side_class("ask") # sorted levels, lowest ask first
         self.owns = [] # list of Order(), unordered list
 
+        # indexes into self.owns for fast lookup of own orders, these are
+        # maintained by _index_own() and _unindex_own()
+        self._own_by_oid = {}    # oid -> Order
+        self._own_by_price = {}  # price -> list of Order
+        self._own_volume = {}    # price -> sum of own volume at this price
+
         self.bid = 0
         self.ask = 0
+
+        # time of the snapshot the book was loaded from (load_snapshot()),
+        # None if the book is not (anymore) based on a snapshot
+        self.snapshot_time = None
+
+        # consistency of the depth feed. depth_stamp is the "now" of the
+        # fulldepth the book was loaded from (0 if none yet), depth messages
+        # older than that or than the partial depth in _partial_range
+        # (stamp, min price, max price) are already contained in the book
+        self.depth_stamp = 0
+        self.count_gaps = 0     # depth messages that did not fit the book
+        self.count_stale = 0    # depth messages older than the book
+        self.count_repairs = 0  # levels removed by _repair_crossed_*()
+        self.count_resyncs = 0  # partial depths merged into the book
+        self._partial_range = None
+        self._traded = {}       # (typ, price) -> volume removed by trades
+        self._gap_prices = []   # prices of gaps since the last resync
+
+        # exact integer totals, total_ask is in BTC units (1E-8) and
+        # total_bid is the sum of price_int * volume_int. Use get_total_ask()
+        # and get_total_bid() to get them as float BTC and float fiat
         self.total_bid = 0
         self.total_ask = 0
 
+        # every totals_check_interval depth or trade updates the totals are
+        # recomputed from scratch and compared, 0 disables it. The result
+        # of the last check is in totals_check (drift_ask, drift_bid, secs)
+        self.totals_check_interval = 10000
+        self.totals_check = (0, 0, 0)
+        self._count_updates = 0
+
+        # changes since last signal_changed, see _mark_changed()
+        self._change = None
+        self._notify_timer = None
+        if notify_rate:
+            self._notify_timer = Timer(1.0 / notify_rate, loop)
+            self._notify_timer.connect(self.slot_notify_timer)
+
+    def stop(self):
+        """stop the timer of coalesced change notifications"""
+        if self._notify_timer:
+            self._notify_timer.cancel()
+
     def slot_ticker(self, dummy_sender, data):
         """Slot for signal_ticker, incoming ticker message"""
         (bid, ask) = data
@@ -1480,11 +3621,20 @@ class OrderBook(BaseObject):
         self.ask = ask
         self._repair_crossed_asks(ask)
         self._repair_crossed_bids(bid)
-        self.signal_changed(self, None)
+        self._mark_changed("ask", ask)
+        self._mark_changed("bid", bid)
+        self._fire_changed()
 
     def slot_depth(self, dummy_sender, data):
-        """Slot for signal_depth, process incoming depth message"""
-        (typ, price, _voldiff, total_vol) = data
+        """Slot for signal_depth_stamped, process incoming depth message"""
+        (typ, price, voldiff, total_vol, now) = data
+        if self.depth_stamp and typ in ("ask", "bid"):
+            if self._is_stale_depth(price, now):
+                self.count_stale += 1
+                self._count_update()
+                return
+            self._check_depth_gap(typ, price, voldiff, total_vol)
+
         toa, tob = self.total_ask, self.total_bid
         if typ == "ask":
             self._update_asks(price, total_vol)
@@ -1492,7 +3642,10 @@ class OrderBook(BaseObject):
             self._update_bids(price, total_vol)
 
         if (toa, tob) != (self.total_ask, self.total_bid):
-            self.signal_changed(self, None)
+            self._mark_changed(typ, price)
+            self._fire_changed()
+
+        self._count_update()
 
     def slot_trade(self, dummy_sender, data):
         """Slot for signal_trade event, process incoming trade messages.
@@ -1507,74 +3660,78 @@ class OrderBook(BaseObject):
             # separate user_order messages to update my owns list
 
         else:
-            voldiff = -volume
             if typ == "bid":  # trade_type=bid means an ask order was filled
                 self._repair_crossed_asks(price)
+                level = self.asks.best()
+                if level and level.price == price:
+                    voldiff = self.asks.set_volume(
+                        price, max(level.volume - volume, 0))
+                    self._update_total_ask(voldiff)
+                    self._add_traded("ask", price, -voldiff)
+                    self._mark_changed("ask", price)
                 if len(self.asks):
-                    if self.asks[0].price == price:
-                        self.asks[0].volume -= volume
-                        if self.asks[0].volume <= 0:
-                            voldiff -= self.asks[0].volume
-                            self.asks.pop(0)
-                        self._update_total_ask(voldiff)
-                if len(self.asks):
-                    self.ask = self.asks[0].price
+                    self.ask = self.asks.best().price
 
             if typ == "ask":  # trade_type=ask means a bid order was filled
                 self._repair_crossed_bids(price)
+                level = self.bids.best()
+                if level and level.price == price:
+                    voldiff = self.bids.set_volume(
+                        price, max(level.volume - volume, 0))
+                    self._update_total_bid(voldiff, price)
+                    self._add_traded("bid", price, -voldiff)
+                    self._mark_changed("bid", price)
                 if len(self.bids):
-                    if self.bids[0].price == price:
-                        self.bids[0].volume -= volume
-                        if self.bids[0].volume <= 0:
-                            voldiff -= self.bids[0].volume
-                            self.bids.pop(0)
-                        self._update_total_bid(voldiff, price)
-                if len(self.bids):
-                    self.bid = self.bids[0].price
+                    self.bid = self.bids.best().price
+
+            self._count_update()
 
-        self.signal_changed(self, None)
+        self._fire_changed()
 
     def slot_user_order(self, dummy_sender, data):
         """Slot for signal_userorder, process incoming user_order mesage"""
         (price, volume, typ, oid, status) = data
+        order = self._own_by_oid.get(oid)
         if status == "removed":
-            for i in range(len(self.owns)):
-                if self.owns[i].oid == oid:
-                    order = self.owns[i]
-                    self.debug(
-                        "### removing %s order %s " % (order.typ,oid),
-                        "price:", int2str(order.price, self.gox.currency),
-                        "volume:", int2str(order.volume, "BTC"),
-                        "type:", order.typ)
-                    self.owns.pop(i)
-                    break
+            if order:
+                self.debug(
+                    "### removing %s order %s " % (order.typ,oid),
+                    "price:", int2str(order.price, self.gox.currency),
+                    "volume:", int2str(order.volume, "BTC"),
+                    "type:", order.typ)
+                self._unindex_own(order)
+                self.owns.remove(order)
+                self._mark_changed(order.typ, order.price)
         else:
-            found = False
-            for order in self.owns:
-                if order.oid == oid:
-                    found = True
-                    order.price = price
-                    order.volume = volume
-                    order.typ = typ
-                    order.oid = oid
-                    if not(status == order.status):
-                        self.debug(
-                            "### updating %s order %s " % (typ,oid),
-                            "price", int2str(price, self.gox.currency),
-                            "volume:", int2str(volume, "BTC"),
-                            "status:", status)
-                    order.status = status
-                    break
+            if order:
+                self._unindex_own(order)
+                self._mark_changed(order.typ, order.price)
+                order.price = price
+                order.volume = volume
+                order.typ = typ
+                if not(status == order.status):
+                    self.debug(
+                        "### updating %s order %s " % (typ,oid),
+                        "price", int2str(price, self.gox.currency),
+                        "volume:", int2str(volume, "BTC"),
+                        "status:", status)
+                order.status = status
+                self._index_own(order)
 
-            if not found:
+            else:
                 self.debug(
                     "### adding %s order %s " % (typ,oid),
                     "price", int2str(price, self.gox.currency),
                     "volume:", int2str(volume, "BTC"),
                     "status:", status)
-                self.owns.append(Order(price, volume, typ, oid, status))
+                order = Order(price, volume, typ, oid, status)
+                self.owns.append(order)
+                self._index_own(order)
 
-        self.signal_changed(self, None)
+            self._mark_changed(typ, price)
+
+        self._mark_changed("own")
+        self._fire_changed()
         self.signal_owns_changed(self, None)
 
     def slot_fulldepth(self, dummy_sender, data):
@@ -1582,128 +3739,312 @@ class OrderBook(BaseObject):
         This will clear the book and then re-initialize it from scratch."""
         (depth) = data
         self.debug("### got full depth: updating orderbook...")
-        self.bids = []
-        self.asks = []
+        self.bids.clear()
+        self.asks.clear()
         self.total_ask = 0
         self.total_bid = 0
         if "error" in depth:
             self.debug("### ", depth["error"])
             return
-        for order in depth["data"]["asks"]:
-            price = int(order["price_int"])
-            volume = int(order["amount_int"])
-            self._update_total_ask(volume)
-            self.asks.append(Order(price, volume, "ask"))
-        for order in depth["data"]["bids"]:
-            price = int(order["price_int"])
-            volume = int(order["amount_int"])
-            self._update_total_bid(volume, price)
-            self.bids.insert(0, Order(price, volume, "bid"))
-
-        self.bid = self.bids[0].price
-        self.ask = self.asks[0].price
-        self.signal_changed(self, None)
+        self._load_levels(depth_levels(depth["data"]["asks"]),
+                          depth_levels(depth["data"]["bids"]))
+        self.snapshot_time = None
+        self.depth_stamp = int(depth["data"].get("now", 0))
+        self._partial_range = None
+        self._traded.clear()
+        self._gap_prices = []
+
+    def slot_partialdepth(self, dummy_sender, data):
+        """Slot for signal_partialdepth, merge the depth around the current
+        price (money/depth/fetch) into the book. All levels between the
+        filter_min_price and filter_max_price of the response are replaced,
+        levels outside of this range are not touched. If there have been
+        gaps outside of this range then a full resync will be requested."""
+        (depth) = data
+        if "error" in depth:
+            self.debug("### ", depth["error"])
+            return
+        data = depth["data"]
+        stamp = int(data["now"])
+        if stamp <= self.depth_stamp:
+            return # the full depth we already have is newer
+        low = int(data["filter_min_price"]["value_int"])
+        high = int(data["filter_max_price"]["value_int"])
+        self.debug("### got partial depth: merging into orderbook...")
+        for typ, orders in (("ask", data["asks"]), ("bid", data["bids"])):
+            side = {"ask": self.asks, "bid": self.bids}[typ]
+            update = {"ask": self._update_asks, "bid": self._update_bids}[typ]
+            fresh = {} # duplicate prices are summed up like in load()
+            for price, volume in depth_levels(orders):
+                fresh[price] = fresh.get(price, 0) + volume
+            for price, dummy_volume in side.pairs():
+                if low <= price <= high and not price in fresh:
+                    fresh[price] = 0
+            for price, volume in fresh.iteritems():
+                update(price, volume)
+                self._mark_changed(typ, price)
+
+        if len(self.bids):
+            self.bid = self.bids.best().price
+        if len(self.asks):
+            self.ask = self.asks.best().price
+        self._partial_range = (stamp, low, high)
+        self._traded.clear()
+        outside = [price for price in self._gap_prices
+            if not low <= price <= high]
+        self._gap_prices = []
+        self.count_resyncs += 1
+        self._fire_changed()
+        if outside:
+            self.debug("### %d depth gaps outside of partial depth"
+                % len(outside))
+            self.signal_resync(self, True)
+
+    def _is_stale_depth(self, price, stamp):
+        """return True if the depth message with this "now" stamp is older
+        than the (partial) depth the book was last loaded from"""
+        if not stamp:
+            return False
+        if stamp <= self.depth_stamp:
+            return True
+        if self._partial_range:
+            (partial_stamp, low, high) = self._partial_range
+            if stamp <= partial_stamp and low <= price <= high:
+                return True
+        return False
+
+    def _check_depth_gap(self, typ, price, voldiff, total_vol):
+        """compare the volume before this depth update with the book, if it
+        does not match then depth messages have been lost, remember the
+        price and request a resync"""
+        side = {"ask": self.asks, "bid": self.bids}[typ]
+        level = side.get(price)
+        volume = level.volume if level else 0
+        volume += self._traded.pop((typ, price), 0)
+        if volume != total_vol - voldiff:
+            self.count_gaps += 1
+            self._request_resync(price)
+
+    def _request_resync(self, price):
+        """remember the price of a gap and ask for a partial resync"""
+        self._gap_prices.append(price)
+        self.signal_resync(self, False)
+
+    def _add_traded(self, typ, price, volume):
+        """remember volume removed from a level by a trade, the depth
+        message for that level will report it as its volume difference"""
+        key = (typ, price)
+        self._traded[key] = self._traded.get(key, 0) + volume
+
+    def _load_levels(self, asks, bids):
+        """replace both sides with the (price, volume) tuples"""
+        self.total_ask = self.asks.load(asks)
+        self.bids.load(bids)
+        self.total_bid = self.bids.total_value()
+
+        if len(self.bids):
+            self.bid = self.bids.best().price
+        if len(self.asks):
+            self.ask = self.asks.best().price
+        self._mark_changed(None)
+        self._fire_changed()
+
+    def save_snapshot(self, filename):
+        """save both sides of the book to a compact binary file: a header
+        (see _SNAPSHOT_HEADER) with currency and time followed by four
+        arrays of 64 bit integers: ask prices, ask volumes, bid prices
+        and bid volumes, all in book order."""
+        with Signal._lock:
+            asks = self.asks.pairs()
+            bids = self.bids.pairs()
+        header = self._SNAPSHOT_HEADER.pack(self._SNAPSHOT_MAGIC,
+            self._SNAPSHOT_VERSION, sys.byteorder[0], INT64,
+            self.gox.currency, time.time(), len(asks), len(bids))
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as snapshot_file:
+            snapshot_file.write(header)
+            for levels in (asks, bids):
+                for column in (0, 1):
+                    array.array(INT64, [level[column] for level in levels]) \
+                        .tofile(snapshot_file)
+        replace_file(tmp_filename, filename)
+
+    def load_snapshot(self, filename, max_age=0):
+        """replace the book with the contents of a file that was written
+        by save_snapshot(). Returns False if the file does not exist, is
+        damaged or unsupported, is for a different currency or is older
+        than max_age seconds (if max_age is not 0). The snapshot_time
+        attribute will then be set to the time the snapshot was taken,
+        until fulldepth arrives."""
+        try:
+            with open(filename, "rb") as snapshot_file:
+                (magic, version, byteorder, typecode, currency, timestamp,
+                    count_asks, count_bids) = self._SNAPSHOT_HEADER.unpack(
+                        snapshot_file.read(self._SNAPSHOT_HEADER.size))
+                if magic != self._SNAPSHOT_MAGIC \
+                        or version != self._SNAPSHOT_VERSION:
+                    self.debug("### not an orderbook snapshot:", filename)
+                    return False
+                if currency != self.gox.currency:
+                    return False
+                if max_age and time.time() - timestamp > max_age:
+                    return False
+                # array() raises ValueError for typecodes it doesn't know
+                if typecode not in ("q", "l", "d") \
+                        or array.array(typecode).itemsize != 8:
+                    self.debug("### unsupported orderbook snapshot:", filename)
+                    return False
+                columns = []
+                for count in (count_asks, count_asks, count_bids, count_bids):
+                    column = array.array(typecode)
+                    column.fromfile(snapshot_file, count)
+                    if byteorder != sys.byteorder[0]:
+                        column.byteswap()
+                    columns.append(column)
+        except (IOError, EOFError, ValueError, struct.error) as exc:
+            self.debug("### could not load orderbook snapshot:", exc)
+            return False
+
+        with Signal._lock:
+            self._load_levels(
+                ((int(price), int(vol)) for price, vol
+                    in itertools.izip(columns[0], columns[1])),
+                ((int(price), int(vol)) for price, vol
+                    in itertools.izip(columns[2], columns[3])))
+            self.snapshot_time = timestamp
+        return True
 
     def _repair_crossed_bids(self, bid):
         """remove all bids that are higher that official current bid value,
         this should actually never be necessary if their feed would not
         eat depth- and trade-messages occaionally :-("""
-        while len(self.bids) and self.bids[0].price > bid:
-            price = self.bids[0].price
-            volume = self.bids[0].volume
-            self._update_total_bid(-volume, price)
-            self.bids.pop(0)
+        repaired = False
+        while len(self.bids) and self.bids.best().price > bid:
+            level = self.bids.pop_best()
+            self._update_total_bid(-level.volume, level.price)
+            self._mark_changed("bid", level.price)
+            self.count_repairs += 1
+            repaired = True
+        if repaired and self.depth_stamp:
+            self._request_resync(bid)
 
     def _repair_crossed_asks(self, ask):
         """remove all asks that are lower that official current ask value,
         this should actually never be necessary if their feed would not
         eat depth- and trade-messages occaionally :-("""
-        while len(self.asks) and self.asks[0].price < ask:
-            volume = self.asks[0].volume
-            self._update_total_ask(-volume)
-            self.asks.pop(0)
+        repaired = False
+        while len(self.asks) and self.asks.best().price < ask:
+            level = self.asks.pop_best()
+            self._update_total_ask(-level.volume)
+            self._mark_changed("ask", level.price)
+            self.count_repairs += 1
+            repaired = True
+        if repaired and self.depth_stamp:
+            self._request_resync(ask)
 
     def _update_asks(self, price, total_vol):
         """update volume at this price level, remove entire level
         if empty after update, add new level if needed."""
-        for i in range(len(self.asks)):
-            level = self.asks[i]
-            if level.price == price:
-                # update existing level
-                voldiff = total_vol - level.volume
-                if total_vol == 0:
-                    self.asks.pop(i)
-                else:
-                    level.volume = total_vol
-                self._update_total_ask(voldiff)
-                return
-            if level.price > price and total_vol > 0:
-                # insert before here and return
-                lnew = Order(price, total_vol, "ask")
-                self.asks.insert(i, lnew)
-                self._update_total_ask(total_vol)
-                return
-
-        # still here? -> end of list or empty list.
-        if total_vol > 0:
-            lnew = Order(price, total_vol, "ask")
-            self.asks.append(lnew)
-            self._update_total_ask(total_vol)
+        voldiff = self.asks.set_volume(price, total_vol)
+        if voldiff:
+            self._update_total_ask(voldiff)
 
     def _update_bids(self, price, total_vol):
         """update volume at this price level, remove entire level
         if empty after update, add new level if needed."""
-        for i in range(len(self.bids)):
-            level = self.bids[i]
-            if level.price == price:
-                # update existing level
-                voldiff = total_vol - level.volume
-                if total_vol == 0:
-                    self.bids.pop(i)
-                else:
-                    level.volume = total_vol
-                self._update_total_bid(voldiff, price)
-                return
-            if level.price < price and total_vol > 0:
-                # insert before here and return
-                lnew = Order(price, total_vol, "ask")
-                self.bids.insert(i, lnew)
-                self._update_total_bid(total_vol, price)
-                return
-
-        # still here? -> end of list or empty list.
-        if total_vol > 0:
-            lnew = Order(price, total_vol, "ask")
-            self.bids.append(lnew)
-            self._update_total_bid(total_vol, price)
+        voldiff = self.bids.set_volume(price, total_vol)
+        if voldiff:
+            self._update_total_bid(voldiff, price)
 
     def _update_total_ask(self, volume):
         """update total BTC on the ask side"""
-        self.total_ask += int2float(volume, "BTC")
+        self.total_ask += volume
 
     def _update_total_bid(self, volume, price):
         """update total fiat on the bid side"""
-        self.total_bid += int2float(volume, "BTC") * int2float(price, self.gox.currency)
+        self.total_bid += volume * price
+
+    def _count_update(self):
+        """count depth and trade updates, check totals periodically"""
+        self._count_updates += 1
+        if self.totals_check_interval:
+            if self._count_updates % self.totals_check_interval == 0:
+                self.check_totals()
+
+    def check_totals(self):
+        """recompute total_ask and total_bid from scratch and compare them to
+        the incrementally updated values. Any difference will be logged and
+        corrected. Returns a tuple (drift_ask, drift_bid, seconds) where
+        seconds is the time the full recomputation took."""
+        time_start = time.time()
+        total_ask = self.asks.total_volume()
+        total_bid = self.bids.total_value()
+        duration = time.time() - time_start
+        self.totals_check = (
+            self.total_ask - total_ask, self.total_bid - total_bid, duration)
+        if self.totals_check[:2] != (0, 0):
+            self.debug("### totals drifted, ask: %d bid: %d, corrected" %
+                self.totals_check[:2])
+            self.total_ask = total_ask
+            self.total_bid = total_bid
+        return self.totals_check
+
+    def get_total_ask(self):
+        """return the total volume of all asks in BTC as float"""
+        return int2float(self.total_ask, "BTC")
+
+    def get_total_bid(self):
+        """return the total value of all bids in fiat currency as float"""
+        return int2float(self.total_bid, "BTC") * \
+            int2float(1, self.gox.currency)
+
+    def _mark_changed(self, side, price=None):
+        """remember that something on this side ("bid", "ask" or "own") has
+        changed, optionally at this price. side=None means everything."""
+        if not self._change:
+            self._change = BookChange()
+        self._change.add(side, price)
+
+    def _fire_changed(self):
+        """send signal_changed with all changes marked since the last time,
+        unless notifications are coalesced, then the timer will do it"""
+        if not self._notify_timer:
+            self.flush_changes()
+
+    def flush_changes(self):
+        """send signal_changed now if anything has changed since the last
+        time. When notifications are coalesced this is called by the timer
+        but it can also be called directly, for example after a batch of
+        messages has been processed. The payload is a BookChange object."""
+        with Signal._lock:
+            change = self._change
+            self._change = None
+        if change:
+            self.signal_changed(self, change)
+
+    def slot_notify_timer(self, _sender, _data):
+        """deliver coalesced change notifications"""
+        self.flush_changes()
 
     def get_own_volume_at(self, price):
         """returns the sum of the volume of own orders at a given price"""
-        volume = 0
-        for order in self.owns:
-            if order.price == price:
-                volume += order.volume
-        return volume
+        return self._own_volume.get(price, 0)
+
+    def get_own_orders_at(self, price):
+        """returns a list of all own orders at a given price"""
+        return list(self._own_by_price.get(price, []))
 
     def have_own_oid(self, oid):
         """do we have an own order with this oid in our list already?"""
-        for order in self.owns:
-            if order.oid == oid:
-                return True
-        return False
+        return oid in self._own_by_oid
 
     def init_own(self, own_orders):
         """called by gox when the initial order list is downloaded,
         this will happen after connect or reconnect"""
         self.owns = []
+        self._own_by_oid = {}
+        self._own_by_price = {}
+        self._own_volume = {}
         if own_orders:
             for order in own_orders:
                 if order["currency"] == self.gox.currency:
@@ -1715,7 +4056,8 @@ class OrderBook(BaseObject):
                         order["status"]
                     ))
 
-        self.signal_changed(self, None)
+        self._mark_changed(None)
+        self._fire_changed()
         self.signal_owns_changed(self, None)
 
     def add_own(self, order):
@@ -1723,7 +4065,9 @@ class OrderBook(BaseObject):
         after it has been submitted. This is a separate method because
         we need to fire the *_changed signals when this happens"""
         self._add_own(order)
-        self.signal_changed(self, None)
+        self._mark_changed("own")
+        self._mark_changed(order.typ, order.price)
+        self._fire_changed()
         self.signal_owns_changed(self, None)
 
     def _add_own(self, order):
@@ -1735,32 +4079,36 @@ class OrderBook(BaseObject):
         of the owns list will be done through the event method slot_user_order
         """
 
-        def insert_dummy(lst, is_ask):
-            """insert an empty (volume=0) dummy order into the bids or asks
-            to make the own order immediately appear in the UI, even if we
-            don't have the full orderbook yet. The dummy orders will be updated
-            later to reflect the true total volume at these prices once we get
-            authoritative data from the server"""
-            for i in range (len(lst)):
-                existing = lst[i]
-                if existing.price == order.price:
-                    return # no dummy needed, an order at this price exists
-                if is_ask:
-                    if existing.price > order.price:
-                        lst.insert(i, Order(order.price, 0, order.typ))
-                        return
-                else:
-                    if existing.price < order.price:
-                        lst.insert(i, Order(order.price, 0, order.typ))
-                        return
-
-            # end of list or empty
-            lst.append(Order(order.price, 0, order.typ))
-
         if not self.have_own_oid(order.oid):
             self.owns.append(order)
+            self._index_own(order)
 
+            # insert an empty (volume=0) dummy level into the bids or asks
+            # to make the own order immediately appear in the UI, even if we
+            # don't have the full orderbook yet. The dummy levels will be
+            # updated later to reflect the true total volume at these prices
+            # once we get authoritative data from the server
             if order.typ == "ask":
-                insert_dummy(self.asks, True)
+                self.asks.add_dummy(order.price)
             if order.typ == "bid":
-                insert_dummy(self.bids, False)
+                self.bids.add_dummy(order.price)
+
+    def _index_own(self, order):
+        """add an own order to the lookup indexes"""
+        self._own_by_oid[order.oid] = order
+        self._own_by_price.setdefault(order.price, []).append(order)
+        self._own_volume[order.price] = \
+            self._own_volume.get(order.price, 0) + order.volume
+
+    def _unindex_own(self, order):
+        """remove an own order from the lookup indexes, this must be called
+        *before* price or volume of an indexed order are modified"""
+        self._own_by_oid.pop(order.oid, None)
+        at_price = self._own_by_price.get(order.price, [])
+        if order in at_price:
+            at_price.remove(order)
+            if at_price:
+                self._own_volume[order.price] -= order.volume
+            else:
+                del self._own_by_price[order.price]
+                del self._own_volume[order.price]
@@ -24,6 +24,7 @@ framework for experimenting with trading bots
 # pylint: disable=C0301,C0302,R0902,R0903,R0912,R0913,R0915,R0922
 
 import argparse
+import contextlib
 import curses
 import curses.panel
 import curses.textpad
@@ -72,6 +73,11 @@ COLORS =    [["con_text",       curses.COLOR_BLUE,    curses.COLOR_CYAN]
 
 COLOR_PAIR = {}
 
+# with ui_queue_size = n (not 0) in the ini file the windows are updated
+# by the worker thread of this goxapi.SignalQueue of that length, so a slow
+# repaint can not stall the threads that receive the data (see connect_ui)
+UI_QUEUE = None
+
 def init_colors():
     """initialize curses color pairs and give them names. The color pair
     can then later quickly be retrieved from the COLOR_PAIR[] dict"""
@@ -81,6 +87,26 @@ def init_colors():
         COLOR_PAIR[name] = curses.color_pair(index)
         index += 1
 
+def connect_ui(signal, slot):
+    """connect a slot of a window to a signal, through the UI_QUEUE if there
+    is one. Slots connected this way must not be connected directly."""
+    if UI_QUEUE:
+        UI_QUEUE.connect(signal, slot)
+    else:
+        signal.connect(slot)
+
+@contextlib.contextmanager
+def ui_lock():
+    """hold this while using curses outside of the window slots, it keeps
+    the slots and everything that changes the data they paint out"""
+    if UI_QUEUE:
+        with UI_QUEUE.lock:
+            with goxapi.Signal._lock:
+                yield
+    else:
+        with goxapi.Signal._lock:
+            yield
+
 class Win:
     """represents a curses window"""
     # pylint: disable=R0902
@@ -112,7 +138,10 @@ class Win:
 
     def do_paint(self):
         """call this if you want the window to repaint itself"""
-        self.paint()
+        # the data must not change while it is painted (this is already
+        # held when called from a slot, but not by the UI_QUEUE worker)
+        with goxapi.Signal._lock:
+            self.paint()
         self.done_paint()
 
     def done_paint(self):
@@ -200,7 +229,7 @@ class WinConsole(Win):
         """create the console window and connect it to the Gox debug
         callback function"""
         self.gox = gox
-        gox.signal_debug.connect(self.slot_debug)
+        connect_ui(gox.signal_debug, self.slot_debug)
         Win.__init__(self, stdscr)
 
     def paint(self):
@@ -237,7 +266,7 @@ class WinOrderBook(Win):
         """create the orderbook window and connect it to the
         onChanged callback of the gox.orderbook instance"""
         self.gox = gox
-        gox.orderbook.signal_changed.connect(self.slot_changed)
+        connect_ui(gox.orderbook.signal_changed, self.slot_changed)
         Win.__init__(self, stdscr)
 
     def calc_size(self):
@@ -306,8 +335,8 @@ class WinChart(Win):
         self.gox = gox
         self.pmin = 0
         self.pmax = 0
-        gox.history.signal_changed.connect(self.slot_hist_changed)
-        gox.orderbook.signal_changed.connect(self.slot_book_changed)
+        connect_ui(gox.history.signal_changed, self.slot_hist_changed)
+        connect_ui(gox.orderbook.signal_changed, self.slot_book_changed)
         Win.__init__(self, stdscr)
 
     def calc_size(self):
@@ -384,17 +413,11 @@ class WinChart(Win):
         self.pmax = 0
         self.pmin = 9999999999
 
-        # determine y range
-        posx = self.width - 2
-        index = 0
-        while index < hist.length() and posx >= 0:
-            candle = hist.candles[index]
-            if self.pmax < candle.hig:
-                self.pmax = candle.hig
-            if self.pmin > candle.low:
-                self.pmin = candle.low
-            index += 1
-            posx -= 1
+        # determine y range from the visible candles
+        count = min(hist.length(), self.width - 1)
+        if count > 0:
+            self.pmax = max(hist.column("hig", count))
+            self.pmin = min(hist.column("low", count))
 
         if self.pmax == self.pmin:
             return
@@ -403,7 +426,7 @@ class WinChart(Win):
         posx = self.width - 2
         index = 0
         while index < hist.length() and posx >= 0:
-            candle = hist.candles[index]
+            candle = hist.candle(index)
             self.paint_candle(posx, candle)
             index += 1
             posx -= 1
@@ -464,9 +487,9 @@ class WinStatus(Win):
         self.gox = gox
         self.order_lag = 0
         self.order_lag_txt = ""
-        gox.signal_orderlag.connect(self.slot_orderlag)
-        gox.signal_wallet.connect(self.slot_changed)
-        gox.orderbook.signal_changed.connect(self.slot_changed)
+        connect_ui(gox.signal_orderlag, self.slot_orderlag)
+        connect_ui(gox.signal_wallet, self.slot_changed)
+        connect_ui(gox.orderbook.signal_changed, self.slot_changed)
         Win.__init__(self, stdscr)
 
     def calc_size(self):
@@ -488,11 +511,12 @@ class WinStatus(Win):
         else:
             line1 += "No info (yet)"
 
-        str_btc = locale.format('%d', self.gox.orderbook.total_ask, 1)
-        str_fiat = locale.format('%d', self.gox.orderbook.total_bid, 1)
-        if self.gox.orderbook.total_ask:
-            str_ratio = locale.format('%1.2f',
-                self.gox.orderbook.total_bid / self.gox.orderbook.total_ask, 1)
+        total_ask = self.gox.orderbook.get_total_ask()
+        total_bid = self.gox.orderbook.get_total_bid()
+        str_btc = locale.format('%d', total_ask, 1)
+        str_fiat = locale.format('%d', total_bid, 1)
+        if total_ask:
+            str_ratio = locale.format('%1.2f', total_bid / total_ask, 1)
         else:
             str_ratio = "-"
 
@@ -722,7 +746,7 @@ class TextBox():
         position. This is only a cosmetic problem but very annnoying. Try to
         force it into the edit field by repainting it very often."""
         while self.editing:
-            with goxapi.Signal._lock:
+            with ui_lock():
                 self.win.touchwin()
                 self.win.refresh()
             time.sleep(0.1)
@@ -946,10 +970,22 @@ def main():
     def curses_loop(stdscr):
         """This code runs within curses environment"""
 
+        global UI_QUEUE # pylint: disable=W0603
+
         init_colors()
 
         gox = goxapi.Gox(secret, config)
 
+        if config.get_int("goxtool", "ui_queue_size"):
+            UI_QUEUE = goxapi.SignalQueue("ui",
+                config.get_int("goxtool", "ui_queue_size"))
+
+        recorder = None
+        if args.record:
+            recorder = goxapi.FeedRecorder(args.record)
+            recorder.signal_debug.connect(gox.signal_debug)
+            recorder.connect(gox.client)
+
         conwin = WinConsole(stdscr, gox)
         bookwin = WinOrderBook(stdscr, gox)
         statuswin = WinStatus(stdscr, gox)
@@ -972,7 +1008,7 @@ def main():
                 if key == curses.KEY_F6:
                     DlgCancelOrders(stdscr, gox).modal()
                 if key == curses.KEY_RESIZE:
-                    with goxapi.Signal._lock:
+                    with ui_lock():
                         stdscr.erase()
                         stdscr.refresh()
                         conwin.resize()
@@ -994,6 +1030,11 @@ def main():
 
         strategy_manager.unload()
         gox.stop()
+        if UI_QUEUE:
+            UI_QUEUE.stop()
+            gox.debug("### ui queue:", UI_QUEUE.stats())
+        if recorder:
+            recorder.close()
         printhook.close()
         logwriter.close()
         # The End.
@@ -1021,6 +1062,14 @@ def main():
         help="do not download full history (useful for debugging)")
     argp.add_argument('--use-http', action="store_true", default="",
         help="use http api for trading (useful when socketio is lagging like hell")
+    argp.add_argument('--server', action="store", default="",
+        help="connect to HOST:PORT without SSL instead of MtGox (for testing)")
+    argp.add_argument('--record', action="store", default="",
+        help="record the received data to files named RECORD.<date-time>")
+    argp.add_argument('--replay', action="store", default="",
+        help="play back recorded files REPLAY.* instead of connecting")
+    argp.add_argument('--replay-speed', action="store", type=float, default=1,
+        help="replay at this factor of the original speed, 0=max, default=1")
     args = argp.parse_args()
 
     config = goxapi.GoxConfig("goxtool.ini")
@@ -1034,6 +1083,13 @@ def main():
         goxapi.FORCE_NO_FULLDEPTH = args.no_fulldepth
         goxapi.FORCE_NO_HISTORY = args.no_history
         goxapi.FORCE_HTTP_API = args.use_http
+        goxapi.FORCE_REPLAY = args.replay
+        goxapi.FORCE_REPLAY_SPEED = args.replay_speed
+        if args.server:
+            goxapi.SOCKETIO_HOST = args.server
+            goxapi.WEBSOCKET_HOST = args.server
+            goxapi.HTTP_HOST = args.server
+            goxapi.FORCE_NO_SSL = True
         if secret.prompt_decrypt() != secret.S_FAIL_FATAL:
             curses.wrapper(curses_loop)
             print
@@ -28,8 +28,14 @@ import struct
 import uuid
 import hashlib
 import base64
+import binascii
 import logging
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 """
 websocket python client.
 =========================
@@ -177,6 +183,10 @@ def create_connection(url, timeout=None, **options):
     websock.connect(url, **options)
     return websock
 
+# initial size of the receive buffer. Everything we receive goes through
+# this buffer (see WebSocket._fill()), it grows if a frame does not fit.
+_RECV_BUFSIZE = 65536
+
 _MAX_INTEGER = (1 << 32) -1
 _AVAILABLE_KEY_CHARS = range(0x21, 0x2f + 1) + range(0x3a, 0x7e + 1)
 _MAX_CHAR_BYTE = (1<<8) -1
@@ -202,6 +212,14 @@ class _SSLSocketWrapper(object):
     def recv(self, bufsize):
         return self.ssl.read(bufsize)
 
+    def recv_into(self, buf):
+        bytes = self.ssl.read(len(buf))
+        buf[:len(bytes)] = bytes
+        return len(bytes)
+
+    def pending(self):
+        return self.ssl.pending()
+
     def send(self, payload):
         return self.ssl.write(payload)
 
@@ -310,8 +328,7 @@ class ABNF(object):
             return frame_header + self._get_masked(mask_key)
 
     def _get_masked(self, mask_key):
-        s = ABNF.mask(mask_key, self.data)
-        return mask_key + "".join(s)
+        return mask_key + ABNF.mask(mask_key, self.data)
 
     @staticmethod
     def mask(mask_key, data):
@@ -322,11 +339,41 @@ class ABNF(object):
 
         data: data to mask/unmask.
         """
-        _m = array.array("B", mask_key)
-        _d = array.array("B", data)
-        for i in xrange(len(_d)):
-            _d[i] ^= _m[i % 4]
-        return _d.tostring()
+        if numpy and len(data) >= _MASK_NUMPY_MIN:
+            return _mask_numpy(mask_key, data)
+        return _mask_long(mask_key, data)
+
+
+# below this payload size the numpy call overhead is larger
+# than the time _mask_long() needs (see benchmark/websocket_mask.py)
+_MASK_NUMPY_MIN = 128
+
+def _mask_loop(mask_key, data):
+    """xor byte by byte (the old implementation, kept as reference)"""
+    _m = array.array("B", mask_key)
+    _d = array.array("B", data)
+    for i in xrange(len(_d)):
+        _d[i] ^= _m[i % 4]
+    return _d.tostring()
+
+def _mask_long(mask_key, data):
+    """xor the whole payload at once as one big integer"""
+    length = len(data)
+    if not length:
+        return ""
+    key = (mask_key * (length // 4 + 1))[:length]
+    value = long(binascii.hexlify(data), 16) ^ long(binascii.hexlify(key), 16)
+    return binascii.unhexlify("%0*x" % (2 * length, value))
+
+def _mask_numpy(mask_key, data):
+    """xor in 32 bit words with numpy, the tail is padded"""
+    length = len(data)
+    if not length:
+        return ""
+    padded = data + "\0" * (-length % 4)
+    words = numpy.frombuffer(padded, dtype=numpy.uint32)
+    key = numpy.frombuffer(mask_key, dtype=numpy.uint32)
+    return (words ^ key).tostring()[:length]
 
 
 class WebSocket(object):
@@ -358,6 +405,7 @@ class WebSocket(object):
         self.connected = False
         self.io_sock = self.sock = socket.socket()
         self.get_mask_key = get_mask_key
+        self._reset_buffer()
 
     def set_mask_key(self, func):
         """
@@ -553,60 +601,137 @@ class WebSocket(object):
 
         return  value: tuple of operation code and string(byte array) value.
         """
+        opcode, data = self.recv_data_view()
+        if data is not None:
+            data = data.tobytes()
+        return (opcode, data)
+
+    def recv_data_view(self):
+        """
+        Recieve data with operation code like recv_data() but without
+        copying the payload. The frame header is parsed directly in the
+        receive buffer and the payload is returned as a memoryview into
+        that buffer.
+
+        The view is only valid until the next call of any recv method,
+        use tobytes() (or slice it first) to keep the data.
+
+        return  value: tuple of operation code and memoryview.
+        """
         while True:
-            frame = self.recv_frame()
-            if not frame:
-                # handle error:
-                # 'NoneType' object has no attribute 'opcode'
-                raise WebSocketException("Not a valid frame %s" % frame)
-            elif frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
-                return (frame.opcode, frame.data)
-            elif frame.opcode == ABNF.OPCODE_CLOSE:
-                self.send_close()
-                return (frame.opcode, None)
-            elif frame.opcode == ABNF.OPCODE_PING:
-                self.pong(frame.data)
+            opcode, data = self.recv_frame_view()
+            if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                return (opcode, data)
+            elif opcode == ABNF.OPCODE_CLOSE:
+                return (opcode, None)
 
-    def recv_frame(self):
+    def recv_frame_view(self):
         """
-        recieve data as frame from server.
+        Recieve exactly one frame, ping frames are answered and close
+        frames are confirmed before this returns. The payload is a
+        memoryview into the receive buffer, see recv_data_view().
 
-        return value: ABNF frame object.
+        return  value: tuple of operation code and memoryview
+                       (None for close frames).
         """
-        header_bytes = self._recv_strict(2)
-        if not header_bytes:
-            return None
-        b1 = ord(header_bytes[0])
-        fin = b1 >> 7 & 1
-        rsv1 = b1 >> 6 & 1
-        rsv2 = b1 >> 5 & 1
-        rsv3 = b1 >> 4 & 1
+        b1, mask_key, length = self._recv_header()
         opcode = b1 & 0xf
-        b2 = ord(header_bytes[1])
-        mask = b2 >> 7 & 1
-        length = b2 & 0x7f
+        if self._rend - self._rpos < length:
+            self._fill(length)
+        data = self._view(length)
+        if traceEnabled:
+            logger.debug("recv: " + repr(data.tobytes()))
+        if mask_key:
+            data = memoryview(ABNF.mask(mask_key, data.tobytes()))
+
+        if opcode == ABNF.OPCODE_CLOSE:
+            self.send_close()
+            return (opcode, None)
+        elif opcode == ABNF.OPCODE_PING:
+            self.pong(data.tobytes())
+        return (opcode, data)
 
-        length_data = ""
+    def recv_available(self):
+        """
+        Read whatever has arrived into the receive buffer. This is meant
+        to be called when select() reports the socket as readable, it will
+        then not block (apart from waiting for the rest of an SSL record).
+        Use frame_ready() and recv_frame_view() to get the frames.
+        """
+        while True:
+            if self._rend == len(self._rbuf):
+                self._compact(self._rend - self._rpos + _RECV_BUFSIZE)
+            bytes = self.io_sock.recv_into(self._rview[self._rend:])
+            if not bytes:
+                raise WebSocketConnectionClosedException()
+            self._rend += bytes
+            pending = getattr(self.io_sock, "pending", None)
+            if not (pending and pending()):
+                return
+
+    def frame_ready(self):
+        """
+        Return True if a complete frame is in the receive buffer,
+        recv_frame_view() can then be called without blocking.
+        """
+        available = self._rend - self._rpos
+        if available < 2:
+            return False
+        b2 = self._rbuf[self._rpos + 1]
+        header_len = _header_len(b2)
+        if available < header_len:
+            return False
+        length = b2 & 0x7f
         if length == 0x7e:
-            length_data = self._recv_strict(2)
-            length = struct.unpack("!H", length_data)[0]
+            length = struct.unpack_from("!H", self._rbuf, self._rpos + 2)[0]
         elif length == 0x7f:
-            length_data = self._recv_strict(8)
-            length = struct.unpack("!Q", length_data)[0]
+            length = struct.unpack_from("!Q", self._rbuf, self._rpos + 2)[0]
+        return available >= header_len + length
 
-        mask_key = ""
-        if mask:
-            mask_key = self._recv_strict(4)
-        data = self._recv_strict(length)
-        if traceEnabled:
-            recieved = header_bytes + length_data + mask_key + data
-            logger.debug("recv: " + repr(recieved))
+    def recv_frame(self):
+        """
+        recieve data as frame from server.
 
-        if mask:
+        return value: ABNF frame object.
+        """
+        b1, mask_key, length = self._recv_header()
+        self._fill(length)
+        data = self._consume(length)
+        if traceEnabled:
+            logger.debug("recv: " + repr(data))
+        if mask_key:
             data = ABNF.mask(mask_key, data)
 
-        frame = ABNF(fin, rsv1, rsv2, rsv3, opcode, mask, data)
-        return frame
+        return ABNF(b1 >> 7 & 1, b1 >> 6 & 1, b1 >> 5 & 1, b1 >> 4 & 1,
+                    b1 & 0xf, mask_key is not None, data)
+
+    def _recv_header(self):
+        """
+        parse the next frame header in the receive buffer and consume it.
+
+        return value: tuple of first header byte, mask key (None if the
+        frame is not masked) and payload length.
+        """
+        if self._rend - self._rpos < 2:
+            self._fill(2)
+        rbuf = self._rbuf
+        b2 = rbuf[self._rpos + 1]
+        length = b2 & 0x7f
+        header_len = _header_len(b2)
+        if header_len > 2 and self._rend - self._rpos < header_len:
+            self._fill(header_len)
+            rbuf = self._rbuf
+
+        pos = self._rpos
+        self._rpos = pos + header_len
+        if length == 0x7e:
+            length = struct.unpack_from("!H", rbuf, pos + 2)[0]
+        elif length == 0x7f:
+            length = struct.unpack_from("!Q", rbuf, pos + 2)[0]
+        mask_key = None
+        if b2 & 0x80:
+            mask_key = str(rbuf[pos + header_len - 4:pos + header_len])
+        return rbuf[pos], mask_key, length
 
     def send_close(self, status = STATUS_NORMAL, reason = ""):
         """
@@ -652,30 +777,99 @@ class WebSocket(object):
         self.connected = False
         self.sock.close()
         self.io_sock = self.sock
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        """
+        (re)initialize the receive buffer
+        """
+        self._rbuf = bytearray(_RECV_BUFSIZE)
+        self._rview = memoryview(self._rbuf)
+        self._rpos = 0
+        self._rend = 0
+
+    def _fill(self, size):
+        """
+        make sure there are at least size unread bytes in the receive
+        buffer. Headers, lines and frames are all parsed from this buffer,
+        so we need only one system call (and one SSL read) per chunk instead
+        of one per byte, and whatever is left over after the handshake will
+        automatically be used by the frame decoder.
+
+        The socket reads directly into the preallocated buffer with
+        recv_into(), unread bytes are moved to the front only when a frame
+        does not fit into the rest of the buffer. If it does not fit at all
+        the buffer is replaced by a larger one which is then kept.
+        """
+        while self._rend - self._rpos < size:
+            if self._rpos + size > len(self._rbuf):
+                self._compact(size)
+            bytes = self.io_sock.recv_into(self._rview[self._rend:])
+            if not bytes:
+                raise WebSocketConnectionClosedException()
+            self._rend += bytes
+
+    def _compact(self, size):
+        """
+        move the unread bytes to the beginning of the buffer and grow
+        it if it can not hold at least size bytes
+        """
+        unread = self._rbuf[self._rpos:self._rend]
+        if size > len(self._rbuf):
+            self._rbuf = bytearray(max(size, 2 * len(self._rbuf)))
+            self._rview = memoryview(self._rbuf)
+        self._rbuf[:len(unread)] = unread
+        self._rpos = 0
+        self._rend = len(unread)
+
+    def _view(self, size):
+        """
+        consume size bytes from the receive buffer and return
+        them as a memoryview (valid until the next _fill())
+        """
+        start = self._rpos
+        self._rpos += size
+        view = self._rview[start:self._rpos]
+        if self._rpos == self._rend:
+            self._rpos = self._rend = 0
+        return view
+
+    def _consume(self, size):
+        """
+        consume size bytes from the receive buffer and return them
+        """
+        return self._view(size).tobytes()
 
     def _recv(self, bufsize):
-        bytes = self.io_sock.recv(bufsize)
-        if not bytes:
-            raise WebSocketConnectionClosedException()
-        return bytes
+        if self._rpos == self._rend:
+            self._fill(1)
+        return self._consume(min(bufsize, self._rend - self._rpos))
 
     def _recv_strict(self, bufsize):
-        remaining = bufsize
-        bytes = ""
-        while remaining:
-            bytes += self._recv(remaining)
-            remaining = bufsize - len(bytes)
-
-        return bytes
+        self._fill(bufsize)
+        return self._consume(bufsize)
 
     def _recv_line(self):
-        line = []
         while True:
-            c = self._recv(1)
-            line.append(c)
-            if c == "\n":
-                break
-        return "".join(line)
+            pos = self._rbuf.find("\n", self._rpos, self._rend)
+            if pos >= 0:
+                return self._consume(pos + 1 - self._rpos)
+            self._fill(self._rend - self._rpos + 1)
+
+
+def _header_len(b2):
+    """
+    length of a frame header, determined by its second byte
+    """
+    header_len = 2
+    length = b2 & 0x7f
+    if length == 0x7e:
+        header_len = 4
+    elif length == 0x7f:
+        header_len = 10
+    if b2 & 0x80:
+        header_len += 4
+    return header_len
 
 
 class WebSocketApp(object):
@@ -0,0 +1,1189 @@
+import BaseHTTPServer
+import gzip
+import httplib
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import goxapi
+import websocket
+
+
+class FakeGox(object):
+    '''
+    Minimal stand-in for goxapi.Gox, provides only the
+    signals and attributes an OrderBook needs.
+    '''
+
+    def __init__(self):
+        self.currency = 'USD'
+        self.signal_ticker = goxapi.Signal()
+        self.signal_depth = goxapi.Signal()
+        self.signal_depth_stamped = goxapi.Signal()
+        self.signal_trade = goxapi.Signal()
+        self.signal_userorder = goxapi.Signal()
+        self.signal_fulldepth = goxapi.Signal()
+        self.signal_partialdepth = goxapi.Signal()
+        self.signal_fullhistory = goxapi.Signal()
+
+
+def fulldepth(asks, bids):
+    '''
+    Returns a fulldepth message like the one from money/depth/full,
+    asks and bids are lists of (price, volume) sorted by price.
+    '''
+    return {'result': 'success', 'data': {
+        'asks': [{'price_int': str(p), 'amount_int': str(v)} for p, v in asks],
+        'bids': [{'price_int': str(p), 'amount_int': str(v)} for p, v in bids],
+    }}
+
+
+def depth_message(currency, separators=(',', ':'), volume=2, total=3):
+    '''
+    Returns the JSON string of a streaming depth message for an ask at 100.
+    '''
+    return json.dumps({'op': 'private', 'private': 'depth',
+        'channel': '24e67e0d-1cad-4cc0-9e7a-f8523ef460fe',
+        'depth': {'currency': currency, 'type_str': 'ask', 'now': '5000',
+            'price_int': '100', 'volume_int': str(volume),
+            'total_volume_int': str(total)}}, separators=separators)
+
+
+class TestOrderBook(unittest.TestCase):
+
+    compact = False
+
+    def setUp(self):
+        self.gox = FakeGox()
+        self.book = goxapi.OrderBook(self.gox, self.compact)
+        self.gox.signal_fulldepth(self.gox, fulldepth(
+            [(101, 10), (102, 20), (105, 30)],
+            [(90, 5), (95, 15), (99, 25)]))
+
+    def prices(self, side):
+        return [level.price for level in side]
+
+    def test_fulldepth_sorted(self):
+        self.assertEqual([101, 102, 105], self.prices(self.book.asks))
+        self.assertEqual([99, 95, 90], self.prices(self.book.bids))
+        self.assertEqual((99, 101), (self.book.bid, self.book.ask))
+
+    def test_depth_insert_update_remove(self):
+        self.gox.signal_depth_stamped(self.gox, ('ask', 103, 7, 7, 0))
+        self.gox.signal_depth_stamped(self.gox, ('bid', 97, 3, 3, 0))
+        self.assertEqual([101, 102, 103, 105], self.prices(self.book.asks))
+        self.assertEqual([99, 97, 95, 90], self.prices(self.book.bids))
+
+        self.gox.signal_depth_stamped(self.gox, ('ask', 102, 5, 25, 0))
+        self.assertEqual(25, self.book.asks[1].volume)
+
+        self.gox.signal_depth_stamped(self.gox, ('bid', 99, -25, 0, 0))
+        self.assertEqual([97, 95, 90], self.prices(self.book.bids))
+        self.assertEqual(97, self.book.bids[0].price)
+
+    def test_trade_removes_filled_level(self):
+        self.gox.signal_trade(self.gox, (0, 101, 10, 'bid', False))
+        self.assertEqual([102, 105], self.prices(self.book.asks))
+        self.assertEqual(102, self.book.ask)
+
+    def test_ticker_repairs_crossed(self):
+        self.gox.signal_ticker(self.gox, (95, 105))
+        self.assertEqual([105], self.prices(self.book.asks))
+        self.assertEqual([95, 90], self.prices(self.book.bids))
+
+    def test_totals_exact(self):
+        self.assertEqual(60, self.book.total_ask)
+        self.assertEqual(90 * 5 + 95 * 15 + 99 * 25, self.book.total_bid)
+        self.gox.signal_depth_stamped(self.gox, ('ask', 103, 7, 7, 0))
+        self.gox.signal_depth_stamped(self.gox, ('bid', 95, -5, 10, 0))
+        self.gox.signal_trade(self.gox, (0, 99, 30, 'ask', False))
+        self.gox.signal_ticker(self.gox, (90, 102))
+        self.assertEqual((0, 0), self.book.check_totals()[:2])
+        self.assertEqual(20 + 7 + 30, self.book.total_ask)
+
+
+    def test_snapshot(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'test.USD.book')
+        self.book.save_snapshot(filename)
+        self.book.save_snapshot(filename) # replaces the existing file
+        gox = FakeGox()
+        book = goxapi.OrderBook(gox, not self.compact)
+        self.assertTrue(book.load_snapshot(filename, 60))
+        self.assertEqual(self.book.asks.pairs(), book.asks.pairs())
+        self.assertEqual(self.book.bids.pairs(), book.bids.pairs())
+        self.assertEqual((99, 101), (book.bid, book.ask))
+        self.assertEqual((self.book.total_ask, self.book.total_bid),
+                         (book.total_ask, book.total_bid))
+        self.assertTrue(book.snapshot_time)
+
+        gox.currency = 'EUR'
+        self.assertFalse(goxapi.OrderBook(gox).load_snapshot(filename))
+        shutil.rmtree(os.path.dirname(filename))
+
+    def test_snapshot_damaged(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'test.USD.book')
+        self.book.save_snapshot(filename)
+        with open(filename, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+        # offset 6 is the array typecode, then a truncated file
+        for damaged in [data[:6] + 'x' + data[7:], data[:6] + 'c' + data[7:],
+                        data[:6] + 'i' + data[7:], data[:-3], data[:10]]:
+            with open(filename, 'wb') as snapshot_file:
+                snapshot_file.write(damaged)
+            book = goxapi.OrderBook(FakeGox())
+            self.assertFalse(book.load_snapshot(filename))
+            self.assertEqual(0, len(book.asks))
+        shutil.rmtree(os.path.dirname(filename))
+
+
+class TestOrderBookCompact(TestOrderBook):
+
+    compact = True
+
+    def test_views_are_orders(self):
+        level = self.book.bids[-1]
+        self.assertEqual((90, 5, 'bid'), (level.price, level.volume, level.typ))
+        self.assertEqual([95, 90], [x.price for x in self.book.bids[1:]])
+
+
+class TestDepthResync(unittest.TestCase):
+
+    def setUp(self):
+        self.gox = FakeGox()
+        self.book = goxapi.OrderBook(self.gox)
+        self.resyncs = []
+        self.book.signal_resync.connect(self.slot_resync)
+        message = fulldepth([(101, 10), (102, 20), (105, 30)],
+                            [(90, 5), (95, 15), (99, 25)])
+        message['data']['now'] = '1000'
+        self.gox.signal_fulldepth(self.gox, message)
+
+    def slot_resync(self, dummy_book, full):
+        self.resyncs.append(full)
+
+    def depth(self, now, data):
+        self.gox.signal_depth_stamped(self.gox, data + (now,))
+
+    def test_consistent(self):
+        self.depth(1001, ('ask', 102, 5, 25))
+        self.gox.signal_trade(self.gox, (0, 101, 4, 'bid', False))
+        self.depth(1002, ('ask', 101, -4, 6))
+        self.assertEqual((0, []), (self.book.count_gaps, self.resyncs))
+
+    def test_stale(self):
+        self.depth(999, ('ask', 102, 5, 15))
+        self.assertEqual(20, self.book.asks.get(102).volume)
+        self.assertEqual(1, self.book.count_stale)
+
+    def test_gap_and_partial(self):
+        self.depth(1001, ('ask', 102, 5, 30))
+        self.depth(1002, ('bid', 80, 1, 2))
+        self.assertEqual(2, self.book.count_gaps)
+        self.assertEqual([False, False], self.resyncs)
+
+        message = fulldepth([(101, 10), (103, 3)], [(99, 25)])
+        message['data'].update({'now': '1001',
+            'filter_min_price': {'value_int': '95'},
+            'filter_max_price': {'value_int': '103'}})
+        self.gox.signal_partialdepth(self.gox, message)
+        self.assertEqual([101, 103, 105],
+                         [price for price, _ in self.book.asks.pairs()])
+        self.assertEqual([(99, 25), (90, 5), (80, 2)], self.book.bids.pairs())
+        self.assertEqual((0, 0), self.book.check_totals()[:2])
+        self.assertEqual(1, self.book.count_resyncs)
+        # the gap at 80 was outside of the partial depth
+        self.assertEqual([False, False, True], self.resyncs)
+
+        # older than the partial depth inside its range: ignored
+        self.depth(1001, ('ask', 103, 1, 4))
+        self.assertEqual(3, self.book.asks.get(103).volume)
+
+    def test_partial_duplicates(self):
+        message = fulldepth([(101, 10), (101, 5)], [(99, 25)])
+        message['data'].update({'now': '1001',
+            'filter_min_price': {'value_int': '95'},
+            'filter_max_price': {'value_int': '103'}})
+        self.gox.signal_partialdepth(self.gox, message)
+        self.assertEqual(15, self.book.asks.get(101).volume)
+        self.assertEqual((0, 0), self.book.check_totals()[:2])
+
+    def test_repair_counted(self):
+        self.gox.signal_ticker(self.gox, (95, 105))
+        self.assertEqual(3, self.book.count_repairs)
+        self.assertEqual([False, False], self.resyncs)
+
+
+class TestFulldepthParser(unittest.TestCase):
+
+    def test_chunks(self):
+        message = fulldepth([(101, 10), (102, 20)], [(90, 5), (99, 25)])
+        message['data']['filter_max_price'] = {'value_int': '1000'}
+        text = json.dumps(message, indent=1)
+        for size in [1, 7, len(text)]:
+            parser = goxapi.FulldepthParser()
+            for pos in range(0, len(text), size):
+                parser.feed(text[pos:pos + size])
+            depth = parser.close()
+            self.assertEqual('success', depth['result'])
+            self.assertEqual([(101, 10), (102, 20)], depth['data']['asks'])
+            self.assertEqual([(90, 5), (99, 25)], depth['data']['bids'])
+            self.assertEqual('1000',
+                depth['data']['filter_max_price']['value_int'])
+
+    def test_truncated(self):
+        parser = goxapi.FulldepthParser()
+        parser.feed('{"data": {"asks": [{"price_int": "1", "amount_int": "2"}')
+        self.assertRaises(ValueError, parser.close)
+
+
+class TestOwnOrders(unittest.TestCase):
+
+    def setUp(self):
+        self.gox = FakeGox()
+        self.book = goxapi.OrderBook(self.gox)
+        self.book.init_own([
+            {'currency': 'USD', 'price': {'value_int': '100'},
+             'amount': {'value_int': '10'}, 'type': 'ask',
+             'oid': 'a', 'status': 'open'},
+            {'currency': 'USD', 'price': {'value_int': '100'},
+             'amount': {'value_int': '5'}, 'type': 'ask',
+             'oid': 'b', 'status': 'open'},
+            {'currency': 'EUR', 'price': {'value_int': '100'},
+             'amount': {'value_int': '7'}, 'type': 'ask',
+             'oid': 'c', 'status': 'open'},
+        ])
+
+    def test_init_own(self):
+        self.assertEqual(15, self.book.get_own_volume_at(100))
+        self.assertTrue(self.book.have_own_oid('a'))
+        self.assertFalse(self.book.have_own_oid('c'))
+        self.assertEqual([100], [level.price for level in self.book.asks])
+
+    def test_user_order_update_and_remove(self):
+        self.gox.signal_userorder(self.gox, (110, 10, 'ask', 'a', 'open'))
+        self.assertEqual(5, self.book.get_own_volume_at(100))
+        self.assertEqual(10, self.book.get_own_volume_at(110))
+
+        self.gox.signal_userorder(self.gox, (0, 0, '', 'b', 'removed'))
+        self.assertEqual(0, self.book.get_own_volume_at(100))
+        self.assertEqual([], self.book.get_own_orders_at(100))
+        self.assertEqual(['a'], [order.oid for order in self.book.owns])
+
+    def test_user_order_add(self):
+        self.gox.signal_userorder(self.gox, (90, 3, 'bid', 'd', 'pending'))
+        self.assertTrue(self.book.have_own_oid('d'))
+        self.assertEqual(['d'],
+            [order.oid for order in self.book.get_own_orders_at(90)])
+
+
+class TestBookChange(unittest.TestCase):
+
+    def setUp(self):
+        self.gox = FakeGox()
+        self.changes = []
+        self.book = goxapi.OrderBook(self.gox, notify_rate=1)
+        self.book._notify_timer.cancel()
+        self.book.signal_changed.connect(self.slot_changed)
+
+    def slot_changed(self, dummy_book, change):
+        self.changes.append(change)
+
+    def test_coalesced(self):
+        self.gox.signal_depth_stamped(self.gox, ('ask', 103, 7, 7, 0))
+        self.gox.signal_depth_stamped(self.gox, ('ask', 101, 7, 7, 0))
+        self.gox.signal_depth_stamped(self.gox, ('ask', 102, 7, 7, 0))
+        self.assertEqual([], self.changes)
+
+        self.book.flush_changes()
+        self.assertEqual(1, len(self.changes))
+        change = self.changes[0]
+        self.assertEqual(set(['ask']), change.sides)
+        self.assertEqual((101, 103), change.ranges['ask'])
+        self.assertTrue(change.affects('ask', 102))
+        self.assertFalse(change.affects('ask', 104))
+        self.assertFalse(change.affects('bid'))
+
+        self.book.flush_changes()
+        self.assertEqual(1, len(self.changes))
+
+    def test_stop(self):
+        book = goxapi.OrderBook(self.gox, notify_rate=1)
+        book.stop()
+        self.assertTrue(book._notify_timer._timer.finished.is_set())
+
+    def test_fulldepth_is_full_change(self):
+        self.gox.signal_fulldepth(self.gox, fulldepth([(101, 1)], [(99, 1)]))
+        self.book.flush_changes()
+        self.assertTrue(self.changes[0].full)
+        self.assertTrue(self.changes[0].affects('bid', 1))
+
+
+class TestGoxTimers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = goxapi.GoxConfig(os.path.join(self.tmpdir, 'test.ini'))
+        self.config.set('gox', 'use_event_loop', 'True')
+        self.config.set('gox', 'orderbook_notify_rate', '10')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_gox(self):
+        gox = goxapi.Gox(goxapi.Secret(self.config), self.config)
+        gox.timer_poll.cancel()
+        return gox
+
+    def test_notify_timer(self):
+        gox = self.make_gox()
+        timer = gox.orderbook._notify_timer
+        self.assertTrue(timer._loop is gox._loop)
+        gox.stop()
+        self.assertEqual(None, timer._timer.func)
+
+    def test_profile_timer(self):
+        gox = self.make_gox()
+        gox.enable_profiling(60)
+        timer = gox.timer_profile
+        self.assertTrue(timer._loop is gox._loop)
+        gox.disable_profiling()
+        self.assertEqual(None, timer._timer.func)
+
+        gox.enable_profiling(60)
+        timer = gox.timer_profile
+        gox.stop()
+        self.assertEqual(None, timer._timer.func)
+        self.assertEqual(None, gox.timer_profile)
+        gox.disable_profiling()
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.gox = FakeGox()
+        self.history = goxapi.History(self.gox, 60, max_candles=3)
+
+    def trade(self, date, price, volume=1):
+        self.gox.signal_trade(self.gox, (date, price, volume, 'bid', False))
+
+    def test_candles(self):
+        self.trade(60, 100)
+        self.trade(70, 110)
+        self.trade(130, 90)
+        self.assertEqual(2, self.history.length())
+        self.assertEqual(120, self.history.last_candle().tim)
+        self.assertEqual(120, self.history.candle(0).tim)
+        candle = self.history.candle(1)
+        self.assertEqual((60, 100, 110, 100, 110, 2), (candle.tim,
+            candle.opn, candle.hig, candle.low, candle.cls, candle.vol))
+        self.assertEqual([110, 90], list(self.history.column('hig')))
+        self.assertEqual([90], list(self.history.column('low', 1)))
+        self.assertRaises(IndexError, self.history.candle, 2)
+        self.assertRaises(IndexError, self.history.candle, -1)
+
+    def test_max_candles(self):
+        for minute in range(10):
+            self.trade(minute * 60, 100 + minute)
+        self.assertEqual(3, self.history.length())
+        self.assertEqual(540, self.history.candle(0).tim)
+        self.assertEqual(420, self.history.candle(2).tim)
+
+    def test_fullhistory_replaces_recent(self):
+        self.trade(60, 100)
+        self.trade(130, 200)
+        self.gox.signal_fullhistory(self.gox, [
+            {'date': '125', 'price_int': '105', 'amount_int': '2'},
+            {'date': '190', 'price_int': '107', 'amount_int': '3'}])
+        self.assertEqual([60, 120, 180],
+            [candle.tim for candle in self.history.candles])
+        self.assertEqual(105, self.history.candle(1).cls)
+
+    def test_store_grows(self):
+        store = goxapi.CandleStore()
+        for tim in range(100):
+            store.append(goxapi.OHLCV(tim, 1, 2, 0, 1, tim))
+        self.assertEqual(100, len(store))
+        self.assertEqual(range(100), [candle.tim for candle in store])
+        self.assertEqual([97, 98, 99], list(store.column('vol', 3)))
+        store.update_last(5, 10)
+        self.assertEqual((5, 0, 5, 109), (store[-1].hig, store[-1].low,
+            store[-1].cls, store[-1].vol))
+        store.pop()
+        self.assertEqual(98, store[-1].tim)
+
+    @unittest.skipUnless(goxapi.numpy, 'numpy not available')
+    def test_numpy_columns(self):
+        self.trade(60, 100)
+        self.trade(130, 90)
+        columns = self.history.numpy_columns()
+        self.assertEqual([60, 120], list(columns['tim']))
+        self.trade(150, 80, 4)
+        self.assertEqual([100, 80], list(columns['cls']))
+        self.assertEqual([1, 5], list(columns['vol']))
+
+
+class TestMultiTimeframe(unittest.TestCase):
+
+    def setUp(self):
+        self.gox = FakeGox()
+        self.opened = []
+        self.history = goxapi.History(self.gox, 300, timeframes=[60, 900])
+        self.history.signal_new_candle.connect(self.slot_new_candle)
+
+    def slot_new_candle(self, dummy_history, timeframe):
+        self.opened.append(timeframe)
+
+    def trade(self, date, price, volume=1):
+        self.gox.signal_trade(self.gox, (date, price, volume, 'bid', False))
+
+    def test_trades(self):
+        for date, price in [(0, 100), (30, 120), (70, 90), (310, 95),
+                            (920, 101)]:
+            self.trade(date, price)
+        self.assertEqual([60, 300, 900, 60, 60, 300, 60, 300, 900],
+            self.opened)
+        self.assertEqual(4, self.history.length(60))
+        self.assertEqual(3, self.history.length())
+        self.assertEqual(2, self.history.length(900))
+        candle = self.history.candle(1, 900)
+        self.assertEqual((0, 100, 120, 90, 95, 4), (candle.tim, candle.opn,
+            candle.hig, candle.low, candle.cls, candle.vol))
+        self.assertEqual(900, self.history.last_candle(900).tim)
+        self.assertEqual(300, self.history.candle(1).tim)
+
+    def test_higher_timeframe_starts_later(self):
+        # the 15 minute store is still empty when the current 1 minute
+        # candle is continued, it must get all trades anyway
+        history = goxapi.History(self.gox, 60, timeframes=[900])
+        history.stores[60].append(goxapi.OHLCV(36420, 1, 1, 1, 1, 0))
+        for date, price in [(36420, 100), (36440, 110), (36450, 90),
+                            (36480, 105), (36690, 120)]:
+            self.trade(date, price)
+        self.assertEqual([36000], [c.tim for c in history.stores[900]])
+        candle = history.last_candle(900)
+        self.assertEqual((100, 120, 90, 120, 5), (candle.opn, candle.hig,
+            candle.low, candle.cls, candle.vol))
+        self.assertEqual([36420, 36480, 36660],
+            [c.tim for c in history.candles])
+
+    def test_stale_higher_timeframe(self):
+        history = goxapi.History(self.gox, 60, timeframes=[900])
+        history.stores[60].append(goxapi.OHLCV(36420, 1, 1, 1, 1, 1))
+        history.stores[900].append(goxapi.OHLCV(35100, 1, 1, 1, 1, 1))
+        self.trade(36430, 110)
+        self.assertEqual([35100, 36000],
+            [c.tim for c in history.stores[900]])
+        self.assertEqual(110, history.last_candle(900).opn)
+
+    def test_update_empty_store(self):
+        self.assertRaises(IndexError,
+            goxapi.CandleStore().update_last, 100, 1)
+
+    def test_fullhistory_merges(self):
+        self.trade(9000, 100)
+        self.gox.signal_fullhistory(self.gox, [
+            {'date': str(9000 + date), 'price_int': str(price),
+                'amount_int': '1'}
+            for date, price in [(10, 100), (70, 130), (400, 80), (950, 90)]])
+        self.assertEqual([9000, 9060, 9360, 9900],
+            [candle.tim for candle in self.history.stores[60]])
+        self.assertEqual([9000, 9300, 9900],
+            [candle.tim for candle in self.history.candles])
+        candle = self.history.candle(1, 900)
+        self.assertEqual((9000, 100, 130, 80, 80), (candle.tim, candle.opn,
+            candle.hig, candle.low, candle.cls))
+
+    def test_fullhistory_each_timeframe(self):
+        history = goxapi.History(FakeGox(), 900, 50, [60])
+        history.gox.signal_fullhistory(history.gox, [
+            {'date': str(90000 + 30 * i), 'price_int': str(100 + i % 7),
+                'amount_int': '1'} for i in range(3000)])
+        self.assertEqual(50, history.length(60))
+        self.assertEqual(50, history.length())
+        candle = history.candle(1)
+        self.assertEqual((178200, 30), (candle.tim, candle.vol))
+
+    def test_partial_leading_candle(self):
+        history = goxapi.History(FakeGox(), 60, timeframes=[3600])
+        history.gox.signal_fullhistory(history.gox, [
+            {'date': str(date), 'price_int': str(price), 'amount_int': '1'}
+            for date, price in [(9600, 149), (10700, 150), (10800, 166),
+                                (10900, 170)]])
+        self.assertEqual([9600, 10680, 10800, 10860],
+            [candle.tim for candle in history.candles])
+        self.assertEqual([7200, 10800], [c.tim for c in history.stores[3600]])
+        candle = history.last_candle(3600)
+        self.assertEqual((166, 170, 2), (candle.opn, candle.cls, candle.vol))
+
+        # an existing partial leading candle is kept as it is
+        history.gox.signal_fullhistory(history.gox, [
+            {'date': str(date), 'price_int': str(price), 'amount_int': '1'}
+            for date, price in [(10700, 150), (10800, 166), (10900, 170),
+                                (11000, 180)]])
+        candle = history.candle(1, 3600)
+        self.assertEqual((7200, 149, 150, 2), (candle.tim, candle.opn,
+            candle.cls, candle.vol))
+        self.assertEqual(3, history.last_candle(3600).vol)
+
+    def test_fullhistory_shorter_than_candle(self):
+        history = goxapi.History(FakeGox(), 900)
+        history.gox.signal_fullhistory(history.gox, [
+            {'date': str(date), 'price_int': str(price), 'amount_int': '1'}
+            for date, price in [(9100, 149), (9200, 150)]])
+        self.assertEqual([(9000, 149, 150, 2)], [(c.tim, c.opn, c.cls, c.vol)
+            for c in history.candles])
+
+    def test_invalid_timeframes(self):
+        self.assertRaises(ValueError, goxapi.History, FakeGox(), 300,
+            timeframes=[120])
+
+    def slot_debug(self, dummy_sender, (msg)):
+        self.messages.append(msg)
+
+    def test_invalid_config_reported(self):
+        self.messages = []
+        tmpdir = tempfile.mkdtemp()
+        config = goxapi.GoxConfig(os.path.join(tmpdir, 'test.ini'))
+        config.set('gox', 'history_timeframes', '7')
+        gox = goxapi.Gox(goxapi.Secret(config), config)
+        gox.timer_poll.cancel()
+        gox.client._timer.cancel()
+        gox.client.start = lambda: None # don't connect
+        gox.signal_debug.connect(self.slot_debug)
+        gox.start()
+        self.assertTrue(self.messages[0].startswith(
+            '### ignoring history_timeframes:'))
+        shutil.rmtree(tmpdir)
+
+
+class TestSlotRecv(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        config = goxapi.GoxConfig(os.path.join(self.tmpdir, 'test.ini'))
+        self.gox = goxapi.Gox(goxapi.Secret(config), config)
+        self.depth = []
+        self.depth_stamped = []
+        self.gox.signal_depth.connect(self.slot_depth)
+
+    def tearDown(self):
+        self.gox.timer_poll.cancel()
+        self.gox.client._timer.cancel()
+        shutil.rmtree(self.tmpdir)
+
+    def slot_depth(self, dummy_gox, data):
+        self.depth.append(data)
+
+    def slot_depth_stamped(self, dummy_gox, data):
+        self.depth_stamped.append(data)
+
+    def test_dispatch(self):
+        self.gox.slot_recv(None, depth_message('USD'))
+        self.assertEqual([('ask', 100, 2, 3)], self.depth)
+
+    def test_dispatch_stamped(self):
+        self.gox.signal_depth_stamped.connect(self.slot_depth_stamped)
+        self.gox.slot_recv(None, depth_message('USD'))
+        self.assertEqual([('ask', 100, 2, 3, 5000)], self.depth_stamped)
+
+    def request_partialdepth(self):
+        self.requests.append(time.time())
+
+    def test_resync_deferred(self):
+        self.requests = []
+        self.gox.client.request_partialdepth = self.request_partialdepth
+        interval = goxapi.DEPTH_RESYNC_INTERVAL
+        goxapi.DEPTH_RESYNC_INTERVAL = 0.1
+        try:
+            for dummy in range(3):
+                self.gox.slot_orderbook_resync(self.gox.orderbook, False)
+            self.assertEqual(1, len(self.requests))
+            time.sleep(0.3)
+            self.assertEqual(2, len(self.requests))
+        finally:
+            goxapi.DEPTH_RESYNC_INTERVAL = interval
+
+    def test_prefilter(self):
+        self.gox.slot_recv(None, depth_message('EUR'))
+        self.assertEqual(1, self.gox.count_prefiltered)
+        self.gox.slot_recv(None, depth_message('EUR', (', ', ': ')))
+        self.assertEqual(1, self.gox.count_prefiltered)
+        self.assertEqual([], self.depth)
+
+    def test_json_decoder(self):
+        self.assertEqual(json.loads, goxapi.json_decoder('json'))
+        self.assertEqual(json.loads, goxapi.json_decoder('no_such_module'))
+
+
+class TestFeedRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.basename = os.path.join(self.tmpdir, 'feed')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def record(self, count):
+        recorder = goxapi.FeedRecorder(self.basename)
+        recorder.record('fulldepth', fulldepth([(101, 1)], [(99, 2)]))
+        for i in range(count):
+            recorder.record('recv', '{"op":"private","n":%d}' % i)
+        recorder.close()
+        return recorder
+
+    def test_roundtrip(self):
+        recorder = self.record(100)
+        self.assertEqual(101, recorder.count_records)
+        self.assertEqual([recorder.filename],
+                         goxapi.feed_files(self.basename))
+        records = list(goxapi.FeedReader(recorder.filename).records())
+        self.assertEqual(101, len(records))
+        self.assertEqual('fulldepth', records[0][1])
+        self.assertEqual(fulldepth([(101, 1)], [(99, 2)]), records[0][2])
+        self.assertEqual(('recv', '{"op":"private","n":99}'), records[-1][1:])
+        times = [record[0] for record in records]
+        self.assertEqual(sorted(times), times)
+
+    def test_not_closed(self):
+        old_block_size = goxapi.FEED_BLOCK_SIZE
+        goxapi.FEED_BLOCK_SIZE = 100
+        try:
+            recorder = self.record(100)
+        finally:
+            goxapi.FEED_BLOCK_SIZE = old_block_size
+        reader = goxapi.FeedReader(recorder.filename)
+        blocks = reader.blocks(recorder.filename)
+        self.assertTrue(len(blocks) > 1)
+
+        # cut off the trailer and a part of the last index block
+        with open(recorder.filename, 'r+b') as feed_file:
+            feed_file.truncate(os.path.getsize(recorder.filename) - 20)
+        self.assertEqual([block[0] for block in blocks],
+            [block[0] for block in reader.blocks(recorder.filename)])
+        self.assertEqual(101, len(list(reader.records())))
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        basename = os.path.join(self.tmpdir, 'feed')
+        recorder = goxapi.FeedRecorder(basename)
+        message = fulldepth([(101, 10)], [(99, 5)])
+        message['data']['now'] = '1000'
+        recorder.record('fulldepth', message)
+        recorder.record('recv', depth_message('USD', volume=3))
+        recorder.close()
+
+        goxapi.FORCE_REPLAY = basename
+        goxapi.FORCE_REPLAY_SPEED = 0
+        config = goxapi.GoxConfig(os.path.join(self.tmpdir, 'test.ini'))
+        config.set('gox', 'use_event_loop', 'True')
+        self.gox = goxapi.Gox(goxapi.Secret(config), config)
+
+    def tearDown(self):
+        goxapi.FORCE_REPLAY = ''
+        goxapi.FORCE_REPLAY_SPEED = 1
+        self.gox.stop()
+        self.gox.timer_poll.cancel()
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay(self):
+        client = self.gox.client
+        self.assertTrue(isinstance(client, goxapi.ReplayClient))
+        self.gox.start()
+        self.assertTrue(client.finished.wait(5))
+        self.assertEqual(2, client.count_replayed)
+        self.assertEqual([(100, 3), (101, 10)], self.gox.orderbook.asks.pairs())
+        self.assertEqual(0, self.gox.orderbook.count_gaps)
+
+    def test_no_event_loop(self):
+        self.assertEqual(None, self.gox._loop)
+        self.assertEqual(None, self.gox.timer_poll._loop)
+
+    def test_no_timeout(self):
+        client = self.gox.client
+        client.connected = True
+        client._time_last_received = 0
+        client.slot_timer(None, None)
+        self.assertTrue(client.connected)
+
+
+def trades(*rows):
+    '''
+    Returns a list of trades like the one from money/trades,
+    rows are (tid, date, price, volume).
+    '''
+    return [{'tid': str(tid), 'date': date, 'price_int': str(price),
+        'amount_int': str(volume), 'trade_type': 'bid'}
+        for tid, date, price, volume in rows]
+
+
+class TestTradeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.history')
+        self.store = goxapi.TradeStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_only(self):
+        self.assertEqual(0, self.store.last_tid())
+        self.assertEqual(2, self.store.add_trades(trades(
+            (1, 100, 10, 1), (2, 130, 12, 2))))
+        self.assertEqual(1, self.store.add_trades(trades(
+            (2, 130, 12, 2), (3, 200, 11, 1))))
+        self.store.close()
+        self.store = goxapi.TradeStore(self.filename)
+        self.assertEqual(3, self.store.last_tid())
+        self.assertEqual(['2', '3'],
+            [trade['tid'] for trade in self.store.trades(130)])
+        self.assertEqual(['1'],
+            [trade['tid'] for trade in self.store.trades(0, 130)])
+
+    def test_candles(self):
+        self.store.add_trades(trades((1, 100, 10, 1), (2, 110, 14, 2),
+            (3, 115, 8, 1), (4, 119, 9, 3), (5, 130, 11, 1)))
+        candles = self.store.candles(60, 90)
+        self.assertEqual([(60, 10, 14, 8, 9, 7), (120, 11, 11, 11, 11, 1)],
+            [(c.tim, c.opn, c.hig, c.low, c.cls, c.vol) for c in candles])
+        self.assertEqual([120], [c.tim for c in self.store.candles(60, 120)])
+
+
+class TestGoxTradeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = goxapi.GoxConfig(os.path.join(self.tmpdir, 'test.ini'))
+        self.config.set('gox', 'history_store', 'True')
+        self.config.set('gox', 'history_timeframe', '1')
+        self.gox = self.make_gox()
+
+    def tearDown(self):
+        self.gox.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def make_gox(self):
+        gox = goxapi.Gox(goxapi.Secret(self.config), self.config)
+        gox.timer_poll.cancel()
+        gox.client._timer.cancel()
+        return gox
+
+    def test_incremental(self):
+        now = int(time.time()) // 60 * 60
+        client = self.gox.client
+        client.signal_fullhistory(client, trades(
+            (1, now - 120, 10, 1), (2, now, 12, 1)))
+        self.assertEqual(2, client.history_since_tid)
+        # only the new trade arrives, the current candle keeps the old one
+        client.signal_fullhistory(client, trades((3, now + 5, 15, 1)))
+        self.assertEqual(3, client.history_since_tid)
+        candle = self.gox.history.last_candle()
+        self.assertEqual((now, 12, 15, 15), (candle.tim, candle.opn,
+            candle.hig, candle.cls))
+
+        self.gox.stop()
+        self.gox = self.make_gox()
+        self.assertEqual(3, self.gox.client.history_since_tid)
+        self.assertEqual([now - 120, now],
+            [c.tim for c in self.gox.history.candles])
+
+    def test_load_limited(self):
+        now = int(time.time()) // 60 * 60
+        rows = [(tid, now - 540 + tid * 60, 10 + tid, 1) for tid in range(10)]
+        client = self.gox.client
+        client.signal_fullhistory(client, trades(*rows))
+        self.gox.stop()
+        self.config.set('gox', 'history_max_candles', '2')
+        self.config.set('gox', 'history_timeframes', '5')
+        self.gox = self.make_gox()
+        history = self.gox.history
+        self.assertEqual([now - 60, now], [c.tim for c in history.candles])
+        current = [row for row in rows if row[1] >= now // 300 * 300]
+        candle = history.last_candle(300)
+        self.assertEqual((now // 300 * 300, current[0][2], len(current)),
+            (candle.tim, candle.opn, candle.vol))
+        self.assertEqual(2, history.length(300))
+
+        # a new trade rebuilds the current candle of every timeframe
+        client = self.gox.client
+        client.signal_fullhistory(client, trades((10, now + 1, 30, 2)))
+        candle = history.last_candle(300)
+        self.assertEqual((current[0][2], 30, len(current) + 2),
+            (candle.opn, candle.hig, candle.vol))
+        candle = history.last_candle()
+        self.assertEqual((now, 19, 30, 3),
+            (candle.tim, candle.opn, candle.hig, candle.vol))
+
+    def test_broken_database(self):
+        filename = self.gox.trade_store.filename
+        self.gox.stop()
+        with open(filename, 'wb') as broken:
+            broken.write('this is not a database' * 100)
+        self.gox = self.make_gox()
+        self.assertEqual(None, self.gox.trade_store)
+        self.assertTrue(any('not using history_store' in str(args)
+            for args in self.gox._startup_messages))
+        # the history still gets the trades, just not stored
+        now = int(time.time()) // 60 * 60
+        client = self.gox.client
+        client.signal_fullhistory(client, trades((1, now, 12, 1)))
+        self.assertEqual(now, self.gox.history.last_candle().tim)
+
+
+class TestSignalQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.signal = goxapi.Signal()
+        self.queue = goxapi.SignalQueue('test', maxlen=2)
+        self.received = []
+        self.release = threading.Event()
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def slot(self, dummy_sender, data):
+        self.release.wait(5)
+        self.received.append((data, threading.current_thread()))
+        if data == 'last':
+            self.done.set()
+
+    def test_delivered_in_order_on_worker(self):
+        self.queue.maxlen = 10
+        self.queue.connect(self.signal, self.slot)
+        self.release.set()
+        for data in ['a', 'b', 'last']:
+            self.signal(self, data)
+        self.done.wait(5)
+        self.assertEqual(['a', 'b', 'last'], [x[0] for x in self.received])
+        self.assertNotEqual(threading.current_thread(), self.received[0][1])
+
+    def test_drops_oldest_when_full(self):
+        self.queue.connect(self.signal, self.slot)
+        self.signal(self, 'first')
+        while self.queue.depth():
+            pass # wait until the worker is blocked in slot('first')
+        for data in ['b', 'c', 'd', 'last']:
+            self.signal(self, data)
+        self.release.set()
+        self.done.wait(5)
+        self.assertEqual(['first', 'd', 'last'],
+            [x[0] for x in self.received])
+        self.assertEqual(2, self.queue.stats()['dropped'])
+
+    def test_forget_dead_slots(self):
+        other = goxapi.BaseObject()
+        self.queue.connect(self.signal, other.debug)
+        del other
+        self.queue.connect(self.signal, self.slot)
+        self.assertEqual(1, len(self.queue._proxies))
+
+    def test_stop_waits_for_slot(self):
+        self.queue.connect(self.signal, self.slot)
+        self.signal(self, 'last')
+        while self.queue.depth():
+            pass # wait until the worker is blocked in the slot
+        threading.Timer(0.05, self.release.set).start()
+        self.queue.stop()
+        self.assertEqual(['last'], [x[0] for x in self.received])
+
+    def test_drop_object_with_del(self):
+        # releasing a dropped call can emit a signal again (__del__)
+        self.queue.connect(self.signal, self.slot)
+        self.signal(self, 'first')
+        while self.queue.depth():
+            pass # wait until the worker is blocked in slot('first')
+        def drop_and_stop():
+            for dummy in range(3): # the third one drops the first one
+                self.signal(self, EmitOnDel(self.signal))
+            self.release.set()
+            self.queue.stop()
+        thread = threading.Thread(target=drop_and_stop)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+class EmitOnDel(object):
+
+    def __init__(self, signal):
+        self.signal = signal
+
+    def __del__(self):
+        self.signal(self, 'deleted')
+
+
+class TestSignalProfiler(unittest.TestCase):
+
+    def tearDown(self):
+        goxapi.Signal.profiler = None
+
+    def slot(self, dummy_sender, dummy_data):
+        pass
+
+    def test_records_slot_calls(self):
+        holder = FakeGox()
+        holder.signal_depth.connect(self.slot)
+        profiler = goxapi.SignalProfiler()
+        profiler.name_signals(holder, 'gox')
+        goxapi.Signal.profiler = profiler
+        for dummy in range(3):
+            holder.signal_depth(holder, None)
+        goxapi.Signal.profiler = None
+        holder.signal_depth(holder, None)
+
+        stats = profiler.get_stats()
+        self.assertEqual(1, len(stats))
+        self.assertEqual('gox.signal_depth', stats[0]['signal'])
+        self.assertEqual('TestSignalProfiler.slot', stats[0]['slot'])
+        self.assertEqual(3, stats[0]['count'])
+        self.assertEqual(3, sum(stats[0]['histogram']))
+
+
+class FakeConfig(object):
+
+    def get_bool(self, dummy_sect, dummy_opt):
+        return False
+
+    def get_int(self, dummy_sect, dummy_opt):
+        return 0
+
+    def get_string(self, dummy_sect, dummy_opt):
+        return ''
+
+
+class PairClient(goxapi.WebsocketClient):
+    '''
+    WebsocketClient that connects to one end of a socket pair.
+    '''
+
+    def __init__(self, loop):
+        goxapi.WebsocketClient.__init__(self, 'USD', None, FakeConfig(), loop)
+        self.server = None
+
+    def _connect_socket(self):
+        self.server, client = socket.socketpair()
+        self.socket = websocket.WebSocket()
+        self.socket.sock.close()
+        self.socket.io_sock = self.socket.sock = client
+
+
+class TestEventLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = goxapi.EventLoop()
+        self.loop.start()
+        self.calls = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def call(self, name):
+        self.calls.append(name)
+        if name == 'last':
+            self.done.set()
+
+    def test_timers_in_order(self):
+        self.loop.call_later(0.02, lambda: self.call('last'))
+        self.loop.call_later(0.01, lambda: self.call('b'))
+        self.loop.call_later(0.005, lambda: self.call('cancelled')).cancel()
+        self.loop.call_soon_threadsafe(lambda: self.call('a'))
+        self.done.wait(5)
+        self.assertEqual(['a', 'b', 'last'], self.calls)
+
+    def slot_recv(self, dummy_sender, data):
+        self.call(data[1:-1])
+
+    def test_client_on_loop(self):
+        frames = '\x81\x03{a}\x81\x06{last}'
+        client = PairClient(self.loop)
+        client.signal_recv.connect(self.slot_recv)
+        client.start()
+        for dummy in range(5000):
+            if client.connected:
+                break
+            time.sleep(0.001)
+        client.server.sendall(frames[:7])
+        time.sleep(0.01)
+        client.server.sendall(frames[7:])
+        self.done.wait(5)
+        client.stop()
+        self.assertEqual(['a', 'last'], self.calls)
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.path
+        if self.headers.get('Accept-Encoding') == 'gzip':
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as zipped:
+                zipped.write(body)
+            body = buf.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/drop':
+            # pretend to keep the connection but then close it
+            self.close_connection = 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                KeepAliveHandler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = goxapi.HTTPConnectionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        self.assertEqual((200, '/a?x=1'), self.pool.request(self.url + '/a?x=1'))
+        self.assertEqual((200, 'x=2'), self.pool.request(self.url + '/', 'x=2'))
+        self.assertEqual((200, '/b'), self.pool.request(self.url + '/b'))
+        stats = self.pool.stats()
+        self.assertEqual((3, 2, 1), (stats['requests'], stats['reused'],
+                                     stats['handshakes']))
+
+    def test_discard_closed(self):
+        self.pool.request(self.url + '/drop')
+        time.sleep(0.1)
+        self.assertEqual((200, 'x=3'), self.pool.request(self.url + '/', 'x=3'))
+        stats = self.pool.stats()
+        self.assertEqual((0, 0, 2), (stats['retries'], stats['reused'],
+                                     stats['handshakes']))
+
+    def test_retry_stale(self):
+        # closed right after the check, too late to be noticed
+        self.pool._is_alive = lambda conn: True
+        self.pool.request(self.url + '/drop')
+        self.assertEqual((200, '/c'), self.pool.request(self.url + '/c'))
+        stats = self.pool.stats()
+        self.assertEqual((1, 2), (stats['retries'], stats['handshakes']))
+
+    def test_no_retry_post(self):
+        self.pool._is_alive = lambda conn: True
+        self.pool.request(self.url + '/drop')
+        self.assertRaises((httplib.HTTPException, socket.error),
+            self.pool.request, self.url + '/', 'x=3')
+        self.assertEqual(0, self.pool.stats()['retries'])
+
+
+class TestHTTPQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        config = goxapi.GoxConfig(os.path.join(self.tmpdir, 'test.ini'))
+        config.set('gox', 'http_endpoint_concurrency', '2')
+        self.client = goxapi.BaseClient('USD', goxapi.Secret(config), config)
+        self.client._timer.cancel()
+        self.client.http_signed_call = self.http_signed_call
+        self.client.signal_recv.connect(self.slot_recv)
+        self.client.signal_debug.connect(self.slot_debug)
+        self.lock = threading.Lock()
+        self.calls = []
+        self.received = []
+        self.messages = []
+        self.failures = 0
+        self.running = {}
+        self.max_running = {}
+        self.max_total = 0
+        self.retry_delay = goxapi.HTTP_RETRY_DELAY
+        goxapi.HTTP_RETRY_DELAY = 0.001
+
+    def tearDown(self):
+        goxapi.HTTP_RETRY_DELAY = self.retry_delay
+        self.client._terminating = True
+        shutil.rmtree(self.tmpdir)
+
+    def start_workers(self, count):
+        for dummy in range(count):
+            goxapi.start_thread(self.client._http_thread_func)
+
+    def http_signed_call(self, api_endpoint, params):
+        with self.lock:
+            self.calls.append(api_endpoint)
+            self.running[api_endpoint] = self.running.get(api_endpoint, 0) + 1
+            self.max_running[api_endpoint] = max(self.running[api_endpoint],
+                self.max_running.get(api_endpoint, 0))
+            self.max_total = max(self.max_total, sum(self.running.values()))
+            fail = len(self.calls) <= self.failures
+        time.sleep(0.02)
+        with self.lock:
+            self.running[api_endpoint] -= 1
+        if fail:
+            return {'result': 'error', 'error': 'Invalid nonce'}
+        return {'result': 'success', 'data': params}
+
+    def slot_recv(self, dummy_sender, data):
+        self.received.append(json.loads(data))
+
+    def slot_debug(self, dummy_sender, (msg)):
+        self.messages.append(msg)
+
+    def wait_for(self, condition):
+        timeout = time.time() + 5
+        while not condition() and time.time() < timeout:
+            time.sleep(0.005)
+
+    def test_retry(self):
+        self.failures = 2
+        self.start_workers(1)
+        self.client.http_requests.put(('money/order/add', {'x': 1}, 'add', 0))
+        self.wait_for(lambda: self.received)
+        self.assertEqual(3, len(self.calls))
+        self.assertEqual([{'op': 'result', 'id': 'add', 'result': {'x': 1}}],
+            self.received)
+
+    def test_give_up(self):
+        self.failures = 1000
+        self.start_workers(1)
+        self.client.http_requests.put(('money/order/add', {}, 'add', 0))
+        self.wait_for(lambda: any('giving up' in msg for msg in self.messages))
+        time.sleep(0.05)
+        self.assertEqual(1 + goxapi.HTTP_MAX_RETRIES, len(self.calls))
+        self.assertEqual([], self.received)
+
+    def test_endpoint_limit(self):
+        self.client.http_requests.put(('money/info', {}, 'info', 0))
+        for reqid in range(6):
+            self.client.http_requests.put(('money/order/add', {}, reqid, 0))
+        self.start_workers(4)
+        self.wait_for(lambda: len(self.received) == 7)
+        self.assertEqual(7, len(self.received))
+        self.assertEqual(2, self.max_running['money/order/add'])
+        self.assertEqual(3, self.max_total)
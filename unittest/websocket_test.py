@@ -0,0 +1,82 @@
+import os
+import socket
+import struct
+import threading
+import unittest
+import websocket
+
+
+def text_frame(payload):
+    '''
+    Returns an unmasked server-to-client text frame.
+    '''
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x81, len(payload))
+    elif len(payload) < 0x10000:
+        header = struct.pack('!BBH', 0x81, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x81, 127, len(payload))
+    return header + payload
+
+
+class TestReceive(unittest.TestCase):
+
+    def setUp(self):
+        self.server, client = socket.socketpair()
+        self.ws = websocket.WebSocket()
+        self.ws.sock.close()
+        self.ws.io_sock = self.ws.sock = client
+
+    def tearDown(self):
+        self.server.close()
+        self.ws.sock.close()
+
+    def test_lines_then_frames(self):
+        self.server.sendall('HTTP/1.1 101 Switching\r\nUpgrade: websocket\r\n'
+                            '\r\n' + text_frame('hello') + text_frame('world'))
+        self.assertEqual(101, self.ws._read_headers()[0])
+        self.assertEqual('hello', self.ws.recv())
+        self.assertEqual('world', self.ws.recv())
+
+    def test_large_frame(self):
+        payload = 'x' * 300000
+        sender = threading.Thread(target=self.server.sendall,
+            args=(text_frame(payload) + text_frame('next'),))
+        sender.start()
+        self.assertEqual(payload, self.ws.recv())
+        sender.join()
+        self.assertEqual('next', self.ws.recv())
+
+    def test_data_view(self):
+        self.server.sendall(text_frame('4::/mtgox:{}') + text_frame('next'))
+        opcode, view = self.ws.recv_data_view()
+        self.assertEqual(websocket.ABNF.OPCODE_TEXT, opcode)
+        self.assertEqual('{}', view[10:].tobytes())
+        self.assertEqual('next', self.ws.recv())
+
+    def test_closed(self):
+        self.server.sendall('partial line')
+        self.server.close()
+        self.assertRaises(websocket.WebSocketConnectionClosedException,
+                          self.ws._recv_line)
+
+
+class TestMask(unittest.TestCase):
+
+    def check(self, func):
+        for length in [0, 1, 3, 4, 5, 17, 100, 1001]:
+            data = os.urandom(length)
+            key = os.urandom(4)
+            expected = websocket._mask_loop(key, data)
+            self.assertEqual(expected, func(key, data))
+            self.assertEqual(data, func(key, expected))
+
+    def test_mask(self):
+        self.check(websocket.ABNF.mask)
+
+    def test_mask_long(self):
+        self.check(websocket._mask_long)
+
+    @unittest.skipUnless(websocket.numpy, 'numpy not available')
+    def test_mask_numpy(self):
+        self.check(websocket._mask_numpy)